@@ -22,14 +22,91 @@ REPO_NOTE_PKG = 'win-repo'
 # Importer configuration key names
 CONFIG_COPY_CHILDREN                = 'copy_children'
 CONFIG_MAX_SPEED                    = 'max_speed'
+# Bytes per second shared by all the syncs with the same scope (cluster or
+# host), each drawing with its priority; unset means no shared limit
+CONFIG_BANDWIDTH_LIMIT              = 'bandwidth_limit'
+CONFIG_BANDWIDTH_SCOPE              = 'bandwidth_scope'
+CONFIG_BANDWIDTH_SCOPE_DEFAULT      = 'cluster'
+CONFIG_BANDWIDTH_PRIORITY           = 'bandwidth_priority'
+CONFIG_BANDWIDTH_PRIORITY_DEFAULT   = 1.0
 CONFIG_NUM_THREADS                  = 'num_threads'
 CONFIG_NUM_THREADS_DEFAULT          = 5
+# Adjust the number of downloads in flight between min_threads and
+# max_threads from the observed throughput and errors; num_threads is where
+# it starts
+CONFIG_ADAPTIVE_CONCURRENCY         = 'adaptive_concurrency'
+CONFIG_ADAPTIVE_CONCURRENCY_DEFAULT = False
+CONFIG_MIN_THREADS                  = 'min_threads'
+CONFIG_MIN_THREADS_DEFAULT          = 1
+CONFIG_MAX_THREADS                  = 'max_threads'
+CONFIG_MAX_THREADS_DEFAULT          = 20
+# Order in which packages are downloaded: feed, largest_first or lpt
+# (see importers.schedule), and how many of the smallest packages follow
+# each large one
+CONFIG_DOWNLOAD_ORDER               = 'download_order'
+CONFIG_DOWNLOAD_ORDER_DEFAULT       = 'feed'
+CONFIG_INTERLEAVE_SMALL             = 'interleave_small'
+CONFIG_INTERLEAVE_SMALL_DEFAULT     = 0
+# Leave the packages another sync is already downloading to it, and only
+# associate them once it saved them
+CONFIG_DEDUPE_DOWNLOADS             = 'dedupe_downloads'
+CONFIG_DEDUPE_DOWNLOADS_DEFAULT     = False
 CONFIG_REMOVE_MISSING_UNITS         = 'remove_missing_units'
 CONFIG_REMOVE_MISSING_UNITS_DEFAULT = False
+# Maximum number of entries in the metadata extraction cache; 0 disables it
+CONFIG_METADATA_CACHE_SIZE          = 'metadata_cache_size'
+CONFIG_METADATA_CACHE_SIZE_DEFAULT  = 10000
+# Threads verifying, extracting and saving downloaded packages; 0 does it in
+# the downloader's threads
+CONFIG_POST_DOWNLOAD_WORKERS        = 'post_download_workers'
+CONFIG_POST_DOWNLOAD_WORKERS_DEFAULT = 4
+# Use the metadata from primary.xml for packages that pass the sha256 check,
+# instead of extracting it again, if the feed provides every field (see
+# Package.EXTRACTED_FIELDS); a fraction of them is still extracted to notice
+# a feed that does not match its packages
+CONFIG_TRUST_UPSTREAM_METADATA      = 'trust_upstream_metadata'
+CONFIG_TRUST_UPSTREAM_METADATA_DEFAULT = False
+CONFIG_TRUST_SAMPLE_RATE            = 'trust_sample_rate'
+CONFIG_TRUST_SAMPLE_RATE_DEFAULT    = 0.01
+# Process the package list even if upstream did not change since the last
+# successful sync
+CONFIG_FORCE_FULL_SYNC              = 'force_full'
+# Number of mirrors of a mirror list whose repomd.xml is fetched at once,
+# the fastest valid one being used; 1 tries them one after another
+CONFIG_MIRROR_RACE_COUNT            = 'mirror_race_count'
+CONFIG_MIRROR_RACE_COUNT_DEFAULT    = 1
+# Where interrupted downloads are kept for the next sync to resume, and
+# when they are discarded; a maximum size of 0 disables resuming
+CONFIG_PARTIAL_DIR                  = 'partial_download_dir'
+CONFIG_PARTIAL_MAX_AGE              = 'partial_max_age'
+CONFIG_PARTIAL_MAX_AGE_DEFAULT      = 7 * 24 * 3600
+CONFIG_PARTIAL_MAX_SIZE             = 'partial_max_size'
+CONFIG_PARTIAL_MAX_SIZE_DEFAULT     = 10 * 1024 ** 3
+# Packages of at least segment_threshold bytes are downloaded as
+# segment_count ranges at once; a threshold of 0, the default, disables it
+CONFIG_SEGMENT_THRESHOLD            = 'segment_threshold'
+CONFIG_SEGMENT_THRESHOLD_DEFAULT    = 0
+CONFIG_SEGMENT_COUNT                = 'segment_count'
+CONFIG_SEGMENT_COUNT_DEFAULT        = 4
+# Packages of a local (file://) feed may be hard linked into storage,
+# rather than copied, when reflinks are not supported. Only for feeds whose
+# files are never modified or replaced in place
+CONFIG_HARDLINK_LOCAL               = 'hardlink_local'
+CONFIG_HARDLINK_LOCAL_DEFAULT       = False
+# Progress updates are written at most every progress_interval seconds,
+# unless progress_batch of them were held back; state changes are always
+# written. An interval of 0 writes every update
+CONFIG_PROGRESS_INTERVAL            = 'progress_interval'
+CONFIG_PROGRESS_INTERVAL_DEFAULT    = 2.0
+CONFIG_PROGRESS_BATCH               = 'progress_batch'
+CONFIG_PROGRESS_BATCH_DEFAULT       = 1000
 
 # Distributor configuration key names
 CONFIG_SERVE_HTTP      = 'serve_http'
 CONFIG_SERVE_HTTPS     = 'serve_https'
+CONFIG_CHECKSUM_TYPE   = 'checksum_type'
+
+CONFIG_CHECKSUM_TYPE_DEFAULT = 'sha256'
 
 DEFAULT_SERVE_HTTP = False
 DEFAULT_SERVE_HTTPS = True
@@ -0,0 +1,206 @@
+"""
+Bandwidth budget shared by concurrent syncs.
+
+max_speed throttles each sync on its own, so the total grows with the
+number of syncs running. Here all syncs draw from one token bucket, stored
+in Mongo so that every worker sees it: one per cluster, or one per host.
+
+Each sync leases tokens in chunks and spends them locally, so the database
+is only involved every tenth of a second's worth of tokens. Syncs with a
+higher priority lease larger chunks and ask again sooner, which gives them
+a share of a saturated link that grows with their priority.
+
+The first sync to use a bucket sets its rate and burst; syncs configured
+differently warn about it, but draw from the bucket as it is.
+"""
+import logging
+import socket
+import threading
+import time
+
+import mongoengine
+from pymongo import ReturnDocument
+
+from pulp_win.common import constants
+
+_LOGGER = logging.getLogger(__name__)
+
+SCOPE_CLUSTER = 'cluster'
+SCOPE_HOST = 'host'
+
+
+class BandwidthBucket(mongoengine.Document):
+    name = mongoengine.StringField(primary_key=True)
+    # Bytes per second, and the most tokens the bucket holds
+    rate = mongoengine.FloatField(required=True)
+    burst = mongoengine.FloatField(required=True)
+    tokens = mongoengine.FloatField(default=0)
+    # time.time() of the last refill
+    updated = mongoengine.FloatField(default=0)
+
+    meta = dict(collection='win_bandwidth_buckets', allow_inheritance=False)
+
+
+def _refill(tokens, updated, rate, burst, now):
+    return min(burst, tokens + max(0, now - updated) * rate)
+
+
+def _check_settings(name, bucket, rate, burst):
+    if (bucket['rate'], bucket['burst']) != (rate, burst):
+        _LOGGER.warning(
+            "Bandwidth bucket %s has a rate of %s and a burst of %s, "
+            "not %s and %s", name, bucket['rate'], bucket['burst'],
+            rate, burst)
+
+
+class MemoryBucketStore(object):
+    """
+    Token buckets shared by the threads of this process only.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = dict()
+
+    def configure(self, name, rate, burst):
+        with self._lock:
+            bucket = self._buckets.setdefault(name, dict(
+                rate=rate, burst=burst, tokens=0, updated=0))
+        _check_settings(name, bucket, rate, burst)
+
+    def take(self, name, amount, now):
+        """
+        Take up to amount tokens.
+
+        :return: number of tokens taken, possibly 0
+        :rtype: float
+        """
+        with self._lock:
+            bucket = self._buckets[name]
+            tokens = _refill(bucket['tokens'], bucket['updated'],
+                             bucket['rate'], bucket['burst'], now)
+            granted = max(0, min(amount, tokens))
+            bucket.update(tokens=tokens - granted, updated=now)
+            return granted
+
+
+class MongoBucketStore(object):
+    """
+    Token buckets in the database, updated with compare-and-set so that
+    concurrent syncs never spend the same tokens.
+    """
+    MAX_RETRIES = 10
+
+    def __init__(self):
+        # Settings of the buckets, to create them again if they get removed
+        self._settings = dict()
+
+    def configure(self, name, rate, burst):
+        self._settings[name] = (rate, burst)
+        bucket = BandwidthBucket._get_collection().find_one_and_update(
+            {'_id': name},
+            {'$setOnInsert': dict(rate=rate, burst=burst, tokens=0.0,
+                                  updated=0.0)},
+            upsert=True, return_document=ReturnDocument.AFTER)
+        _check_settings(name, bucket, rate, burst)
+
+    def take(self, name, amount, now):
+        collection = BandwidthBucket._get_collection()
+        for _ in range(self.MAX_RETRIES):
+            doc = collection.find_one({'_id': name})
+            if doc is None:
+                _LOGGER.warning("Bandwidth bucket %s is gone, creating it "
+                                "again", name)
+                self.configure(name, *self._settings[name])
+                continue
+            tokens = _refill(doc['tokens'], doc['updated'], doc['rate'],
+                             doc['burst'], now)
+            granted = max(0, min(amount, tokens))
+            result = collection.update_one(
+                {'_id': name, 'tokens': doc['tokens'],
+                 'updated': doc['updated']},
+                {'$set': dict(tokens=tokens - granted, updated=now)})
+            if result.modified_count:
+                return granted
+        # Too much contention, try again later
+        return 0
+
+
+class BandwidthLimiter(object):
+    # Seconds worth of tokens leased at once, at priority 1, and the least
+    # number of bytes leased
+    LEASE_TIME = 0.1
+    LEASE_SIZE = 64 * 1024
+    # Longest wait between two attempts to lease tokens
+    MAX_WAIT = 1.0
+
+    def __init__(self, store, name, rate, burst=None, priority=1.0,
+                 clock=time.time, sleep=time.sleep):
+        """
+        :param store: MongoBucketStore or MemoryBucketStore
+        :param name: bucket to draw from
+        :type  name: str
+        :param rate: bytes per second for all the syncs using the bucket
+        :type  rate: float
+        :param priority: weight of this sync against the others
+        :type  priority: float
+        """
+        if rate <= 0 or priority <= 0:
+            raise ValueError("Rate and priority must be positive")
+        self.store = store
+        self.name = name
+        self.rate = float(rate)
+        self.priority = float(priority)
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._leased = 0
+        burst = burst or max(self.rate, 2 * self.lease_size)
+        store.configure(name, self.rate, float(burst))
+
+    @property
+    def lease_size(self):
+        """
+        Bytes leased at once, at priority 1.
+        """
+        return max(self.LEASE_SIZE, self.rate * self.LEASE_TIME)
+
+    @classmethod
+    def from_config(cls, config, store=None):
+        """
+        :return: the limiter configured for the importer, or None if there
+                 is no shared bandwidth limit
+        :rtype: BandwidthLimiter
+        """
+        rate = float(config.get(constants.CONFIG_BANDWIDTH_LIMIT) or 0)
+        if rate <= 0:
+            return None
+        scope = config.get(constants.CONFIG_BANDWIDTH_SCOPE,
+                           constants.CONFIG_BANDWIDTH_SCOPE_DEFAULT)
+        if scope == SCOPE_HOST:
+            name = '%s:%s' % (SCOPE_HOST, socket.getfqdn())
+        else:
+            name = SCOPE_CLUSTER
+        priority = float(config.get(
+            constants.CONFIG_BANDWIDTH_PRIORITY,
+            constants.CONFIG_BANDWIDTH_PRIORITY_DEFAULT))
+        return cls(store or MongoBucketStore(), name, rate,
+                   priority=priority)
+
+    def consume(self, size):
+        """
+        Wait until size more bytes may be transferred.
+        """
+        lease = self.lease_size * self.priority
+        while size > 0:
+            with self._lock:
+                if self._leased <= 0:
+                    self._leased += self.store.take(self.name, lease,
+                                                    self.clock())
+                spent = min(size, self._leased)
+                self._leased -= spent
+                size -= spent
+            if size > 0 and spent <= 0:
+                # Until a lease worth of tokens comes back, sooner for
+                # higher priorities
+                self.sleep(min(self.MAX_WAIT,
+                               self.lease_size / self.rate / self.priority))
@@ -0,0 +1,155 @@
+"""
+Content-addressed cache of extracted package metadata.
+
+Extracting metadata is pointless when the very same bytes were already seen,
+e.g. when a package is uploaded again, synced into another repository, or
+downloaded again after a failed sync. Entries are keyed by unit type and
+sha256, and the least recently used ones are evicted once the cache grows
+past its configured size. The size is only checked every EVICT_INTERVAL
+puts, so the cache may briefly hold a few more entries than configured.
+
+Entries record the METADATA_VERSION they were extracted with; those from
+another version are misses, and get replaced.
+
+Hits and misses are counted in memory, and only added to the persistent
+counters by flush(), once per sync or upload.
+"""
+import datetime
+import itertools
+import logging
+import threading
+
+import mongoengine
+
+from pulp_win.common import constants
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class MetadataCacheEntry(mongoengine.Document):
+    # <type id>:<sha256>
+    key = mongoengine.StringField(primary_key=True)
+    # MetadataCache.METADATA_VERSION
+    version = mongoengine.IntField()
+    metadata = mongoengine.DictField(required=True)
+    last_used = mongoengine.DateTimeField(required=True)
+
+    meta = dict(collection='win_metadata_cache', indexes=['last_used'],
+                allow_inheritance=False)
+
+
+class MetadataCacheStats(mongoengine.Document):
+    # A single document holds the counters for all pulp processes
+    name = mongoengine.StringField(primary_key=True)
+    hits = mongoengine.IntField(default=0)
+    misses = mongoengine.IntField(default=0)
+    evictions = mongoengine.IntField(default=0)
+
+    meta = dict(collection='win_metadata_cache_stats',
+                allow_inheritance=False)
+
+    STATS_NAME = 'metadata_cache'
+
+
+class MetadataCache(object):
+    # Number of puts between two checks of the cache size
+    EVICT_INTERVAL = 100
+    # Bumped whenever extraction changes what it returns, e.g. when a field
+    # is added or was read wrong
+    METADATA_VERSION = 1
+
+    def __init__(self,
+                 max_entries=constants.CONFIG_METADATA_CACHE_SIZE_DEFAULT):
+        self.max_entries = max_entries
+        # Shared by the threads processing downloads
+        self._puts = itertools.count()
+        self._lock = threading.Lock()
+        # Counters for this instance only; the persistent ones are in
+        # MetadataCacheStats
+        self.hits = 0
+        self.misses = 0
+        # Not yet added to the persistent counters
+        self._unflushed = dict(hits=0, misses=0, evictions=0)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Return a cache sized according to the importer configuration, or None
+        if the cache is disabled.
+        """
+        max_entries = int(config.get(
+            constants.CONFIG_METADATA_CACHE_SIZE,
+            constants.CONFIG_METADATA_CACHE_SIZE_DEFAULT))
+        if max_entries <= 0:
+            return None
+        return cls(max_entries)
+
+    @classmethod
+    def _key(cls, type_id, checksum):
+        return '%s:%s' % (type_id, checksum)
+
+    def get(self, type_id, checksum):
+        """
+        Return the metadata previously stored for this content, or None.
+        """
+        entry = MetadataCacheEntry.objects(
+            key=self._key(type_id, checksum),
+            version=self.METADATA_VERSION).modify(
+                set__last_used=datetime.datetime.utcnow())
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                self._unflushed['misses'] += 1
+                return None
+            self.hits += 1
+            self._unflushed['hits'] += 1
+        return dict(entry.metadata)
+
+    def put(self, type_id, checksum, metadata):
+        MetadataCacheEntry(key=self._key(type_id, checksum),
+                           version=self.METADATA_VERSION,
+                           metadata=metadata,
+                           last_used=datetime.datetime.utcnow()).save()
+        # The first put checks too, so that short syncs still evict
+        if next(self._puts) % self.EVICT_INTERVAL == 0:
+            self._evict()
+
+    def _evict(self):
+        excess = MetadataCacheEntry.objects.count() - self.max_entries
+        if excess <= 0:
+            return
+        keys = [e.key for e in MetadataCacheEntry.objects.order_by(
+            'last_used').only('key').limit(excess)]
+        MetadataCacheEntry.objects(key__in=keys).delete()
+        with self._lock:
+            self._unflushed['evictions'] += len(keys)
+        _LOGGER.debug("Evicted %d entries from the metadata cache",
+                      len(keys))
+
+    def flush(self):
+        """
+        Add the counts since the last flush to the persistent counters, with
+        a single write.
+        """
+        with self._lock:
+            counts = self._unflushed
+            self._unflushed = dict(hits=0, misses=0, evictions=0)
+        update = dict(('inc__%s' % name, count)
+                      for name, count in counts.items() if count)
+        if not update:
+            return
+        MetadataCacheStats.objects(
+            name=MetadataCacheStats.STATS_NAME).update_one(
+                upsert=True, **update)
+
+    @classmethod
+    def stats(cls):
+        """
+        Return the persistent counters, shared by all pulp processes.
+        """
+        stats = MetadataCacheStats.objects(
+            name=MetadataCacheStats.STATS_NAME).first()
+        if stats is None:
+            return dict(hits=0, misses=0, evictions=0)
+        return dict(hits=stats.hits, misses=stats.misses,
+                    evictions=stats.evictions)
@@ -0,0 +1,148 @@
+"""
+Registry of the packages being downloaded, shared by all syncs.
+
+Repositories often mirror overlapping feeds, and syncs running at the same
+time would download the same packages. Before downloading, a sync claims
+the checksums of its packages here; the packages another sync already
+claimed are left to it, and only associated once that sync saved them.
+
+Claims expire unless their owner keeps refreshing them, so that a sync
+that died does not hold on to its packages.
+"""
+import datetime
+import logging
+import threading
+import uuid
+
+import mongoengine
+from pymongo.errors import BulkWriteError
+
+_LOGGER = logging.getLogger(__name__)
+
+# Mongo error codes for a unique index violation
+DUPLICATE_KEY_ERRORS = (11000, 11001)
+
+
+class InFlightDownload(mongoengine.Document):
+    # <checksum type>:<checksum>
+    key = mongoengine.StringField(primary_key=True)
+    owner = mongoengine.StringField(required=True)
+    expires = mongoengine.DateTimeField(required=True)
+
+    meta = dict(collection='win_inflight_downloads',
+                indexes=[dict(fields=['expires'], expireAfterSeconds=0)],
+                allow_inheritance=False)
+
+
+class InFlightRegistry(object):
+    # Seconds a claim lives without being refreshed
+    TTL = 600
+
+    def __init__(self, owner=None, ttl=None):
+        self.owner = owner or uuid.uuid4().hex
+        self.ttl = ttl or self.TTL
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    @classmethod
+    def key(cls, unit):
+        return '%s:%s' % (unit.checksumtype, unit.checksum)
+
+    def _expires(self):
+        return datetime.datetime.utcnow() + datetime.timedelta(
+            seconds=self.ttl)
+
+    @classmethod
+    def _collection(cls):
+        return InFlightDownload._get_collection()
+
+    def claim(self, keys):
+        """
+        Claim the keys nobody else is downloading.
+
+        :return: the keys now owned by this registry
+        :rtype: set
+        """
+        keys = sorted(set(keys))
+        if not keys:
+            return set()
+        expires = self._expires()
+        taken = set()
+        try:
+            self._collection().insert_many(
+                [dict(_id=key, owner=self.owner, expires=expires)
+                 for key in keys], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                if error['code'] not in DUPLICATE_KEY_ERRORS:
+                    raise
+                taken.add(keys[error['index']])
+        claimed = set(keys) - taken
+        # Claims whose owner stopped refreshing them are up for grabs, even
+        # if Mongo did not get to remove them yet
+        now = datetime.datetime.utcnow()
+        for key in sorted(taken):
+            result = self._collection().update_one(
+                {'_id': key, 'expires': {'$lt': now}},
+                {'$set': dict(owner=self.owner, expires=expires)})
+            if result.modified_count:
+                claimed.add(key)
+        return claimed
+
+    def release(self, key):
+        self._collection().delete_one({'_id': key, 'owner': self.owner})
+
+    def release_all(self):
+        self._collection().delete_many({'owner': self.owner})
+
+    def refresh(self):
+        self._collection().update_many(
+            {'owner': self.owner}, {'$set': dict(expires=self._expires())})
+
+    def pending(self, keys):
+        """
+        :return: the keys still claimed by someone else
+        :rtype: set
+        """
+        keys = sorted(set(keys))
+        if not keys:
+            return set()
+        cursor = self._collection().find(
+            {'_id': {'$in': keys}, 'owner': {'$ne': self.owner},
+             'expires': {'$gte': datetime.datetime.utcnow()}},
+            projection=dict(_id=True))
+        return set(doc['_id'] for doc in cursor)
+
+    def start(self):
+        """
+        Keep refreshing the claims from a background thread, until stop().
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="%s-refresh" % __name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.ttl / 3.0):
+            try:
+                self.refresh()
+            except Exception:
+                _LOGGER.exception("Unable to refresh download claims")
+
+    def stop(self):
+        """
+        Stop refreshing, and drop whatever claims are left.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.release_all()
@@ -0,0 +1,104 @@
+"""
+Single-pass ingest of package files.
+
+The metadata reader only needs a few scattered sectors of a package, while
+the checksum needs all of it. SinglePassReader serves the reader's random
+accesses from whole blocks it keeps around, then feeds those same blocks to
+the hashers when the rest of the file is streamed through, so that every
+byte of the file is read from disk exactly once.
+"""
+import os
+
+from pulp.server import util
+
+
+class SinglePassReader(object):
+    BLOCK_SIZE = 64 * 1024
+    # Blocks nobody looked at yet are read (and hashed) in larger chunks
+    CHUNK_SIZE = 16 * BLOCK_SIZE
+
+    def __init__(self, fobj, checksum_types, checksums=None):
+        """
+        :param checksums: digests of the file computed elsewhere (e.g. while
+                          it was downloaded); the file is then only read
+                          where the metadata reader needs it
+        :type  checksums: dict
+        """
+        self._fobj = fobj
+        # msiinfo, if used as a fallback, needs a file name
+        self.name = getattr(fobj, 'name', None)
+        self._hashers = dict((ctype, util.get_hash_object(ctype))
+                             for ctype in checksum_types)
+        self._blocks = dict()
+        self._pos = 0
+        self._checksums = None
+        self.size = None
+        if checksums is not None:
+            self._checksums = dict((ctype, checksums[ctype])
+                                   for ctype in checksum_types)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence != os.SEEK_SET:
+            raise ValueError("Unsupported seek mode %s" % whence)
+        self._pos = offset
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size):
+        ret = []
+        end = self._pos + size
+        while self._pos < end:
+            idx, offset = divmod(self._pos, self.BLOCK_SIZE)
+            block = self._block(idx)
+            if offset >= len(block):
+                break
+            data = block[offset:offset + end - self._pos]
+            ret.append(data)
+            self._pos += len(data)
+        return b''.join(ret)
+
+    def _block(self, idx):
+        block = self._blocks.get(idx)
+        if block is None:
+            self._fobj.seek(idx * self.BLOCK_SIZE)
+            block = self._blocks[idx] = self._fobj.read(self.BLOCK_SIZE)
+        return block
+
+    def checksums(self):
+        """
+        Stream the file through the hashers, reusing the blocks already read.
+
+        :return: dictionary of checksum type to hex digest
+        :rtype: dict
+        """
+        if self._checksums is not None:
+            if self.size is None:
+                self._fobj.seek(0, os.SEEK_END)
+                self.size = self._fobj.tell()
+            return self._checksums
+        max_blocks = self.CHUNK_SIZE // self.BLOCK_SIZE
+        size = 0
+        idx = 0
+        while True:
+            count = 1
+            data = self._blocks.pop(idx, None)
+            if data is None:
+                while (count < max_blocks and
+                       idx + count not in self._blocks):
+                    count += 1
+                self._fobj.seek(idx * self.BLOCK_SIZE)
+                data = self._fobj.read(count * self.BLOCK_SIZE)
+            for hasher in self._hashers.values():
+                hasher.update(data)
+            size += len(data)
+            if len(data) < count * self.BLOCK_SIZE:
+                break
+            idx += count
+        self._blocks.clear()
+        self.size = size
+        self._checksums = dict((ctype, hasher.hexdigest())
+                               for ctype, hasher in self._hashers.items())
+        return self._checksums
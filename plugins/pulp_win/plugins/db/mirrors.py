@@ -0,0 +1,197 @@
+"""
+Mirror scores, kept across syncs.
+
+Every sync measures the mirrors it talks to: how fast repomd.xml comes back,
+how fast packages download, and how often requests fail. The figures are
+folded into exponentially weighted averages, so that recent behavior counts
+most, and are used to pick the mirrors to race for metadata and to spread
+package downloads.
+
+Several syncs may measure the same mirror at once. Each one keeps the
+samples it took, and save() folds them into whatever is stored at that
+point, with a compare-and-set update, so that no sync overwrites the
+samples of another.
+"""
+import datetime
+import logging
+import random
+import threading
+
+import mongoengine
+from pymongo.errors import DuplicateKeyError
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class MirrorStats(mongoengine.Document):
+    url = mongoengine.StringField(primary_key=True)
+    # Bytes per second while downloading packages
+    throughput = mongoengine.FloatField()
+    # Seconds to fetch repomd.xml
+    latency = mongoengine.FloatField()
+    # Fraction of recent requests that succeeded
+    health = mongoengine.FloatField(default=1.0)
+    successes = mongoengine.IntField(default=0)
+    failures = mongoengine.IntField(default=0)
+    last_used = mongoengine.DateTimeField()
+
+    meta = dict(collection='win_mirror_stats', allow_inheritance=False)
+
+
+class MirrorScores(object):
+    """
+    Scores for a set of mirrors, updated in memory (from any thread) during a
+    sync and written back by save().
+    """
+    # Weight of the newest sample in the averages
+    ALPHA = 0.3
+    AVERAGES = ('throughput', 'latency', 'health')
+    # Attempts at saving a mirror's samples while other syncs save theirs
+    MAX_RETRIES = 10
+
+    def __init__(self, urls):
+        self._lock = threading.Lock()
+        self._stats = dict()
+        # Samples taken since the last save, by url
+        self._pending = dict()
+        urls = [url for url in urls if url]
+        for stats in MirrorStats.objects(url__in=urls):
+            self._stats[stats.url] = stats
+        for url in urls:
+            if url not in self._stats:
+                self._stats[url] = MirrorStats(url=url)
+
+    def _average(self, old, sample):
+        if old is None:
+            return sample
+        return self.ALPHA * sample + (1 - self.ALPHA) * old
+
+    def _fold(self, values, samples):
+        for sample in samples:
+            for field, value in sorted(sample.items()):
+                values[field] = self._average(values.get(field), value)
+        return values
+
+    def _update(self, url, success, **samples):
+        samples['health'] = 1.0 if success else 0.0
+        with self._lock:
+            stats = self._stats.get(url)
+            if stats is None:
+                return
+            for field, value in self._fold(
+                    dict((f, getattr(stats, f)) for f in samples),
+                    [samples]).items():
+                setattr(stats, field, value)
+            if success:
+                stats.successes += 1
+            else:
+                stats.failures += 1
+            stats.last_used = datetime.datetime.utcnow()
+            pending = self._pending.setdefault(
+                url, dict(samples=[], successes=0, failures=0))
+            pending['samples'].append(samples)
+            pending['successes' if success else 'failures'] += 1
+            pending['last_used'] = stats.last_used
+
+    def record_metadata(self, url, seconds):
+        self._update(url, True, latency=seconds)
+
+    def record_download(self, url, size, seconds):
+        samples = dict()
+        if seconds > 0:
+            samples['throughput'] = float(size) / seconds
+        self._update(url, True, **samples)
+
+    def record_failure(self, url):
+        self._update(url, False)
+
+    def score(self, url):
+        """
+        Expected usefulness of a mirror: its throughput scaled by its health.
+        Mirrors that were never measured get the best known throughput, so
+        that they are given a chance.
+        """
+        with self._lock:
+            known = [s.throughput for s in self._stats.values()
+                     if s.throughput]
+            stats = self._stats[url]
+            throughput = stats.throughput or max(known or [1.0])
+            return throughput * stats.health
+
+    def rank(self, urls):
+        """
+        :return: urls, best first; ties keep their original order
+        :rtype: list
+        """
+        order = dict((url, idx) for idx, url in enumerate(urls))
+        return sorted(urls, key=lambda url: (-self.score(url), order[url]))
+
+    def choose(self, urls):
+        """
+        Pick one of the urls at random, weighted by score.
+        """
+        weights = [max(self.score(url), 0) for url in urls]
+        total = sum(weights)
+        if total <= 0:
+            return random.choice(urls)
+        point = random.uniform(0, total)
+        for url, weight in zip(urls, weights):
+            point -= weight
+            if point <= 0:
+                return url
+        return urls[-1]
+
+    def mirror_for(self, url):
+        """
+        :return: the mirror url is served from, or None
+        :rtype: str
+        """
+        matches = [m for m in self._stats if url.startswith(m)]
+        if not matches:
+            return None
+        return max(matches, key=len)
+
+    def save(self):
+        with self._lock:
+            pending, self._pending = self._pending, dict()
+        collection = MirrorStats._get_collection()
+        for url, changes in sorted(pending.items()):
+            if not self._save(collection, url, changes):
+                _LOGGER.warning("Unable to save the scores of %s", url)
+        _LOGGER.debug("Saved scores for %d mirrors", len(pending))
+
+    def _save(self, collection, url, changes):
+        """
+        Fold the samples into the stored averages, unless another sync
+        changed them in the meantime, in which case try again.
+
+        :return: whether the samples were saved
+        :rtype: bool
+        """
+        for _ in range(self.MAX_RETRIES):
+            doc = collection.find_one({'_id': url})
+            if doc is None:
+                values = self._fold(dict(health=1.0), changes['samples'])
+                values.update(_id=url, successes=changes['successes'],
+                              failures=changes['failures'],
+                              last_used=changes['last_used'])
+                try:
+                    collection.insert_one(values)
+                except DuplicateKeyError:
+                    continue
+                return True
+            previous = dict((field, doc.get(field))
+                            for field in self.AVERAGES)
+            values = dict(previous)
+            if values['health'] is None:
+                values['health'] = 1.0
+            self._fold(values, changes['samples'])
+            spec = dict(previous, _id=url)
+            result = collection.update_one(
+                spec,
+                {'$set': dict(values, last_used=changes['last_used']),
+                 '$inc': dict(successes=changes['successes'],
+                              failures=changes['failures'])})
+            if result.modified_count:
+                return True
+        return False
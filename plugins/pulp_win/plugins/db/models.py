@@ -1,28 +1,153 @@
 import io
 import logging
-import os
 import subprocess
 import mongoengine
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from pulp.common import dateutils
 from pulp.server import util
 from pulp.server.controllers import repository as repo_controller
-from pulp.server.db.model import FileContentUnit
+from pulp.server.db.model import (FileContentUnit, Repository,
+                                  RepositoryContentUnit)
 from pulp_rpm.plugins.db.fields import ChecksumTypeStringField
 from pulp_win.common import ids
+from pulp_win.plugins.db import ingest, msidb, storage
 from xml.etree import ElementTree
 
+# Only used as a fallback, when the in-process reader fails to parse a file
 MSIINFO_PATH = '/usr/bin/msiinfo'
-if not os.path.exists(MSIINFO_PATH):
-    raise RuntimeError("msiinfo is not available")
 
 _LOGGER = logging.getLogger(__name__)
 
 NotUniqueError = mongoengine.NotUniqueError
-
+# Mongo error codes for a unique index violation
+DUPLICATE_KEY_ERRORS = (11000, 11001)
+
+# Digests computed on ingest and stored on each unit, so that any of them can
+# be served without reading the file again
+CHECKSUM_TYPES = (util.TYPE_SHA256, util.TYPE_SHA1, util.TYPE_MD5)
+# Units are looked up by any of those digests when a feed advertises a
+# checksum type other than the one in their unit key; units saved before
+# the digests were stored do not have them
+CHECKSUMS_INDEXES = [dict(fields=['checksums.%s' % checksum_type],
+                          sparse=True)
+                     for checksum_type in CHECKSUM_TYPES]
 
 class Error(ValueError):
     pass
 
 
+def associate_units(repo, units):
+    """
+    Associate units with a repository in a single bulk write. This has the
+    same effect as calling repo_controller.associate_single_unit for each
+    unit.
+
+    :param repo: the repository to associate the units with
+    :type  repo: pulp.server.db.model.Repository
+    :param units: units already saved in the database
+    :type  units: iterable
+    :return: the units
+    :rtype: list
+    """
+    units = list(units)
+    if not units:
+        return units
+    now = dateutils.format_iso8601_utc_timestamp(
+        dateutils.now_utc_timestamp())
+    ops = [UpdateOne(dict(repo_id=repo.repo_id, unit_id=unit.id,
+                          unit_type_id=unit._content_type_id),
+                     {'$setOnInsert': dict(created=now),
+                      '$set': dict(updated=now)},
+                     upsert=True)
+           for unit in units]
+    RepositoryContentUnit._get_collection().bulk_write(ops, ordered=False)
+    return units
+
+
+def iter_repo_unit_ids(repo, type_ids):
+    """
+    :param repo: the repository
+    :type  repo: pulp.server.db.model.Repository
+    :param type_ids: unit types to consider
+    :type  type_ids: list
+    :return: generator of the ids of the repository's units, sorted
+    """
+    cursor = RepositoryContentUnit._get_collection().find(
+        dict(repo_id=repo.repo_id, unit_type_id={'$in': list(type_ids)}),
+        projection=dict(unit_id=True, _id=False)).sort('unit_id', 1)
+    for doc in cursor:
+        yield doc['unit_id']
+
+
+def unassociate_units(repo, unit_ids, type_ids):
+    """
+    Remove units from a repository with one delete per unit type, and
+    update the repository's unit counts by as many units as were removed.
+
+    :param repo: the repository to remove the units from
+    :type  repo: pulp.server.db.model.Repository
+    :param unit_ids: ids of the units
+    :type  unit_ids: iterable
+    :param type_ids: unit types the units may be of
+    :type  type_ids: iterable
+    :return: number of units removed
+    :rtype: int
+    """
+    unit_ids = list(unit_ids)
+    if not unit_ids:
+        return 0
+    collection = RepositoryContentUnit._get_collection()
+    removed = dict()
+    for type_id in sorted(type_ids):
+        result = collection.delete_many(
+            dict(repo_id=repo.repo_id, unit_type_id=type_id,
+                 unit_id={'$in': unit_ids}))
+        if result.deleted_count:
+            removed[type_id] = result.deleted_count
+    if not removed:
+        return 0
+    update = dict(('inc__content_unit_counts__%s' % type_id, -count)
+                  for type_id, count in removed.items())
+    update['set__last_unit_removed'] = (
+        dateutils.now_utc_datetime_with_tzinfo())
+    Repository.objects(repo_id=repo.repo_id).update_one(**update)
+    return sum(removed.values())
+
+
+def save_and_associate_units(repo, unit_paths, move=False):
+    """
+    Batched equivalent of Package.save_and_associate.
+
+    The new units of each type are inserted with one unordered bulk insert.
+    Those that turn out to be in the database already are replaced with the
+    stored units, fetched with a single query, and all units are then
+    associated with the repository in one bulk write.
+
+    :param repo: the repository to associate the units with
+    :type  repo: pulp.server.db.model.Repository
+    :param unit_paths: (unit, file_path) pairs; file_path is None for units
+                       without a file
+    :type  unit_paths: iterable
+    :param move: the files are temporary, see Package.import_file
+    :type  move: bool
+    :return: the units in the database, in the order they were passed in
+    :rtype: list
+    """
+    unit_paths = list(unit_paths)
+    by_class = dict()
+    for idx, (unit, file_path) in enumerate(unit_paths):
+        by_class.setdefault(unit.__class__, []).append(idx)
+    ret = [unit for unit, _ in unit_paths]
+    for model_class, indexes in sorted(by_class.items()):
+        saved = model_class._save_units([unit_paths[i] for i in indexes],
+                                        move=move)
+        for idx, unit in zip(indexes, saved):
+            ret[idx] = unit
+    associate_units(repo, ret)
+    return ret
+
+
 class InvalidPackageError(Error):
     pass
 
@@ -35,20 +160,30 @@ class Package(FileContentUnit):
     checksum = mongoengine.StringField(required=True)
     checksumtype = ChecksumTypeStringField(required=True)
     size = mongoengine.IntField()
+    # All digests from CHECKSUM_TYPES, keyed by checksum type
+    checksums = mongoengine.DictField()
+    # Serialized primary.xml <package> element, keyed by checksum type, and
+    # the REPODATA_VERSION it was rendered with
+    repodata = mongoengine.DictField()
+    repodata_version = mongoengine.IntField()
 
     filename = mongoengine.StringField(required=True)
     relativepath = mongoengine.StringField()
 
     UNIT_KEY_TO_FIELD_MAP = dict()
     REPOMD_EXTRA_FIELDS = []
+    # Fields read from the package. Published in primary.xml, so that an
+    # importer trusting the feed does not have to read the package
+    EXTRACTED_FIELDS = []
+    # Derived data, not reported as part of the unit's properties
+    INTERNAL_FIELDS = set(['repodata', 'repodata_version'])
+    # Bumped whenever the rendered <package> element changes, so that stored
+    # fragments from before are rendered again
+    REPODATA_VERSION = 2
 
     def __init__(self, *args, **kwargs):
         super(Package, self).__init__(*args, **kwargs)
-        # Additional data to be saved in the repodata representation
-        self.repodata = None
         self.base_url = None
-        # Needed by sync verification
-        self.checksums = {}
 
     def __str__(self):
         return '<%s: %s>' % (
@@ -57,44 +192,105 @@ class Package(FileContentUnit):
                       for name in self.unit_key_fields))
 
     @classmethod
-    def from_file(cls, filename, user_metadata=None):
-        if hasattr(filename, "read"):
-            fobj = filename
-        else:
-            try:
-                fobj = open(filename, "r")
-            except IOError as e:
-                raise Error(str(e))
-        if not user_metadata:
-            user_metadata = {}
-        unit_md = cls._read_metadata(filename)
+    def pre_save_signal(cls, sender, document, **kwargs):
+        super(Package, cls).pre_save_signal(sender, document, **kwargs)
+        # Render the primary.xml fragments now, so that publishing only has
+        # to copy them
+        checksum_types = set(document.checksums or [])
+        if document.checksumtype:
+            checksum_types.add(document.checksumtype)
+        document.repodata = dict(
+            (ctype, document._render_primary(ctype).decode('utf-8'))
+            for ctype in checksum_types)
+        document.repodata_version = cls.REPODATA_VERSION
+
+    @classmethod
+    def from_file(cls, filename, user_metadata=None, cache=None,
+                  checksum=None, checksums=None):
+        """
+        Create a unit from a package file.
+
+        :param cache: if set, metadata previously extracted from the same
+                      content is reused instead of being extracted again
+        :type  cache: pulp_win.plugins.db.cache.MetadataCache
+        :param checksum: sha256 of the file, if the caller already verified
+                         it; on a cache hit the file is then not read at all
+        :type  checksum: str
+        :param checksums: all the digests from CHECKSUM_TYPES, if the caller
+                          already computed them; the file is then not hashed
+        :type  checksums: dict
+        """
+        if checksums is not None:
+            checksum = checksums[util.TYPE_SHA256]
+        metadata = None
+        if cache is not None and checksum is not None:
+            metadata = cache.get(cls.TYPE_ID, checksum)
+        if metadata is None:
+            # Without a checksum, the cache can only be consulted once the
+            # file has been hashed
+            lookup = (cache is not None and checksum is None)
+            if hasattr(filename, "read"):
+                metadata = cls._ingest(filename, cache, lookup, checksums)
+            else:
+                metadata = cls._ingest_path(filename, cache, lookup,
+                                            checksums)
+        # Overwriting metadata extracted from the file with user-specified
+        # metadata seems dangerous. If this statement is not correct,
+        # uncomment the lines below. We won't be mapping fields like
+        # ProductVersion from user_metadata, if the user wanted to overwrite
+        # something they'd have done it with the properties pulp expects.
+        # metadata.update((attr, user_metadata[attr]) for attr in metadata
+        #                 if attr in (user_metadata or {}))
+        return cls(**metadata)
+
+    @classmethod
+    def _ingest_path(cls, path, cache=None, lookup=False, checksums=None):
+        try:
+            fobj = open(path, "rb")
+        except IOError as e:
+            raise Error(str(e))
+        with fobj:
+            return cls._ingest(fobj, cache, lookup, checksums)
+
+    @classmethod
+    def _ingest(cls, fobj, cache=None, lookup=False, checksums=None):
+        """
+        Extract the metadata, checksum and size of a package from a single
+        read of the file, and map them to the model's fields.
+
+        If lookup is set, the file is hashed before it is parsed, so that the
+        cache can be checked first.
+        """
+        reader = ingest.SinglePassReader(fobj, CHECKSUM_TYPES, checksums)
+        if lookup:
+            checksum = reader.checksums()[util.TYPE_SHA256]
+            metadata = cache.get(cls.TYPE_ID, checksum)
+            if metadata is not None:
+                return metadata
+        unit_md = cls._read_metadata(reader)
+        checksums = reader.checksums()
         unit_md.update(checksumtype=util.TYPE_SHA256,
-                       checksum=cls._compute_checksum(fobj),
-                       size=fobj.tell())
+                       checksum=checksums[util.TYPE_SHA256],
+                       checksums=checksums,
+                       size=reader.size)
 
         ignored = set(['filename'])
 
         metadata = dict()
-        user_md = dict()
         for attr, fdef in cls._fields.items():
             if attr == 'id' or attr.startswith('_'):
                 continue
+            if attr in cls.INTERNAL_FIELDS:
+                continue
             prop_name = cls.UNIT_KEY_TO_FIELD_MAP.get(attr, attr)
             val = unit_md.get(prop_name)
             if val is None and fdef.required and attr not in ignored:
                 raise Error('Required field is missing: {}'.format(attr))
             metadata[attr] = val
-            if user_metadata and attr in user_metadata:
-                # We won't be mapping fields like ProductVersion from
-                # user_metadata, if the user wanted to overwrite something
-                # they'd have done it with the properties pulp expects.
-                user_md[attr] = user_metadata[attr]
         metadata['filename'] = cls.filename_from_unit_key(metadata)
-        # Overwriting metadata extracted from the file with user-specified
-        # metadata seems dangerous. If this statement is not correct,
-        # uncomment the line below.
-        # metadata.update(user_md)
-        return cls(**metadata)
+        if cache is not None:
+            cache.put(cls.TYPE_ID, metadata['checksum'], metadata)
+        return metadata
 
     @classmethod
     def _run_cmd(cls, cmd):
@@ -108,11 +304,6 @@ class Package(FileContentUnit):
             raise InvalidPackageError(stderr)
         return stdout, stderr
 
-    @classmethod
-    def _compute_checksum(cls, fobj):
-        cstype = util.TYPE_SHA256
-        return util.calculate_checksums(fobj, [cstype])[cstype]
-
     @classmethod
     def filename_from_unit_key(cls, unit_key):
         return "{0}-{1}.{2}".format(
@@ -125,6 +316,18 @@ class Package(FileContentUnit):
         """
         return self.relativepath
 
+    def get_checksum(self, checksumtype=None):
+        """
+        Return the checksum type and value to advertise for this unit.
+
+        The requested type is served from the stored digests if available,
+        otherwise the unit's own checksum is used.
+        """
+        if checksumtype and self.checksums and \
+                self.checksums.get(checksumtype):
+            return checksumtype, self.checksums[checksumtype]
+        return self.checksumtype or checksumtype, self.checksum
+
     def get_symlink_name(self):
         return self.filename
 
@@ -132,7 +335,7 @@ class Package(FileContentUnit):
     def all_properties(self):
         ret = dict()
         for k in self.__class__._fields:
-            if k.startswith('_'):
+            if k.startswith('_') or k in self.INTERNAL_FIELDS:
                 continue
             ret[k] = getattr(self, k)
         return ret
@@ -142,7 +345,51 @@ class Package(FileContentUnit):
             repository=repo, unit=self)
         return self
 
-    def save_and_associate(self, file_path, repo):
+    def import_content(self, path, location=None):
+        """
+        Place the file into the unit's storage path, linking it rather than
+        copying it where the filesystem allows.
+        """
+        if location is not None or not self._storage_path:
+            return super(Package, self).import_content(path, location)
+        method = storage.link_or_copy(path, self._storage_path)
+        _LOGGER.debug("Imported %s into %s (%s)", path, self._storage_path,
+                      method)
+
+    def import_file(self, file_path, move=False, owned=False):
+        """
+        Import the file of the unit, which must already be saved, into
+        storage.
+
+        :param move: file_path is a temporary file nobody else uses, which
+                     can be moved into storage rather than copied
+        :type  move: bool
+        :param owned: file_path is a file Pulp owns and removes itself, like
+                      an upload staging file, which can be hard linked into
+                      storage rather than copied
+        :type  owned: bool
+        """
+        if not (move or owned):
+            self.safe_import_content(file_path)
+            return
+        try:
+            if move:
+                method = storage.move(file_path, self._storage_path)
+            else:
+                method = storage.link_or_copy(file_path, self._storage_path,
+                                              hardlink=True)
+        except Exception:
+            # Same as safe_import_content: no unit without its file
+            self.delete()
+            raise
+        _LOGGER.debug("Imported %s into %s (%s)", file_path,
+                      self._storage_path, method)
+
+    def save_and_associate(self, file_path, repo, move=False, owned=False):
+        """
+        :param move: see import_file
+        :param owned: see import_file
+        """
         with_filename = ('filename' in self.__class__._fields)
         if with_filename:
             filename = self.filename_from_unit_key(self.unit_key)
@@ -151,29 +398,136 @@ class Package(FileContentUnit):
         try:
             self.save()
             if with_filename:
-                self.safe_import_content(file_path)
+                self.import_file(file_path, move=move, owned=owned)
         except NotUniqueError:
             unit = self.__class__.objects.filter(**unit.unit_key).first()
         unit.associate(repo)
         return unit
 
+    @classmethod
+    def _save_units(cls, unit_paths, move=False):
+        """
+        Insert units of this type in bulk; units already in the database
+        are replaced with the stored ones.
+
+        :return: the units in the database, in the order they were passed in
+        :rtype: list
+        """
+        with_filename = ('filename' in cls._fields)
+        collection = cls._get_collection()
+        docs = []
+        for unit, _ in unit_paths:
+            if with_filename:
+                unit.set_storage_path(
+                    unit.filename_from_unit_key(unit.unit_key))
+            # What Document.save() does before writing
+            mongoengine.signals.pre_save.send(cls, document=unit)
+            unit.validate()
+            docs.append(unit.to_mongo())
+        duplicates = set()
+        try:
+            collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                if error['code'] not in DUPLICATE_KEY_ERRORS:
+                    raise
+                duplicates.add(error['index'])
+        ret = []
+        for idx, (unit, file_path) in enumerate(unit_paths):
+            ret.append(unit)
+            if idx in duplicates:
+                continue
+            unit._created = False
+            unit._clear_changed_fields()
+            if with_filename:
+                unit.import_file(file_path, move=move)
+        if not duplicates:
+            return ret
+        units = [ret[idx] for idx in duplicates]
+        unit_keys = set(unit.unit_key_as_named_tuple for unit in units)
+        checksums = sorted(set(unit.checksum for unit in units))
+        existing = dict()
+        for unit in cls.objects(checksum__in=checksums):
+            unit_key = unit.unit_key_as_named_tuple
+            if unit_key in unit_keys:
+                existing[unit_key] = unit
+        for idx in duplicates:
+            ret[idx] = existing[ret[idx].unit_key_as_named_tuple]
+        return ret
+
+    @classmethod
+    def _read_msi_info(cls, filename):
+        """
+        Read the list of tables, the Property table and the ModuleSignature
+        table from an MSI database, in one pass over the file.
+
+        The in-process reader is tried first; msiinfo is only used if the
+        reader cannot make sense of the file.
+        """
+        try:
+            return cls._read_msi_info_native(filename)
+        except msidb.Error as e:
+            _LOGGER.info("Falling back to msiinfo for %s: %s", filename, e)
+        if hasattr(filename, "name"):
+            filename = filename.name
+        return cls._read_msi_info_msiinfo(filename)
+
+    @classmethod
+    def _read_msi_info_native(cls, filename):
+        tables, contents = msidb.read_tables(
+            filename, ['Property', 'ModuleSignature'])
+        properties = None
+        if 'Property' in contents:
+            properties = dict((row['Property'], row['Value'] or '')
+                              for row in contents['Property']
+                              if row['Property'] is not None)
+        module_signature = None
+        if 'ModuleSignature' in contents:
+            module_signature = cls._parse_module_signature(
+                (row['ModuleID'], row['Language'], row['Version'])
+                for row in contents['ModuleSignature'])
+        return dict(tables=tables, Property=properties,
+                    ModuleSignature=module_signature)
+
+    @classmethod
+    def _read_msi_info_msiinfo(cls, filename):
+        tables = cls._read_msi_tables(filename)
+        properties = None
+        if 'Property' in tables:
+            cmd = [MSIINFO_PATH, 'export', filename, 'Property']
+            stdout, stderr = cls._run_cmd(cmd)
+            properties = (h.rstrip().partition('\t')
+                          for h in stdout.split('\n'))
+            properties = dict((x[0], x[2]) for x in properties
+                              if x[1] == '\t')
+        module_signature = None
+        if 'ModuleSignature' in tables:
+            module_signature = cls._read_msi_module_signature(filename)
+        return dict(tables=tables, Property=properties,
+                    ModuleSignature=module_signature)
+
     @classmethod
     def _read_msi_module_signature(cls, filename):
         # https://msdn.microsoft.com/en-us/library/windows/desktop/aa370051(v=vs.85).aspx
         cmd = [MSIINFO_PATH, 'export', filename, 'ModuleSignature']
         stdout, _ = cls._run_cmd(cmd)
+        rows = (row.rstrip().split('\t', 2) for row in stdout.split('\n'))
+        return cls._parse_module_signature(
+            arr for arr in rows if len(arr) == 3)
+
+    @classmethod
+    def _parse_module_signature(cls, rows):
         # According to the document linked above, the ModuleID is always
         # name.GUID. msiinfo will return a bunch of header rows which are not
         # in that format, so the rpartition will skip them.
         metadata = []
-        for row in stdout.split('\n'):
-            arr = row.rstrip().split('\t', 2)
-            if len(arr) != 3:
+        for module_id, _, version in rows:
+            if module_id is None:
                 continue
-            name, sep, guid = arr[0].rpartition('.')
+            name, sep, guid = module_id.rpartition('.')
             if not sep:
                 continue
-            metadata.append(dict(name=name, guid=guid, version=arr[2]))
+            metadata.append(dict(name=name, guid=guid, version=version))
         metadata.sort(key=lambda x: (x['name'], x['version']))
         return metadata
 
@@ -185,6 +539,15 @@ class Package(FileContentUnit):
         return tables
 
     def render_primary(self, checksumtype):
+        checksum_type, _ = self.get_checksum(checksumtype)
+        fragment = None
+        if self.repodata_version == self.REPODATA_VERSION:
+            fragment = (self.repodata or {}).get(checksum_type)
+        if fragment is not None:
+            return fragment.encode('utf-8')
+        return self._render_primary(checksumtype)
+
+    def _render_primary(self, checksumtype):
         sio = io.BytesIO()
         el = self._package_to_xml(checksumtype)
         et = ElementTree.ElementTree(el)
@@ -193,17 +556,26 @@ class Package(FileContentUnit):
 
     def _package_to_xml(self, checksumtype):
         unit_key = self.unit_key
-        checksum_type = unit_key.pop('checksumtype',
-                                     self.checksumtype or checksumtype)
-        if self.checksum:
-            unit_key['checksum'] = self.checksum
-        for field in self.REPOMD_EXTRA_FIELDS:
+        unit_key.pop('checksumtype', None)
+        checksum_type, checksum = self.get_checksum(checksumtype)
+        if checksum:
+            unit_key['checksum'] = checksum
+        for field in self.REPOMD_EXTRA_FIELDS + self.EXTRACTED_FIELDS:
             val = getattr(self, field)
-            if val is not None:
+            if val is not None and not isinstance(val, list):
                 unit_key[field] = val
         el = self._to_xml_element("package",
                                   attrib=dict(type=self.type_id),
                                   content=unit_key)
+        for field in self.EXTRACTED_FIELDS:
+            val = getattr(self, field)
+            if not isinstance(val, list):
+                continue
+            # Even if empty: no entries is not the same as unknown
+            list_el = ElementTree.SubElement(el, field)
+            for item in val:
+                ElementTree.SubElement(list_el, "module", attrib=dict(
+                    (k, v) for k, v in item.items() if v is not None))
         csum_nodes = el.findall('checksum')
         if csum_nodes:
             csum_node = csum_nodes[0]
@@ -228,7 +600,7 @@ class Package(FileContentUnit):
 class MSI(Package):
     TYPE_ID = TYPE = ids.TYPE_ID_MSI
     meta = dict(collection='units_msi',
-                indexes=list(ids.UNIT_KEY_MSI))
+                indexes=list(ids.UNIT_KEY_MSI) + CHECKSUMS_INDEXES)
 
     unit_key_fields = ids.UNIT_KEY_MSI
     unit_display_name = 'MSI'
@@ -236,6 +608,7 @@ class MSI(Package):
 
     UNIT_KEY_TO_FIELD_MAP = dict(name='ProductName', version='ProductVersion')
     REPOMD_EXTRA_FIELDS = ['ProductCode', 'UpgradeCode']
+    EXTRACTED_FIELDS = ['Manufacturer', 'ModuleSignature']
 
     UpgradeCode = mongoengine.StringField()
     ProductCode = mongoengine.StringField()
@@ -249,20 +622,12 @@ class MSI(Package):
 
     @classmethod
     def _read_metadata(cls, filename):
-        tables = cls._read_msi_tables(filename)
-        if 'Property' not in tables:
+        msi_info = cls._read_msi_info(filename)
+        if msi_info['Property'] is None:
             raise InvalidPackageError("MSI does not have a Property table")
-        cmd = [MSIINFO_PATH, 'export', filename, 'Property']
-        stdout, stderr = cls._run_cmd(cmd)
-        headers = (h.rstrip().partition('\t')
-                   for h in stdout.split('\n'))
-        headers = dict((x[0], x[2]) for x in headers if x[1] == '\t')
+        headers = msi_info['Property']
         # Add the module signature, to link an MSI to an MSM
-        if 'ModuleSignature' in tables:
-            module_signature = cls._read_msi_module_signature(filename)
-        else:
-            module_signature = []
-        headers['ModuleSignature'] = module_signature
+        headers['ModuleSignature'] = msi_info['ModuleSignature'] or []
         return headers
 
 
@@ -270,12 +635,14 @@ class MSM(Package):
     TYPE_ID = TYPE = ids.TYPE_ID_MSM
 
     meta = dict(collection='units_msm',
-                indexes=list(ids.UNIT_KEY_MSM))
+                indexes=list(ids.UNIT_KEY_MSM) + CHECKSUMS_INDEXES)
 
     unit_key_fields = ids.UNIT_KEY_MSM
     unit_display_name = 'MSM'
     unit_description = 'MSM'
 
+    EXTRACTED_FIELDS = ['guid']
+
     guid = mongoengine.StringField()
 
     # For backward compatibility
@@ -285,21 +652,19 @@ class MSM(Package):
 
     @classmethod
     def _read_metadata(cls, filename):
-        # First, dump tables. An MSM should not contain Property
-        tables = cls._read_msi_tables(filename)
-        if 'Property' in tables:
+        # An MSM should not contain Property
+        msi_info = cls._read_msi_info(filename)
+        if msi_info['Property'] is not None:
             raise InvalidPackageError("Attempt to handle an MSI as an MSM")
-        if 'ModuleSignature' not in tables:
+        module_signature = msi_info['ModuleSignature']
+        if module_signature is None:
             # Theoretically impossible:
             # https://msdn.microsoft.com/en-us/library/windows/desktop/aa370051(v=vs.85).aspx
             raise InvalidPackageError("ModuleSignature is missing")
 
-        # According to the document linked above, the ModuleID is always
-        # name.GUID. msiinfo will return a bunch of header rows which are not
-        # in that format, so the rpartition will skip them.
-        module_signature = cls._read_msi_module_signature(filename)
         if len(module_signature) != 1:
             raise InvalidPackageError(
                 "Not a valid MSM: more than one entry in ModuleSignature")
         metadata = module_signature[0]
         return metadata
+
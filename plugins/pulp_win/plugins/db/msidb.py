@@ -0,0 +1,361 @@
+"""
+In-process reader for MSI and MSM databases.
+
+An MSI database is an OLE compound file: every table is a stream inside the
+compound file, stored column by column, and every string value is an index
+into a shared string pool. Only the subset of both formats needed to read
+the tables pulp_win cares about is implemented here; anything unexpected
+raises Error, and callers fall back to msiinfo.
+
+References:
+https://msdn.microsoft.com/en-us/library/dd942138.aspx (MS-CFB)
+https://github.com/GNOME/msitools/blob/master/libmsi/table.c
+"""
+import struct
+
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+OLE_HEADER_SIZE = 512
+DIR_ENTRY_SIZE = 128
+
+# Special sector ids
+MAXREGSECT = 0xFFFFFFFA
+ENDOFCHAIN = 0xFFFFFFFE
+FREESECT = 0xFFFFFFFF
+NOSTREAM = 0xFFFFFFFF
+
+# Directory entry types
+STGTY_EMPTY = 0
+STGTY_STREAM = 2
+STGTY_ROOT = 5
+
+# Stream names are compressed into the 0x3800-0x4840 unicode range; 0x4840
+# itself prefixes the streams holding database tables.
+_NAME_ALPHABET = ('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                  'abcdefghijklmnopqrstuvwxyz._')
+TABLE_PREFIX = u'\u4840'
+
+# Column type bits, from libmsi
+MSITYPE_VALID = 0x0100
+MSITYPE_STRING = 0x0800
+MSITYPE_NULLABLE = 0x1000
+MSITYPE_TEMPORARY = 0x4000
+
+# Long string references (3 bytes instead of 2) are flagged in the pool header
+LONG_STRING_REFS = 0x8000
+
+# Codepages msiinfo may report which python knows under a different name
+_CODEPAGES = {
+    0: 'cp1252',
+    65001: 'utf-8',
+}
+
+
+class Error(ValueError):
+    pass
+
+
+def decode_stream_name(name):
+    ret = []
+    for char in name:
+        code = ord(char)
+        if 0x3800 <= code < 0x4800:
+            code -= 0x3800
+            ret.append(_NAME_ALPHABET[code & 0x3f])
+            ret.append(_NAME_ALPHABET[(code >> 6) & 0x3f])
+        elif 0x4800 <= code < 0x4840:
+            ret.append(_NAME_ALPHABET[code - 0x4800])
+        else:
+            ret.append(char)
+    return u''.join(ret)
+
+
+class CompoundFile(object):
+    """
+    Random-access reader for the streams stored in an OLE compound file.
+    Only the header, allocation tables, directory and the requested streams
+    are read; the bulk of the file (typically embedded cabinets) is never
+    touched.
+    """
+    def __init__(self, fobj):
+        self._fobj = fobj
+        header = self._read_at(0, OLE_HEADER_SIZE)
+        if len(header) < OLE_HEADER_SIZE or header[:8] != OLE_SIGNATURE:
+            raise Error("Not an OLE compound file")
+        (_, _, byte_order, sector_shift,
+         mini_sector_shift) = struct.unpack('<5H', header[24:34])
+        if byte_order != 0xFFFE:
+            raise Error("Unsupported byte order 0x%04x" % byte_order)
+        if sector_shift not in (9, 12):
+            raise Error("Unsupported sector size 2**%d" % sector_shift)
+        (_, num_fat_sectors, first_dir_sector, _, mini_stream_cutoff,
+         first_minifat_sector, _, first_difat_sector,
+         num_difat_sectors) = struct.unpack('<9I', header[40:76])
+        self.sector_size = 1 << sector_shift
+        self.mini_sector_size = 1 << mini_sector_shift
+        self.mini_stream_cutoff = mini_stream_cutoff
+
+        fat_sectors = list(struct.unpack('<109I', header[76:512]))
+        fat_sectors.extend(self._read_difat(first_difat_sector,
+                                            num_difat_sectors))
+        fat_sectors = fat_sectors[:num_fat_sectors]
+        self._fat = self._read_table(fat_sectors)
+
+        self.entries = self._read_directory(first_dir_sector)
+        if not self.entries or self.entries[0]['type'] != STGTY_ROOT:
+            raise Error("Root storage is missing")
+        root = self.entries[0]
+        self._minifat = self._read_table(
+            self._chain(first_minifat_sector, self._fat))
+        self._mini_stream_sectors = self._chain(root['start'], self._fat)
+
+    def _read_at(self, offset, size):
+        self._fobj.seek(offset)
+        return self._fobj.read(size)
+
+    def _read_sector(self, sector):
+        if sector > MAXREGSECT:
+            raise Error("Invalid sector %d" % sector)
+        data = self._read_at((sector + 1) * self.sector_size,
+                             self.sector_size)
+        if len(data) != self.sector_size:
+            raise Error("Truncated file")
+        return data
+
+    def _read_difat(self, sector, count):
+        ret = []
+        per_sector = self.sector_size // 4 - 1
+        for _ in range(count):
+            if sector == ENDOFCHAIN:
+                break
+            entries = struct.unpack('<%dI' % (per_sector + 1),
+                                    self._read_sector(sector))
+            ret.extend(entries[:per_sector])
+            sector = entries[per_sector]
+        return ret
+
+    def _read_table(self, sectors):
+        ret = []
+        count = self.sector_size // 4
+        for sector in sectors:
+            ret.extend(struct.unpack('<%dI' % count,
+                                     self._read_sector(sector)))
+        return ret
+
+    @classmethod
+    def _chain(cls, sector, table):
+        ret = []
+        while sector != ENDOFCHAIN and sector != FREESECT:
+            if sector >= len(table) or len(ret) > len(table):
+                raise Error("Corrupted sector chain")
+            ret.append(sector)
+            sector = table[sector]
+        return ret
+
+    def _read_directory(self, sector):
+        data = b''.join(self._read_sector(s)
+                        for s in self._chain(sector, self._fat))
+        entries = []
+        for offset in range(0, len(data), DIR_ENTRY_SIZE):
+            entry = data[offset:offset + DIR_ENTRY_SIZE]
+            name_len, entry_type = struct.unpack('<HB', entry[64:67])
+            left, right, child = struct.unpack('<3I', entry[68:80])
+            start, size = struct.unpack('<IQ', entry[116:128])
+            if self.sector_size == 512:
+                # Version 3 files may leave garbage in the high dword
+                size &= 0xFFFFFFFF
+            name = entry[:max(name_len - 2, 0)].decode('utf-16-le', 'replace')
+            entries.append(dict(name=name, type=entry_type, left=left,
+                                right=right, child=child, start=start,
+                                size=size))
+        return entries
+
+    def streams(self):
+        """
+        Return a dict of name to directory entry for the streams stored
+        directly under the root storage, which is where MSI keeps its tables.
+        """
+        ret = dict()
+        pending = [self.entries[0]['child']]
+        seen = set()
+        while pending:
+            sid = pending.pop()
+            if sid == NOSTREAM or sid in seen:
+                continue
+            if sid >= len(self.entries):
+                raise Error("Invalid directory entry %d" % sid)
+            seen.add(sid)
+            entry = self.entries[sid]
+            pending.extend([entry['left'], entry['right']])
+            if entry['type'] == STGTY_STREAM:
+                ret[entry['name']] = entry
+        return ret
+
+    def read_stream(self, entry):
+        size = entry['size']
+        if size < self.mini_stream_cutoff:
+            data = b''.join(self._read_mini_sector(s)
+                            for s in self._chain(entry['start'],
+                                                 self._minifat))
+        else:
+            data = b''.join(self._read_sector(s)
+                            for s in self._chain(entry['start'], self._fat))
+        if len(data) < size:
+            raise Error("Truncated stream %s" % entry['name'])
+        return data[:size]
+
+    def _read_mini_sector(self, sector):
+        offset = sector * self.mini_sector_size
+        idx, offset = divmod(offset, self.sector_size)
+        if idx >= len(self._mini_stream_sectors):
+            raise Error("Invalid mini sector %d" % sector)
+        data = self._read_sector(self._mini_stream_sectors[idx])
+        return data[offset:offset + self.mini_sector_size]
+
+
+class MsiDatabase(object):
+    """
+    Read access to the tables of an MSI database.
+    """
+    def __init__(self, fobj):
+        self._cfile = CompoundFile(fobj)
+        self._streams = dict()
+        for name, entry in self._cfile.streams().items():
+            name = decode_stream_name(name)
+            if name.startswith(TABLE_PREFIX):
+                self._streams[name[len(TABLE_PREFIX):]] = entry
+        self._load_string_pool()
+        self._columns = self._load_columns()
+        self.tables = set(
+            row[0] for row in self._read_rows('_Tables', [MSITYPE_STRING]))
+
+    def _stream_data(self, name):
+        entry = self._streams.get(name)
+        if entry is None:
+            return b''
+        return self._cfile.read_stream(entry)
+
+    def _load_string_pool(self):
+        pool = self._stream_data('_StringPool')
+        data = self._stream_data('_StringData')
+        if len(pool) < 4:
+            raise Error("String pool is missing")
+        pool = struct.unpack('<%dH' % (len(pool) // 2),
+                             pool[:len(pool) // 2 * 2])
+        codepage = pool[0] | ((pool[1] & ~LONG_STRING_REFS) << 16)
+        encoding = _CODEPAGES.get(codepage, 'cp%d' % codepage)
+        try:
+            u''.encode(encoding)
+        except LookupError:
+            raise Error("Unsupported codepage %d" % codepage)
+        self._strref_size = 3 if pool[1] & LONG_STRING_REFS else 2
+
+        # String id 0 is the null string
+        strings = [None]
+        offset = 0
+        idx = 2
+        while idx + 1 < len(pool):
+            length, refs = pool[idx], pool[idx + 1]
+            if length == 0 and refs != 0:
+                # Strings over 64k are stored with a null length; the next
+                # entry holds the low word of their length, and the high
+                # word in place of its refcount (see msi_load_string_table
+                # in libmsi/string.c).
+                if idx + 3 >= len(pool):
+                    raise Error("Truncated string pool")
+                length = (pool[idx + 3] << 16) + pool[idx + 2]
+                idx += 2
+            idx += 2
+            if offset + length > len(data):
+                raise Error("Truncated string data")
+            strings.append(data[offset:offset + length].decode(
+                encoding, 'replace'))
+            offset += length
+        self._strings = strings
+
+    def _load_columns(self):
+        types = [MSITYPE_STRING, 2, MSITYPE_STRING, 2]
+        columns = dict()
+        for table, number, name, col_type in self._read_rows('_Columns',
+                                                             types):
+            columns.setdefault(table, []).append((number, name, col_type))
+        for table_columns in columns.values():
+            table_columns.sort()
+        return columns
+
+    def _column_size(self, col_type):
+        if col_type & ~MSITYPE_NULLABLE == MSITYPE_STRING | MSITYPE_VALID:
+            # Binary stream reference
+            return 2
+        if col_type & MSITYPE_STRING:
+            return self._strref_size
+        if col_type & 0xff <= 2:
+            return 2
+        return 4
+
+    def _read_rows(self, table, types):
+        data = self._stream_data(table)
+        sizes = [self._column_size(t) for t in types]
+        row_size = sum(sizes)
+        if not row_size:
+            return []
+        num_rows = len(data) // row_size
+        columns = []
+        offset = 0
+        for col_type, size in zip(types, sizes):
+            columns.append([self._decode_value(
+                data[offset + i * size:offset + (i + 1) * size], col_type)
+                for i in range(num_rows)])
+            offset += num_rows * size
+        return list(zip(*columns))
+
+    def _decode_value(self, raw, col_type):
+        value = 0
+        for char in reversed(bytearray(raw)):
+            value = (value << 8) | char
+        if col_type & ~MSITYPE_NULLABLE == MSITYPE_STRING | MSITYPE_VALID:
+            return None
+        if col_type & MSITYPE_STRING:
+            if value >= len(self._strings):
+                raise Error("Invalid string reference %d" % value)
+            return self._strings[value]
+        if value == 0:
+            return None
+        return value - (1 << (len(raw) * 8 - 1))
+
+    def read_table(self, table):
+        """
+        Return the rows of a table, as dictionaries keyed by column name.
+        """
+        if table not in self.tables:
+            raise Error("No such table: %s" % table)
+        columns = [c for c in self._columns.get(table, [])
+                   if not c[2] & MSITYPE_TEMPORARY]
+        names = [c[1] for c in columns]
+        types = [c[2] for c in columns]
+        return [dict(zip(names, row)) for row in self._read_rows(table, types)]
+
+
+def read_tables(filename, tables):
+    """
+    Open an MSI database and read the requested tables in one go.
+
+    :param filename: path or file object of the MSI database
+    :param tables: names of the tables to read; tables missing from the
+                   database are silently skipped
+    :return: a tuple of the set of table names in the database, and a dict
+             mapping each requested table that was found to its rows
+    """
+    if hasattr(filename, "read"):
+        return _read_tables(filename, tables)
+    try:
+        fobj = open(filename, "rb")
+    except IOError as e:
+        raise Error(str(e))
+    with fobj:
+        return _read_tables(fobj, tables)
+
+
+def _read_tables(fobj, tables):
+    db = MsiDatabase(fobj)
+    return db.tables, dict((name, db.read_table(name))
+                           for name in tables if name in db.tables)
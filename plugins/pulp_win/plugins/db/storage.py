@@ -0,0 +1,137 @@
+"""
+Placing package files into storage without copying their bytes.
+
+Where the filesystem allows it, a file is moved, cloned (reflink) or hard
+linked into place, which only touches metadata; a plain copy is the
+fallback. Hard links are only made when asked for: the target shares the
+inode of the source, so whoever owns the source could change the file in
+storage, or its ownership and permissions, behind Pulp's back.
+
+The target is always written under a temporary name next to it, then
+renamed, so that a reader never sees a partial file.
+
+To survive a crash, the file's data is flushed to disk before the rename
+that makes it visible, and the directory after it, so that the storage
+path never points to a file whose contents were lost.
+"""
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import uuid
+
+_LOGGER = logging.getLogger(__name__)
+
+# ioctl(dest_fd, FICLONE, src_fd), from linux/fs.h
+FICLONE = 0x40049409
+
+RENAME = 'rename'
+REFLINK = 'reflink'
+HARDLINK = 'hardlink'
+COPY = 'copy'
+
+
+def _reflink(src, dst):
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy(src, dst):
+    shutil.copyfile(src, dst)
+
+
+def _temp_name(dst):
+    return os.path.join(os.path.dirname(dst), '.%s.%s.tmp' % (
+        os.path.basename(dst), uuid.uuid4().hex))
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def link_or_copy(src, dst, hardlink=False):
+    """
+    Make dst a file with the contents of src, replacing dst if it exists.
+    src is left alone.
+
+    A reflink is tried first, since the result is independent of src. A
+    hard link comes next, if allowed; copying is the last resort, e.g.
+    across filesystems.
+
+    :param hardlink: src belongs to Pulp, or is trusted not to change, and
+                     may share its inode with dst
+    :type  hardlink: bool
+    :return: the method that was used: REFLINK, HARDLINK or COPY
+    :rtype: str
+    """
+    _makedirs(os.path.dirname(dst))
+    tmp = _temp_name(dst)
+    methods = [(REFLINK, _reflink)]
+    if hardlink:
+        methods.append((HARDLINK, os.link))
+    for method, func in methods:
+        try:
+            func(src, tmp)
+        except (IOError, OSError) as e:
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            if e.errno == errno.ENOENT and not os.path.exists(src):
+                raise
+            _LOGGER.debug("No %s from %s to %s: %s", method, src, dst, e)
+            continue
+        break
+    else:
+        method = COPY
+        try:
+            _copy(src, tmp)
+        except Exception:
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            raise
+    try:
+        _fsync(tmp)
+        os.rename(tmp, dst)
+    except Exception:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        raise
+    _fsync(os.path.dirname(dst))
+    return method
+
+
+def move(src, dst):
+    """
+    Move src, a file nobody else uses, to dst, replacing dst if it exists.
+    A rename is all it takes on the same filesystem; otherwise src is
+    linked or copied with link_or_copy, then removed.
+
+    :return: the method that was used: RENAME, or what link_or_copy used
+    :rtype: str
+    """
+    _makedirs(os.path.dirname(dst))
+    _fsync(src)
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # src is removed right after, nobody else can reach the inode
+        method = link_or_copy(src, dst, hardlink=True)
+        os.unlink(src)
+        return method
+    _fsync(os.path.dirname(dst))
+    return RENAME
@@ -4,14 +4,17 @@ from ConfigParser import SafeConfigParser
 from gettext import gettext as _
 
 from pulp_win.common.constants import PUBLISH_HTTP_KEYWORD, \
-    PUBLISH_HTTPS_KEYWORD, PUBLISH_RELATIVE_URL_KEYWORD
+    PUBLISH_HTTPS_KEYWORD, PUBLISH_RELATIVE_URL_KEYWORD, \
+    CONFIG_CHECKSUM_TYPE, CONFIG_CHECKSUM_TYPE_DEFAULT
+from pulp_win.plugins.db.models import CHECKSUM_TYPES
 
 _LOG = logging.getLogger(__name__)
 
 REQUIRED_CONFIG_KEYS = (PUBLISH_RELATIVE_URL_KEYWORD, PUBLISH_HTTP_KEYWORD,
                         PUBLISH_HTTPS_KEYWORD)
 
-OPTIONAL_CONFIG_KEYS = ('http_publish_dir', 'https_publish_dir')
+OPTIONAL_CONFIG_KEYS = ('http_publish_dir', 'https_publish_dir',
+                        CONFIG_CHECKSUM_TYPE)
 
 ROOT_PUBLISH_DIR = '/var/lib/pulp/published/win'
 MASTER_PUBLISH_DIR = os.path.join(ROOT_PUBLISH_DIR, 'master')
@@ -94,6 +97,7 @@ def validate_config(repo, config, config_conduit):
         # optional options
         'http_publish_dir': _validate_http_publish_dir,
         'https_publish_dir': _validate_https_publish_dir,
+        CONFIG_CHECKSUM_TYPE: _validate_checksum_type,
     }
 
     # iterate through the options that have validation methods, validate them
@@ -179,6 +183,19 @@ def get_https_publish_dir(config=None):
     return publish_dir
 
 
+def get_checksum_type(config=None):
+    """
+    Get the checksum type to publish the repository metadata with.
+
+    :param config: configuration instance
+    :type  config: pulp.plugins.config.PluginCallConfiguration or None
+    :return: the checksum type
+    :rtype:  str
+    """
+    config = config or {}
+    return config.get(CONFIG_CHECKSUM_TYPE) or CONFIG_CHECKSUM_TYPE_DEFAULT
+
+
 def get_repo_relative_path(repo, config=None):
     """
     Get the configured relative path for the given repository.
@@ -228,6 +245,14 @@ def _validate_https_publish_dir(https_publish_dir, error_messages):
                                error_messages)
 
 
+def _validate_checksum_type(checksum_type, error_messages):
+    if checksum_type is None or checksum_type in CHECKSUM_TYPES:
+        return
+    msg = _('Configuration value for [%(k)s] must be one of %(v)s')
+    error_messages.append(msg % {'k': CONFIG_CHECKSUM_TYPE,
+                                 'v': ', '.join(sorted(CHECKSUM_TYPES))})
+
+
 # -- generalized validation methods -------------------------------------------
 
 
@@ -105,7 +105,9 @@ class RepomdStep(PluginStep):
         wd = self.get_working_dir()
         total = len(self.parent.publish_msi.units +
                     self.parent.publish_msm.units)
-        checksum_type = 'sha256'
+        # Package checksums of that type are served from the digests stored
+        # on each unit, files are never rehashed
+        checksum_type = configuration.get_checksum_type(self.get_config())
         with PrimaryXMLFileContext(wd, total, checksum_type) as primary:
             units = itertools.chain(self.parent.publish_msi.units,
                                     self.parent.publish_msm.units)
@@ -0,0 +1,124 @@
+"""
+Adaptive limit on the number of downloads in flight.
+
+The downloader runs a fixed number of threads, set to the highest allowed
+concurrency. Requests are handed to it through acquire(), which blocks
+while the limit is reached; every finished download calls release().
+
+The limit follows AIMD, like TCP congestion control: after each window of
+completed downloads it grows by one while throughput keeps up and no
+errors occur, and it is cut by half on errors, or by a quarter when
+throughput drops. With equal bounds, the limit stays where it is.
+"""
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class AIMDController(object):
+    # Fraction of failed downloads in a window that halves the limit
+    ERROR_RATE = 0.05
+    # Throughput, relative to the previous window, below which the limit is
+    # reduced
+    DROP = 0.75
+    DECREASE = 0.5
+    DROP_DECREASE = 0.75
+    # Changes kept in the progress report
+    HISTORY_SIZE = 50
+    # acquire() gives up waiting after that many seconds, in case a release
+    # got lost
+    WAIT_TIMEOUT = 60
+
+    def __init__(self, minimum, maximum, initial=None, report=None,
+                 clock=time.time):
+        """
+        :param report: dictionary kept up to date with the current limit
+                       and its history
+        :type  report: dict
+        """
+        if minimum < 1 or maximum < minimum:
+            raise ValueError("Invalid bounds %s-%s" % (minimum, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(maximum, initial or minimum))
+        self.clock = clock
+        self.report = report if report is not None else dict()
+        self._cond = threading.Condition()
+        self._in_flight = set()
+        self._started = clock()
+        self._reset_window()
+        self._last_throughput = None
+        self.report.update(current=self.limit, minimum=minimum,
+                           maximum=maximum, history=[[0, self.limit]])
+
+    def _reset_window(self):
+        self._window_start = self.clock()
+        self._window_bytes = 0
+        self._window_done = 0
+        self._window_errors = 0
+
+    def acquire(self, key):
+        """
+        Wait until one more download may start, then count key as in flight.
+        """
+        with self._cond:
+            deadline = self.clock() + self.WAIT_TIMEOUT
+            while len(self._in_flight) >= self.limit:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    _logger.debug("No download finished in %ss, starting %s",
+                                  self.WAIT_TIMEOUT, key)
+                    break
+                self._cond.wait(remaining)
+            self._in_flight.add(key)
+
+    def release(self, key, size=0, succeeded=True):
+        """
+        Count the download of key as finished. Keys that were not acquired
+        are ignored.
+        """
+        with self._cond:
+            if key not in self._in_flight:
+                return
+            self._in_flight.discard(key)
+            self._window_done += 1
+            self._window_bytes += size or 0
+            if not succeeded:
+                self._window_errors += 1
+            if self._window_done >= max(self.limit, 4):
+                self._adjust()
+            self._cond.notify_all()
+
+    @property
+    def in_flight(self):
+        with self._cond:
+            return len(self._in_flight)
+
+    def _adjust(self):
+        elapsed = self.clock() - self._window_start
+        throughput = self._window_bytes / elapsed if elapsed > 0 else None
+        error_rate = float(self._window_errors) / self._window_done
+        limit = self.limit
+        if error_rate > self.ERROR_RATE:
+            limit = int(limit * self.DECREASE)
+        elif (throughput is not None and self._last_throughput and
+              throughput < self._last_throughput * self.DROP):
+            limit = int(limit * self.DROP_DECREASE)
+        else:
+            limit += 1
+        self._last_throughput = throughput
+        self._reset_window()
+        self._set_limit(limit)
+
+    def _set_limit(self, limit):
+        limit = max(self.minimum, min(self.maximum, limit))
+        if limit == self.limit:
+            return
+        _logger.debug("Download concurrency: %d -> %d", self.limit, limit)
+        self.limit = limit
+        history = self.report['history']
+        history.append([round(self.clock() - self._started, 1), limit])
+        del history[:-self.HISTORY_SIZE]
+        self.report['current'] = limit
@@ -0,0 +1,888 @@
+"""
+Package downloads for the win importer.
+
+Downloads are written through a HashingFile, which computes the package's
+digests as the bytes arrive, so that neither checksum verification nor
+metadata extraction have to read the whole file back from disk.
+
+With a PartialStore, packages are downloaded into a directory that outlives
+the sync, under a name derived from their checksum. A download that did not
+complete is picked up by the next sync, which only requests the missing
+bytes with an HTTP Range request.
+
+Packages above a size threshold are split in ranges that are fetched over
+separate connections and written in place. They are hashed as well: the
+digests follow the part of the file written without gaps. The ranges
+written so far are recorded next to the file, so that the next sync only
+fetches the missing ones.
+"""
+import bisect
+import errno
+import fcntl
+import functools
+import httplib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib
+import urlparse
+
+import requests
+from nectar.report import DownloadReport
+from pulp.server import util
+from pulp.server.config import config as pulp_config
+from pulp_rpm.plugins.importers.yum.repomd import alternate
+
+from pulp_win.common import constants
+from pulp_win.plugins.db import models, storage
+from pulp_win.plugins.importers import pipeline
+
+_logger = logging.getLogger(__name__)
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _open_locked(path):
+    """
+    Open path for reading and writing, without truncating it, holding an
+    exclusive lock on it.
+
+    :return: the file object, or None if another process holds the lock
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        os.close(fd)
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return os.fdopen(fd, "r+b")
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _add_range(ranges, start, end):
+    """
+    Add [start, end) to a sorted list of disjoint (start, end) ranges,
+    merging it with the ranges it touches.
+    """
+    idx = bisect.bisect_right(ranges, (start, end))
+    if idx and ranges[idx - 1][1] >= start:
+        idx -= 1
+        start = ranges[idx][0]
+        end = max(end, ranges[idx][1])
+        del ranges[idx]
+    while idx < len(ranges) and ranges[idx][0] <= end:
+        end = max(end, ranges[idx][1])
+        del ranges[idx]
+    ranges.insert(idx, (start, end))
+
+
+class HashingFile(object):
+    """
+    Write-only file object handed to the downloader as a destination.
+
+    The file is only opened on the first write, so that queued requests do
+    not hold file descriptors. While open, it is locked; if another process
+    holds the lock, the download goes to the fallback path instead.
+
+    A completed download is marked with finish(), which keeps the file open,
+    and locked, until close(): that is only called once the file was moved
+    into place or removed. A failed download is closed with abort().
+
+    Downloads in segments write with write_at(), from several threads. The
+    ranges written so far are saved in a state file next to the file, which
+    resume() reads back.
+
+    With a BandwidthLimiter, writes wait for the bandwidth budget, which
+    slows down the downloader reading from the network.
+    """
+    STATE_SUFFIX = '.ranges'
+    # Bytes written with write_at() between two saves of the state
+    CHECKPOINT_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, path, checksum_types=models.CHECKSUM_TYPES,
+                 fallback=None, limiter=None):
+        self.name = path
+        self.limiter = limiter
+        self.fallback = fallback
+        # Set once the download was moved to the fallback path
+        self.fell_back = False
+        self.checksum_types = checksum_types
+        self._fobj = None
+        self._lock = threading.Lock()
+        # Size of the file being downloaded in segments
+        self._total = None
+        self._unsaved = 0
+        self._reset()
+        # Time of the first write and of finish(), to measure throughput
+        self.started = None
+        self.finished = None
+
+    def _reset(self):
+        self._hashers = dict((ctype, util.get_hash_object(ctype))
+                             for ctype in self.checksum_types)
+        self.size = 0
+        # Cleared if the downloader moves around in the file, in which case
+        # the digests no longer describe its contents
+        self.valid = True
+        # Ranges written past the first gap, which are hashed once the gap
+        # is filled
+        self._ranges = []
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, self.name)
+
+    def _open(self, truncate=True):
+        if self._fobj is None:
+            fobj = _open_locked(self.name)
+            if fobj is None:
+                if self.fallback is None:
+                    raise DownloadError("%s is being downloaded by another "
+                                        "process" % self.name)
+                _logger.debug("%s is locked, downloading to %s",
+                              self.name, self.fallback)
+                self.name = self.fallback
+                self.fell_back = True
+                fobj = open(self.name, "w+b")
+            elif truncate:
+                fobj.truncate(0)
+            self._fobj = fobj
+            self.started = time.time()
+        return self._fobj
+
+    @property
+    def state_path(self):
+        return self.name + self.STATE_SUFFIX
+
+    def _load_state(self):
+        """
+        :return: the size of the file a download in segments was writing,
+                 and the (start, end) ranges it wrote, or None and no
+                 ranges if there is no such download
+        :rtype: tuple
+        """
+        try:
+            with open(self.state_path) as fobj:
+                state = json.load(fobj)
+            return int(state['size']), [(int(start), int(end))
+                                        for start, end in state['ranges']]
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                _logger.warning("Unable to read %s: %s", self.state_path, e)
+        except (ValueError, KeyError, TypeError) as e:
+            _logger.warning("Ignoring invalid %s: %s", self.state_path, e)
+        return None, []
+
+    def _save_state(self):
+        if self._total is None or self.fell_back:
+            return
+        # What the state lists has to be on disk first
+        self._fobj.flush()
+        ranges = ([(0, self.size)] if self.size else []) + self._ranges
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, "w") as fobj:
+            json.dump(dict(size=self._total, ranges=ranges), fobj)
+        os.rename(tmp_path, self.state_path)
+        self._unsaved = 0
+
+    def _remove_state(self):
+        if not self.fell_back:
+            _remove(self.state_path)
+
+    def resume(self, size=None):
+        """
+        Keep what a previous download left in the file, and hash it, so that
+        only the rest needs to be downloaded.
+
+        With size, the file is to be downloaded in segments, and the ranges
+        a previous download in segments of the same file wrote are kept as
+        well; missing() tells what is left. Otherwise, the file is cut at
+        the first range that was not written.
+
+        :param size: size of the file, when downloading it in segments
+        :type  size: int
+        :return: number of bytes already downloaded, from the start of the
+                 file
+        :rtype: int
+        """
+        if self._fobj is not None:
+            return self.size
+        fobj = self._open(truncate=False)
+        if self.fell_back:
+            return 0
+        with self._lock:
+            fobj.seek(0, os.SEEK_END)
+            length = fobj.tell()
+            if os.path.exists(self.state_path):
+                total, written = self._load_state()
+            else:
+                total, written = None, [(0, length)]
+            for start, end in written:
+                end = min(end, length)
+                if start < end:
+                    _add_range(self._ranges, start, end)
+            if size is None or total != size:
+                # Only what was written from the start of the file is kept
+                prefix = self._ranges[:1]
+                if prefix and prefix[0][0] != 0:
+                    prefix = []
+                self._ranges = prefix
+                end = prefix[0][1] if prefix else 0
+                if end < length:
+                    fobj.truncate(end)
+            self._catch_up()
+            # Sequential writes go on from there
+            fobj.seek(self.size)
+            if size is None:
+                self._remove_state()
+            else:
+                self._total = size
+                self._save_state()
+            return self.size
+
+    def missing(self, size):
+        """
+        :return: the (first byte, last byte) ranges of the size bytes of the
+                 file that were not written yet
+        :rtype: list
+        """
+        with self._lock:
+            missing = []
+            pos = self.size
+            for start, end in self._ranges:
+                if start > pos:
+                    missing.append((pos, start - 1))
+                pos = max(pos, end)
+            if pos < size:
+                missing.append((pos, size - 1))
+            return missing
+
+    def _hash(self, data):
+        for hasher in self._hashers.values():
+            hasher.update(data)
+        self.size += len(data)
+
+    def _catch_up(self):
+        # Hash the ranges that now follow the hashed part without a gap,
+        # reading them back
+        while self._ranges and self._ranges[0][0] <= self.size:
+            end = self._ranges.pop(0)[1]
+            self._fobj.seek(self.size)
+            while self.size < end:
+                data = self._fobj.read(min(READ_BLOCK_SIZE, end - self.size))
+                if not data:
+                    return
+                self._hash(data)
+
+    def write(self, data):
+        if self.limiter is not None:
+            self.limiter.consume(len(data))
+        self._open().write(data)
+        self._hash(data)
+
+    def write_at(self, offset, data):
+        """
+        Write data at offset, for downloads in segments. Can be called from
+        several threads at once.
+        """
+        if self.limiter is not None:
+            self.limiter.consume(len(data))
+        end = offset + len(data)
+        with self._lock:
+            fobj = self._open(truncate=False)
+            fobj.seek(offset)
+            fobj.write(data)
+            if offset == self.size:
+                self._hash(data)
+                self._catch_up()
+            elif offset > self.size:
+                _add_range(self._ranges, offset, end)
+            else:
+                self.valid = False
+            self._unsaved += len(data)
+            if self._unsaved >= self.CHECKPOINT_SIZE:
+                self._save_state()
+
+    def checkpoint(self):
+        """
+        Save the ranges written so far, for a later resume().
+        """
+        with self._lock:
+            if self._fobj is not None:
+                self._save_state()
+
+    def tell(self):
+        return self.size
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._open().seek(offset, whence)
+        if (offset, whence) == (0, os.SEEK_SET):
+            # A restarted download overwrites the file from the beginning
+            self._reset()
+            if self._total is not None:
+                self._remove_state()
+                self._total = None
+        else:
+            self.valid = False
+
+    def truncate(self, size=None):
+        if size is None:
+            self._open().truncate()
+        else:
+            self._open().truncate(size)
+            if size != self.size:
+                self.valid = False
+
+    def flush(self):
+        if self._fobj is not None:
+            self._fobj.flush()
+
+    def finish(self):
+        """
+        Mark the download complete. The file stays locked until close().
+        """
+        # An empty download still has to leave an (empty) file behind
+        self._open(truncate=False).flush()
+        if self._total is not None:
+            self._remove_state()
+        self.finished = time.time()
+
+    def abort(self):
+        """
+        Close the file after a failed download, removing it unless it holds
+        part of the download.
+        """
+        if self._fobj is None or self._fobj.closed:
+            return
+        self._fobj.flush()
+        if not os.fstat(self._fobj.fileno()).st_size:
+            # Still locked, nobody else is using it
+            os.unlink(self.name)
+            self._remove_state()
+        elif self._total is not None:
+            with self._lock:
+                self._save_state()
+        self.close()
+
+    def close(self):
+        if self._fobj is not None and not self._fobj.closed:
+            self._fobj.close()
+            if self.finished is None:
+                self.finished = time.time()
+
+    @property
+    def elapsed(self):
+        if self.finished is None:
+            return None
+        return self.finished - self.started
+
+    @property
+    def closed(self):
+        return self._fobj is not None and self._fobj.closed
+
+    def checksums(self):
+        """
+        :return: dictionary of checksum type to hex digest of what was
+                 written, or None if it cannot be trusted
+        :rtype: dict
+        """
+        if not self.valid or self._ranges:
+            return None
+        if self._total is not None and self.size != self._total:
+            return None
+        return dict((ctype, hasher.hexdigest())
+                    for ctype, hasher in self._hashers.items())
+
+
+class RangeNotSupported(DownloadError):
+    pass
+
+
+class Throttle(object):
+    """
+    Keep a transfer, possibly spread over several threads, under max_speed
+    bytes per second.
+    """
+    def __init__(self, max_speed):
+        self.max_speed = max_speed
+        self._lock = threading.Lock()
+        self._started = None
+        self._transferred = 0
+
+    def consume(self, size):
+        if not self.max_speed:
+            return
+        with self._lock:
+            if self._started is None:
+                self._started = time.time()
+            self._transferred += size
+            delay = (self._transferred / float(self.max_speed) -
+                     (time.time() - self._started))
+        if delay > 0:
+            time.sleep(delay)
+
+
+def segments(ranges, count):
+    """
+    Split the (first byte, last byte) ranges in about count ranges of the
+    same length.
+
+    :return: list of (first byte, last byte) tuples
+    :rtype: list
+    """
+    total = sum(last - first + 1 for first, last in ranges)
+    if not total:
+        return []
+    step = -(-total // max(1, min(count, total)))
+    return [(start, min(start + step - 1, last))
+            for first, last in ranges
+            for start in range(first, last + 1, step)]
+
+
+class PartialStore(object):
+    """
+    Directory holding downloads in progress, named after the checksum of
+    the package, so that an interrupted download can be resumed by a later
+    sync. Partial files are evicted once they get too old, or, oldest
+    first, when they take too much space.
+    """
+    SUFFIX = '.part'
+    # Checksums come from the feed and end up in file names
+    _SAFE_NAME = re.compile(r'^[A-Za-z0-9]+$')
+
+    def __init__(self, path, max_age, max_size):
+        """
+        :param max_age: seconds after which an untouched partial download is
+                        removed
+        :type  max_age: int
+        :param max_size: bytes the partial downloads may use in total
+        :type  max_size: int
+        """
+        self.path = path
+        self.max_age = max_age
+        self.max_size = max_size
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Return the store for the importer configuration, or None if partial
+        downloads are not to be kept.
+        """
+        max_size = int(config.get(
+            constants.CONFIG_PARTIAL_MAX_SIZE,
+            constants.CONFIG_PARTIAL_MAX_SIZE_DEFAULT))
+        if max_size <= 0:
+            return None
+        max_age = int(config.get(
+            constants.CONFIG_PARTIAL_MAX_AGE,
+            constants.CONFIG_PARTIAL_MAX_AGE_DEFAULT))
+        path = config.get(constants.CONFIG_PARTIAL_DIR)
+        if not path:
+            path = os.path.join(
+                pulp_config.get('server', 'working_directory'),
+                'win_partial_downloads')
+        return cls(path, max_age, max_size)
+
+    def path_for(self, unit):
+        """
+        :return: path of the partial download for the unit, or None if its
+                 checksum cannot be used as a file name
+        :rtype: str
+        """
+        if not (self._SAFE_NAME.match(unit.checksumtype or '') and
+                self._SAFE_NAME.match(unit.checksum or '')):
+            return None
+        return os.path.join(self.path, '%s-%s%s' % (
+            unit.checksumtype, unit.checksum, self.SUFFIX))
+
+    def evict(self, now=None):
+        """
+        Remove the partial downloads that are too old, then the oldest ones
+        until they fit in max_size. Files being downloaded are left alone.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        if now is None:
+            now = time.time()
+        entries = []
+        state_suffix = self.SUFFIX + HashingFile.STATE_SUFFIX
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.endswith(state_suffix):
+                # Left behind by a partial download removed by hand
+                if not os.path.exists(path[:-len(HashingFile.STATE_SUFFIX)]):
+                    _remove(path)
+                continue
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        cutoff = now - self.max_age
+        removed = 0
+        for mtime, size, path in entries:
+            if mtime >= cutoff and total <= self.max_size:
+                break
+            fobj = _open_locked(path)
+            if fobj is None:
+                continue
+            with fobj:
+                _remove(path + HashingFile.STATE_SUFFIX)
+                os.unlink(path)
+            total -= size
+            removed += 1
+        if removed:
+            _logger.info("Removed %d partial downloads from %s",
+                         removed, self.path)
+        return removed
+
+
+class RangeFetcher(object):
+    """
+    Download a file with requests, continuing where a HashingFile left off.
+    The session is set up from the nectar configuration of the sync.
+
+    Like nectar's downloaders, each file is downloaded at most at its share
+    of max_speed.
+    """
+    CHUNK_SIZE = 64 * 1024
+    _COMPLETE_RANGE = re.compile(r'^bytes \*/(\d+)$')
+
+    def __init__(self, nectar_config):
+        self.config = nectar_config
+        self.session = self._build_session(nectar_config)
+        self.max_speed = None
+        if getattr(nectar_config, 'max_speed', None):
+            self.max_speed = float(nectar_config.max_speed) / (
+                getattr(nectar_config, 'max_concurrent', None) or 1)
+
+    @classmethod
+    def _build_session(cls, config):
+        def option(name):
+            return getattr(config, name, None)
+
+        session = requests.Session()
+        if option('ssl_validation') is False:
+            session.verify = False
+        elif option('ssl_ca_cert_path'):
+            session.verify = option('ssl_ca_cert_path')
+        if option('ssl_client_cert_path'):
+            if option('ssl_client_key_path'):
+                session.cert = (option('ssl_client_cert_path'),
+                                option('ssl_client_key_path'))
+            else:
+                session.cert = option('ssl_client_cert_path')
+        if option('basic_auth_username'):
+            session.auth = (option('basic_auth_username'),
+                            option('basic_auth_password'))
+        if option('proxy_url'):
+            scheme, netloc = option('proxy_url').split('://', 1)
+            if option('proxy_username'):
+                netloc = '%s:%s@%s' % (option('proxy_username'),
+                                       option('proxy_password'), netloc)
+            if option('proxy_port'):
+                netloc = '%s:%s' % (netloc, option('proxy_port'))
+            proxy = '%s://%s' % (scheme, netloc)
+            session.proxies = dict(http=proxy, https=proxy)
+        session.headers.update(option('headers') or {})
+        return session
+
+    def _get(self, url, headers):
+        return self.session.get(
+            url, headers=headers, stream=True,
+            timeout=(getattr(self.config, 'connect_timeout', None),
+                     getattr(self.config, 'read_timeout', None)))
+
+    def fetch_segments(self, url, dest, size, count):
+        """
+        Download the size bytes of url into dest, in count ranges fetched
+        at once, each written in place. What a previous download in
+        segments wrote into dest is kept, and only the rest is fetched.
+
+        :type dest: HashingFile
+        :raises RangeNotSupported: if the server ignores the Range header
+        """
+        dest.resume(size)
+        bounds = segments(dest.missing(size), count)
+        if not bounds:
+            return
+        errors = []
+        # The segments share the file's share of max_speed
+        throttle = Throttle(self.max_speed)
+
+        def fetch_range(bounds):
+            try:
+                self.fetch_range(url, dest, *bounds, throttle=throttle)
+            except Exception as e:
+                errors.append(e)
+
+        try:
+            with pipeline.WorkerPool(fetch_range, len(bounds)) as pool:
+                for item in bounds:
+                    pool.put(item)
+        finally:
+            dest.checkpoint()
+        for error in errors:
+            if isinstance(error, RangeNotSupported):
+                raise error
+        if errors:
+            raise errors[0]
+        missing = dest.missing(size)
+        if missing:
+            raise DownloadError("%s: bytes %d-%d missing" % (
+                url, missing[0][0], missing[0][1]))
+
+    def fetch_range(self, url, dest, first, last, throttle=None):
+        """
+        Write bytes first to last (included) of url at the same offset in
+        dest.
+
+        :type dest: HashingFile
+        """
+        if throttle is None:
+            throttle = Throttle(self.max_speed)
+        response = self._get(url, {'Range': 'bytes=%d-%d' % (first, last)})
+        try:
+            if response.status_code != httplib.PARTIAL_CONTENT:
+                if response.status_code == httplib.OK:
+                    raise RangeNotSupported("%s: Range not supported" % url)
+                raise DownloadError("%s: HTTP %s" % (
+                    url, response.status_code))
+            content_range = response.headers.get('Content-Range', '')
+            if not content_range.startswith('bytes %d-%d/' % (first, last)):
+                raise DownloadError("%s: unexpected Content-Range %r" %
+                                    (url, content_range))
+            offset = first
+            for chunk in response.iter_content(self.CHUNK_SIZE):
+                chunk = chunk[:last + 1 - offset]
+                if not chunk:
+                    break
+                throttle.consume(len(chunk))
+                dest.write_at(offset, chunk)
+                offset += len(chunk)
+            if offset <= last:
+                raise DownloadError("%s: %d bytes missing at %d" % (
+                    url, last + 1 - offset, offset))
+        finally:
+            response.close()
+
+    def fetch(self, url, dest, size=None):
+        """
+        Download url into dest, only asking for the bytes dest does not hold
+        yet. If the server does not honor the Range request, dest is
+        overwritten with the whole file.
+
+        :type dest: HashingFile
+        :param size: size of the file according to the metadata, if known
+        :type  size: int
+        """
+        offset = dest.size
+        headers = dict()
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        response = self._get(url, headers)
+        try:
+            status = response.status_code
+            if offset and status == httplib.REQUESTED_RANGE_NOT_SATISFIABLE:
+                match = self._COMPLETE_RANGE.match(
+                    response.headers.get('Content-Range', ''))
+                total = int(match.group(1)) if match else size
+                if total == offset:
+                    # Nothing past the end of the file: it was all there
+                    _logger.debug("%s: already downloaded", url)
+                    return
+                # What was kept is no prefix of the file; start over
+                dest.seek(0)
+                dest.truncate()
+                return self.fetch(url, dest, size)
+            if status == httplib.PARTIAL_CONTENT and offset:
+                content_range = response.headers.get('Content-Range', '')
+                if not content_range.startswith('bytes %d-' % offset):
+                    raise DownloadError("%s: unexpected Content-Range %r" %
+                                        (url, content_range))
+            elif status == httplib.OK:
+                if offset:
+                    _logger.debug("%s: Range not supported", url)
+                    dest.seek(0)
+                    dest.truncate()
+            else:
+                raise DownloadError("%s: HTTP %s" % (url, status))
+            throttle = Throttle(self.max_speed)
+            for chunk in response.iter_content(self.CHUNK_SIZE):
+                throttle.consume(len(chunk))
+                dest.write(chunk)
+        finally:
+            response.close()
+
+
+class Packages(alternate.Packages):
+    """
+    Download packages into HashingFile destinations.
+
+    If mirrors are given, each package is fetched from one of them, picked
+    at random with a probability that follows the mirror's score.
+
+    Packages with a partial download to resume, and packages of at least
+    segment_threshold bytes, which are fetched as segment_count ranges, are
+    not given to the downloader: they are handed to a pool of as many
+    threads, in the order of the requests and under the same concurrency
+    limit.
+
+    Packages from a local (file://) feed are not given to the downloader
+    either: they are reflinked into the working directory, or hard linked if
+    hardlink_local is set, and only copied if the filesystem does not allow
+    that.
+
+    With an AIMDController, requests are only handed to the downloader, or
+    to the pool, while the controller's limit allows another download in
+    flight.
+    """
+    def __init__(self, base_url, nectar_config, units, dst_dir, listener,
+                 *args, **kwargs):
+        self.mirrors = kwargs.pop('mirrors', None)
+        self.mirror_scores = kwargs.pop('mirror_scores', None)
+        self.partials = kwargs.pop('partials', None)
+        self.segment_threshold = kwargs.pop('segment_threshold', 0)
+        self.segment_count = kwargs.pop('segment_count', 1)
+        self.concurrency = kwargs.pop('concurrency', None)
+        self.limiter = kwargs.pop('limiter', None)
+        self.hardlink_local = kwargs.pop('hardlink_local', False)
+        super(Packages, self).__init__(base_url, nectar_config, units,
+                                       dst_dir, listener, *args, **kwargs)
+        self.feed_url = base_url
+        self.win_nectar_config = nectar_config
+        self.event_listener = listener
+        # Set while download_packages runs: the pool resuming partial
+        # downloads and downloading in segments, and its fetcher
+        self._pool = None
+        self._fetcher = None
+        # Requests for file:// urls, linked into place instead
+        self._local = []
+
+    def get_requests(self):
+        for request in super(Packages, self).get_requests():
+            if self.mirrors and len(self.mirrors) > 1:
+                request.url = self._mirror_url(request.url)
+            if request.url.startswith('file://'):
+                self._local.append(request)
+                continue
+            if self.concurrency is not None:
+                # Released by the listener when the download finishes
+                self.concurrency.acquire(request.url)
+            if isinstance(request.destination, basestring):
+                request.destination = self._destination(request)
+            if self._is_large(request.data):
+                self._pool.put(functools.partial(
+                    self._fetch, request,
+                    functools.partial(self._fetch_segments, request)))
+            elif request.destination.size:
+                self._pool.put(functools.partial(self._resume, request))
+            else:
+                yield request
+
+    def _is_large(self, unit):
+        if not self.segment_threshold or self.segment_count < 2:
+            return False
+        return (unit.size or 0) >= self.segment_threshold
+
+    def _destination(self, request):
+        path = None
+        if self.partials is not None:
+            path = self.partials.path_for(request.data)
+        if path is None:
+            return HashingFile(request.destination, limiter=self.limiter)
+        dest = HashingFile(path, fallback=request.destination,
+                           limiter=self.limiter)
+        # Downloads in segments are resumed by the pool
+        if (not self._is_large(request.data) and os.path.exists(path) and
+                os.path.getsize(path)):
+            dest.resume()
+        return dest
+
+    def download_packages(self):
+        if self.partials is not None:
+            self.partials.evict()
+        workers = getattr(self.win_nectar_config, 'max_concurrent', None)
+        self._fetcher = RangeFetcher(self.win_nectar_config)
+        self._pool = pipeline.WorkerPool(lambda job: job(), workers or 1)
+        try:
+            with self._pool:
+                super(Packages, self).download_packages()
+        finally:
+            self._pool = None
+        if self._local:
+            self._download_local()
+
+    def _resume(self, request):
+        _logger.info("Resuming %s at byte %d", request.url,
+                     request.destination.size)
+        self._fetch(request, functools.partial(self._fetcher.fetch,
+                                               size=request.data.size))
+
+    def _fetch_segments(self, request, url, dest):
+        _logger.info("Downloading %s in %d segments", url, self.segment_count)
+        try:
+            self._fetcher.fetch_segments(url, dest, request.data.size,
+                                         self.segment_count)
+        except RangeNotSupported as e:
+            _logger.info("%s, downloading it in one piece", e)
+            dest.seek(0)
+            dest.truncate()
+            self._fetcher.fetch(url, dest, request.data.size)
+
+    def _download_local(self):
+        requests, self._local = self._local, []
+        for request in requests:
+            self._fetch(request, self._fetch_local)
+
+    def _fetch_local(self, url, path):
+        src = urllib.unquote(urlparse.urlparse(url).path)
+        method = storage.link_or_copy(src, path,
+                                      hardlink=self.hardlink_local)
+        _logger.debug("Fetched %s (%s)", src, method)
+
+    def _fetch(self, request, fetch):
+        """
+        Call fetch(url, destination) for the request and report the outcome
+        to the listener, the way the downloader does.
+        """
+        try:
+            fetch(request.url, request.destination)
+        except Exception as e:
+            _logger.warning("Unable to download %s: %s", request.url, e)
+            report = DownloadReport(request.url, request.destination,
+                                    data=request.data)
+            report.error_msg = str(e)
+            report.download_failed()
+            self.event_listener.download_failed(report)
+        else:
+            report = DownloadReport(request.url, request.destination,
+                                    data=request.data)
+            report.download_succeeded()
+            self.event_listener.download_succeeded(report)
+
+    def _mirror_url(self, url):
+        prefix = self.feed_url.rstrip('/') + '/'
+        if not url.startswith(prefix):
+            return url
+        mirror = self.mirror_scores.choose(self.mirrors)
+        return mirror.rstrip('/') + '/' + url[len(prefix):]
@@ -7,6 +7,7 @@ from pulp.server.db import model as platform_models
 from gettext import gettext as _
 from pulp_win.common.ids import SUPPORTED_TYPES, TYPE_ID_IMPORTER_WIN
 from pulp_win.plugins.db import models
+from pulp_win.plugins.db.cache import MetadataCache
 from pulp_win.plugins.importers import sync
 
 _LOG = logging.getLogger(__name__)
@@ -59,12 +60,17 @@ class WinImporter(Importer):
         unit_data.update(metadata or {})
         unit_data.update(unit_key or {})
 
+        cache = MetadataCache.from_config(config)
         try:
-            unit = model_class.from_file(file_path, unit_data)
+            unit = model_class.from_file(file_path, unit_data, cache=cache)
         except models.Error as e:
             return self.fail_report(str(e))
+        finally:
+            if cache is not None:
+                cache.flush()
 
-        unit = unit.save_and_associate(file_path, repo)
+        # The staging file belongs to Pulp, which removes it afterwards
+        unit = unit.save_and_associate(file_path, repo, owned=True)
         return dict(success_flag=True, summary="",
                     details=dict(
                         unit=dict(unit_key=unit.unit_key,
@@ -0,0 +1,74 @@
+"""
+Bounded producer/consumer stage for work that should not run in the
+downloader's threads.
+
+Producers block in put() once max_pending items are waiting, which bounds
+the number of downloaded files sitting in the working directory.
+"""
+import logging
+import Queue
+import threading
+
+_logger = logging.getLogger(__name__)
+
+# Tells a worker thread to exit
+_STOP = object()
+
+
+class WorkerPool(object):
+    def __init__(self, handler, workers, max_pending=None):
+        """
+        :param handler: callable invoked with each item, from a worker thread
+        :param workers: number of worker threads
+        :type  workers: int
+        :param max_pending: number of queued items after which put() blocks;
+                            defaults to twice the number of workers
+        :type  max_pending: int
+        """
+        if workers < 1:
+            raise ValueError("At least one worker is needed")
+        self.handler = handler
+        self.workers = workers
+        self._queue = Queue.Queue(maxsize=max_pending or 2 * workers)
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def start(self):
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._run,
+                                      name="%s-%d" % (__name__, idx))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item):
+        """
+        Queue an item, waiting for room if the workers are behind.
+        """
+        self._queue.put(item)
+
+    def close(self):
+        """
+        Wait for all queued items to be processed, then stop the workers.
+        """
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            try:
+                self.handler(item)
+            except Exception:
+                _logger.exception("Error processing %r", item)
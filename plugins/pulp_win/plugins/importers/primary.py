@@ -0,0 +1,107 @@
+"""
+Streaming parser for the primary.xml of a win repository.
+
+Elements are discarded as soon as each package has been consumed, and
+every package is returned as a light PackageInfo tuple instead of a full
+model instance, so the memory used by the parser does not depend on the
+size of the feed.
+"""
+from collections import namedtuple
+
+import mongoengine
+
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:  # pragma: no cover
+    from xml.etree.ElementTree import iterparse
+
+COMMON_SPEC_URL = 'http://linux.duke.edu/metadata/common'
+PACKAGE_TAG = '{%s}package' % COMMON_SPEC_URL
+
+# unit_key holds the values of the model's unit_key_fields, in that order, so
+# it compares equal to the model's unit_key_as_named_tuple. fields holds
+# everything needed to instantiate the model.
+PackageInfo = namedtuple('PackageInfo', 'model_class unit_key size fields')
+
+
+class UnsupportedPackageType(ValueError):
+    pass
+
+
+def _tag(name):
+    return '{%s}%s' % (COMMON_SPEC_URL, name)
+
+
+def dispatch_table(model_class):
+    """
+    Map the tags of a package's child elements to the model's field names.
+    """
+    table = dict()
+    for fname in model_class._fields:
+        if fname.startswith('_'):
+            continue
+        table[_tag(fname)] = fname
+    table[_tag('size')] = 'size'
+    if 'relativepath' in model_class._fields:
+        table[_tag('location')] = 'location'
+    return table
+
+
+def iter_packages(fobj, type_class_map):
+    """
+    Parse primary.xml incrementally.
+
+    :param fobj: file object for primary.xml
+    :param type_class_map: dictionary of package type to model class
+    :return: generator of PackageInfo, in document order
+    """
+    tables = dict((type_id, dispatch_table(model_class))
+                  for type_id, model_class in type_class_map.items())
+    context = iterparse(fobj, events=('start', 'end'))
+    _, root = next(context)
+    table = None
+    fields = None
+    for event, el in context:
+        tag = el.tag
+        if event == 'start':
+            if tag == PACKAGE_TAG:
+                pkg_type = el.attrib.get('type')
+                table = tables.get(pkg_type)
+                if table is None:
+                    raise UnsupportedPackageType(
+                        "Unsupported package type %s" % pkg_type)
+                model_class = type_class_map[pkg_type]
+                fields = dict()
+            continue
+        if tag == PACKAGE_TAG:
+            fields['filename'] = model_class.filename_from_unit_key(fields)
+            # Unknown, rather than the field's default
+            for fname in model_class.EXTRACTED_FIELDS:
+                fields.setdefault(fname, None)
+            unit_key = tuple(fields.get(k)
+                             for k in model_class.unit_key_fields)
+            yield PackageInfo(model_class, unit_key, fields.get('size'),
+                              fields)
+            fields = table = None
+            # Drop the package, and with it all its child elements
+            root.clear()
+            continue
+        if table is None:
+            continue
+        fname = table.get(tag)
+        if fname is None:
+            continue
+        if fname == 'size':
+            try:
+                fields[fname] = int(el.attrib.get('package', 0))
+            except ValueError:
+                fields[fname] = 0
+        elif fname == 'location':
+            fields['relativepath'] = el.attrib['href']
+        elif isinstance(model_class._fields[fname], mongoengine.ListField):
+            # One child element per entry, with the entry in its attributes
+            fields[fname] = [dict(child.attrib) for child in el]
+        else:
+            fields[fname] = el.text
+            if fname == 'checksum' and 'type' in el.attrib:
+                fields['checksumtype'] = el.attrib['type']
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 
+from contextlib import contextmanager
 from gettext import gettext as _
+import bisect
 import logging
+import threading
+import time
 
 from pulp_win.common import constants
 from pulp_win.plugins.db import models
@@ -33,13 +37,19 @@ class DistributionReport(dict):
 
 
 class ContentReport(dict):
-    def __init__(self):
+    def __init__(self, lock=None):
+        # Downloaded units are processed by several threads
+        self.lock = lock or threading.RLock()
         self['error_details'] = []
         self['items_total'] = 0
         self['items_left'] = 0
         self['size_total'] = 0
         self['size_left'] = 0
         self['state'] = constants.STATE_NOT_STARTED
+        # Progress updates that were not written, see ProgressThrottle
+        self['updates_suppressed'] = 0
+        self['phases'] = {}
+        self.timings = PhaseTimings(self['phases'], self.lock)
         self['details'] = {
             'msi_done': 0,
             'msi_total': 0,
@@ -56,19 +66,178 @@ class ContentReport(dict):
             self['details'][total_name] = counts[total_type]
 
     def success(self, model):
-        self['items_left'] -= 1
-        if self['items_left'] % 100 == 0:
-            _logger.debug(_('%(n)s items left to download.') %
-                          {'n': self['items_left']})
-        self['size_left'] -= model.size
-        done_attribute = type_done_map[model._content_type_id]
-        self['details'][done_attribute] += 1
+        with self.lock:
+            self['items_left'] -= 1
+            if self['items_left'] % 100 == 0:
+                _logger.debug(_('%(n)s items left to download.') %
+                              {'n': self['items_left']})
+            self['size_left'] -= model.size
+            done_attribute = type_done_map[model._content_type_id]
+            self['details'][done_attribute] += 1
         return self
 
     def failure(self, model, error_report):
-        self['items_left'] -= 1
-        self['size_left'] -= model.size
-        done_attribute = type_done_map[model._content_type_id]
-        self['details'][done_attribute] += 1
-        self['error_details'].append(error_report)
+        with self.lock:
+            self['items_left'] -= 1
+            self['size_left'] -= model.size
+            done_attribute = type_done_map[model._content_type_id]
+            self['details'][done_attribute] += 1
+            self['error_details'].append(error_report)
         return self
+
+
+class ProgressThrottle(object):
+    """
+    Decide which progress updates get written. Writing every one of them
+    costs a database write per unit, which dominates syncs of many small
+    packages from a fast feed.
+
+    An update is written if interval seconds passed since the last write,
+    if batch updates were held back since, or if a state changed.
+    """
+    def __init__(self, interval, batch, clock=time.time):
+        self.interval = interval
+        self.batch = batch
+        self.clock = clock
+        self.pending = 0
+        self._last_time = None
+        self._last_states = None
+
+    def ready(self, states, force=False):
+        """
+        :param states: the states in the progress report
+        :type  states: tuple
+        :param force: write the update regardless
+        :type  force: bool
+        :return: whether to write this update; if so, the caller must write
+                 it, since it counts as the last one written
+        :rtype: bool
+        """
+        now = self.clock()
+        if (force or self.interval <= 0 or states != self._last_states or
+                self._last_time is None or
+                now - self._last_time >= self.interval or
+                self.pending + 1 >= self.batch):
+            self._last_time = now
+            self._last_states = states
+            self.pending = 0
+            return True
+        self.pending += 1
+        return False
+
+
+class LatencyHistogram(object):
+    """
+    Latencies counted in buckets whose bounds double, from 1ms to about a
+    minute, so that percentiles can be estimated in constant memory. The
+    estimate is the upper bound of the bucket the percentile falls in.
+    """
+    BOUNDS = tuple(0.001 * 2 ** i for i in range(17))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        rank = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(self.BOUNDS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return dict(p50=round(self.percentile(0.5), 3),
+                    p90=round(self.percentile(0.9), 3),
+                    p99=round(self.percentile(0.99), 3),
+                    max=round(self.max, 3))
+
+
+class PhaseTimings(object):
+    """
+    Time spent in each phase of a sync, with the units and bytes it
+    processed, kept up to date in a dictionary of the progress report.
+
+    Phases run by the sync itself (metadata, parse, existence_check,
+    download) are measured in wall time. Phases run once per unit,
+    possibly from several threads at once (verification, extraction,
+    db_write), add up the time spent on each unit; extraction also keeps
+    the distribution of its per-unit latency.
+    """
+    def __init__(self, phases, lock):
+        """
+        :param phases: dictionary to fill, keyed by phase name
+        :type  phases: dict
+        """
+        self.phases = phases
+        self.lock = lock
+        self._totals = dict()
+        self._latencies = dict()
+
+    def record(self, phase, seconds, units=0, size=0, latency=False):
+        """
+        :param latency: add seconds to the phase's latency distribution
+        :type  latency: bool
+        """
+        with self.lock:
+            if latency:
+                histogram = self._latencies.setdefault(
+                    phase, LatencyHistogram())
+                histogram.add(seconds)
+            totals = self._totals.setdefault(phase, [0.0, 0, 0])
+            totals[0] += seconds
+            totals[1] += units
+            totals[2] += size or 0
+            seconds, units, size = totals
+            entry = dict(seconds=round(seconds, 3), units=units, bytes=size)
+            if seconds > 0:
+                entry['units_per_sec'] = round(units / seconds, 1)
+                entry['bytes_per_sec'] = int(size / seconds)
+            if phase in self._latencies:
+                entry['latency'] = self._latencies[phase].summary()
+            self.phases[phase] = entry
+
+    def count(self, phase, units=0, size=0):
+        """
+        Add units and bytes to a phase whose time is recorded separately.
+        """
+        self.record(phase, 0, units=units, size=size)
+
+    @contextmanager
+    def timed(self, phase, units=0, size=0, latency=False):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(phase, time.time() - start, units=units, size=size,
+                        latency=latency)
+
+    def timed_iter(self, phase, iterable, every=1000):
+        """
+        Iterate, recording the time spent producing the items, once every
+        so many items.
+        """
+        iterator = iter(iterable)
+        seconds = 0.0
+        units = 0
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.record(phase, seconds + time.time() - start, units)
+                return
+            seconds += time.time() - start
+            units += 1
+            if units >= every:
+                self.record(phase, seconds, units)
+                seconds = 0.0
+                units = 0
+            yield item
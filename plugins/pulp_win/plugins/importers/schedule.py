@@ -0,0 +1,102 @@
+"""
+Order in which packages are handed to the downloader.
+
+A few very large packages that happen to start last keep the sync running
+long after everything else is done. Starting with the largest ones lets
+the small ones fill the gaps at the end:
+
+- largest_first: decreasing size.
+- lpt: longest processing time first, spread over the download slots: the
+  packages are assigned, largest first, to the slot with the least bytes
+  so far, and the slots are then taken in turn, so that every slot starts
+  with its largest package.
+- feed: the order of primary.xml.
+
+Any order can interleave a few of the smallest packages after each of the
+others, so that units keep being added while large ones download.
+"""
+import heapq
+import logging
+
+_logger = logging.getLogger(__name__)
+
+FEED = 'feed'
+LARGEST_FIRST = 'largest_first'
+LPT = 'lpt'
+POLICIES = (FEED, LARGEST_FIRST, LPT)
+
+
+def _size(unit):
+    return unit.size or 0
+
+
+def largest_first(units):
+    return sorted(units, key=_size, reverse=True)
+
+
+def lpt(units, slots):
+    """
+    :return: the units, taking the slots' assignments in turn
+    :rtype: list
+    """
+    bins = [[] for _ in range(max(1, slots))]
+    loads = [(0, idx) for idx in range(len(bins))]
+    for unit in largest_first(units):
+        load, idx = heapq.heappop(loads)
+        bins[idx].append(unit)
+        heapq.heappush(loads, (load + _size(unit), idx))
+    ret = []
+    for rank in range(max(len(b) for b in bins) if units else 0):
+        ret.extend(b[rank] for b in bins if rank < len(b))
+    return ret
+
+
+def interleave(units, count):
+    """
+    Follow each unit with the count smallest units left, the others keeping
+    their order.
+    """
+    units = list(units)
+    if count <= 0:
+        return units
+    smallest = sorted(range(len(units)), key=lambda idx: _size(units[idx]))
+    taken = [False] * len(units)
+    ret = []
+    pos = 0
+    for idx, unit in enumerate(units):
+        if taken[idx]:
+            continue
+        taken[idx] = True
+        ret.append(unit)
+        added = 0
+        while pos < len(smallest) and added < count:
+            small_idx = smallest[pos]
+            pos += 1
+            if not taken[small_idx]:
+                taken[small_idx] = True
+                ret.append(units[small_idx])
+                added += 1
+    return ret
+
+
+def order(units, policy, slots=1, small=0):
+    """
+    :param units: units to download, with their size
+    :type  units: iterable
+    :param policy: one of POLICIES
+    :type  policy: str
+    :param slots: number of downloads at once
+    :type  slots: int
+    :param small: number of small units after each large one
+    :type  small: int
+    :return: the units, in download order
+    :rtype: list
+    """
+    if policy == LARGEST_FIRST:
+        units = largest_first(units)
+    elif policy == LPT:
+        units = lpt(units, slots)
+    elif policy != FEED:
+        _logger.warning("Unknown download order %r, using %r",
+                        policy, FEED)
+    return interleave(units, small)
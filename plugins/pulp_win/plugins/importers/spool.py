@@ -0,0 +1,98 @@
+"""
+Sorted set of strings that may not fit in memory.
+
+Values are kept in memory until there are max_items of them, then sorted
+and written out as a run in a temporary file. Iterating merges the runs,
+so memory use depends on the number of runs, not on the number of values.
+"""
+import heapq
+import tempfile
+import threading
+
+
+class SortedSpool(object):
+    def __init__(self, dir=None, max_items=100000):
+        """
+        :param dir: directory for the temporary files
+        :type  dir: str
+        :param max_items: number of values kept in memory
+        :type  max_items: int
+        """
+        self.dir = dir
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def add(self, value):
+        """
+        :param value: string without newlines
+        :type  value: basestring
+        """
+        with self._lock:
+            self._buffer.append(value)
+            if len(self._buffer) >= self.max_items:
+                self._spill()
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def _spill(self):
+        run = tempfile.TemporaryFile(dir=self.dir, prefix='spool-')
+        for value in sorted(set(self._buffer)):
+            run.write(value.encode('utf-8') + '\n')
+        run.flush()
+        self._runs.append(run)
+        self._buffer = []
+
+    @classmethod
+    def _read(cls, run):
+        run.seek(0)
+        for line in run:
+            yield line[:-1].decode('utf-8')
+
+    def __iter__(self):
+        """
+        :return: generator of the values, sorted, without duplicates
+        """
+        with self._lock:
+            buffer = sorted(set(self._buffer))
+            runs = list(self._runs)
+        previous = None
+        for value in heapq.merge(buffer, *[self._read(run) for run in runs]):
+            if value != previous:
+                yield value
+                previous = value
+
+    def close(self):
+        with self._lock:
+            for run in self._runs:
+                run.close()
+            self._runs = []
+            self._buffer = []
+
+
+def difference(items, keys):
+    """
+    Merge two sorted streams, yielding the items that are not in keys.
+
+    :param items: sorted values
+    :type  items: iterable
+    :param keys: sorted values
+    :type  keys: iterable
+    :return: generator of values from items
+    """
+    keys = iter(keys)
+    current = next(keys, None)
+    for item in items:
+        while current is not None and current < item:
+            current = next(keys, None)
+        if current != item:
+            yield item
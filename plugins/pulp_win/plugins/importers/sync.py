@@ -1,25 +1,45 @@
 import logging
+import os
+import Queue
+import random
 import shutil
 import tempfile
+import threading
+import time
+import traceback
 from gettext import gettext as _
 
 from pulp.common.plugins import importer_constants
 from pulp.plugins.util import verification
-from pulp.server.controllers import units as units_controller
 from pulp.server.exceptions import PulpCodedException
 from pulp.server import util
 
+from pulp_win.common import constants
 from pulp_win.plugins.db import models
-from pulp_win.plugins.importers.report import ContentReport
+from pulp_win.plugins.db.bandwidth import BandwidthLimiter
+from pulp_win.plugins.db.cache import MetadataCache
+from pulp_win.plugins.db.inflight import InFlightRegistry
+from pulp_win.plugins.db.mirrors import MirrorScores
+from pulp_win.plugins.importers import concurrency
+from pulp_win.plugins.importers import download as win_download
+from pulp_win.plugins.importers import pipeline
+from pulp_win.plugins.importers import primary as win_primary
+from pulp_win.plugins.importers import schedule
+from pulp_win.plugins.importers import spool
+from pulp_win.plugins.importers.report import ContentReport, ProgressThrottle
 
 from pulp_rpm.plugins import error_codes
 from pulp_rpm.plugins.importers.yum.listener import PackageListener
-from pulp_rpm.plugins.importers.yum.repomd import alternate, packages, primary
+from pulp_rpm.plugins.importers.yum.repomd import metadata, primary
 from pulp_rpm.plugins.importers.yum import sync as yumsync
 
 _logger = logging.getLogger(__name__)
 
 
+# Scratchpad key for the upstream state seen by the last successful sync
+UPSTREAM_FINGERPRINT_KEY = 'win_upstream_fingerprint'
+
+
 class CancelException(Exception):
     pass
 
@@ -30,16 +50,74 @@ class RepoSync(yumsync.RepoSync):
         models.MSI.TYPE_ID: models.MSI,
         models.MSM.TYPE_ID: models.MSM,
     }
+    # Number of upstream packages checked against the database at once
+    DECIDE_BATCH_SIZE = 5000
+    # Number of fileless units saved and associated with one bulk write
+    SAVE_BATCH_SIZE = 1000
+    # Seconds between two checks on the downloads of other syncs
+    INFLIGHT_POLL_INTERVAL = 5
+    # Settings that change what a sync does with the same upstream
+    # repository: after changing one, the next sync processes it again
+    FINGERPRINT_SETTINGS = [
+        (constants.CONFIG_REMOVE_MISSING_UNITS,
+         constants.CONFIG_REMOVE_MISSING_UNITS_DEFAULT),
+    ]
 
     def __init__(self, *args, **kwargs):
+        # Guards the progress report, which is updated from the threads
+        # processing downloaded units
+        self._progress_lock = threading.RLock()
         super(RepoSync, self).__init__(*args, **kwargs)
-        self.content_report = ContentReport()
+        self.content_report = ContentReport(lock=self._progress_lock)
+        self.progress_throttle = ProgressThrottle(
+            float(self.config.get(constants.CONFIG_PROGRESS_INTERVAL,
+                                  constants.CONFIG_PROGRESS_INTERVAL_DEFAULT)),
+            int(self.config.get(constants.CONFIG_PROGRESS_BATCH,
+                                constants.CONFIG_PROGRESS_BATCH_DEFAULT)))
         self.progress_report = {
             'metadata': {'state': 'NOT_STARTED'},
             'content': self.content_report,
         }
         # Enforce validation of downloaded content
         self.config.override_config[importer_constants.KEY_VALIDATE] = True
+        self.metadata_cache = MetadataCache.from_config(self.config)
+        # Upstream state, recorded on success for the next sync to compare
+        self._fingerprint = None
+        self.remove_missing = bool(self.config.get(
+            constants.CONFIG_REMOVE_MISSING_UNITS,
+            constants.CONFIG_REMOVE_MISSING_UNITS_DEFAULT))
+        # Ids of the units upstream lists, when missing ones are removed
+        self._upstream_ids = None
+        self.trust_upstream_metadata = bool(self.config.get(
+            constants.CONFIG_TRUST_UPSTREAM_METADATA,
+            constants.CONFIG_TRUST_UPSTREAM_METADATA_DEFAULT))
+        self.trust_sample_rate = float(self.config.get(
+            constants.CONFIG_TRUST_SAMPLE_RATE,
+            constants.CONFIG_TRUST_SAMPLE_RATE_DEFAULT))
+        self.mirror_race_count = int(self.config.get(
+            constants.CONFIG_MIRROR_RACE_COUNT,
+            constants.CONFIG_MIRROR_RACE_COUNT_DEFAULT))
+        self.adaptive_concurrency = bool(self.config.get(
+            constants.CONFIG_ADAPTIVE_CONCURRENCY,
+            constants.CONFIG_ADAPTIVE_CONCURRENCY_DEFAULT))
+        # Set for the duration of download()
+        self.concurrency = None
+        # Claims on the packages this sync downloads
+        self.inflight = None
+        if self.config.get(constants.CONFIG_DEDUPE_DOWNLOADS,
+                           constants.CONFIG_DEDUPE_DOWNLOADS_DEFAULT):
+            self.inflight = InFlightRegistry()
+        # Only used with a mirror list
+        self.mirror_scores = None
+        self._mirrors = []
+        self._failed_mirrors = set()
+        # The mirror check_metadata() ended up using, and the repomd.xml
+        # fetched from the mirrors racing it
+        self._metadata_url = None
+        self._race_results = None
+        self._repomd_states = dict()
+        # Contents of the winning repomd.xml
+        self._raced_repomd = None
 
     def run(self):
         """
@@ -53,21 +131,33 @@ class RepoSync(yumsync.RepoSync):
         if not self.sync_feed:
             raise PulpCodedException(error_code=error_codes.RPM1004,
                                      reason='Not found')
-        url_count = 0
-        for url in self.sync_feed:
+        self._mirrors = list(self.sync_feed)
+        if len(self._mirrors) > 1 and None not in self._mirrors:
+            self.mirror_scores = MirrorScores(self._mirrors)
+            self._mirrors = self.mirror_scores.rank(self._mirrors)
+        for idx, url in enumerate(self._mirrors):
             # Verify that we have a feed url.
             # if there is no feed url, then we have nothing to sync
             if url is None:
                 raise PulpCodedException(error_code=error_codes.RPM1005)
+            if url in self._failed_mirrors:
+                continue
             # using this tmp dir ensures that cleanup leaves nothing behind,
             # since we delete below
             self.tmp_dir = tempfile.mkdtemp(dir=self.working_dir)
-            url_count += 1
             try:
-                with self.update_state(self.progress_report['metadata']):
+                with self.update_state(self.progress_report['metadata']), \
+                        self.content_report.timings.timed('metadata'):
                     metadata_files = self.check_metadata(url)
-                    self.fix_metadata(metadata_files)
-                    metadata_files = self.get_metadata(metadata_files)
+                    # Racing may have picked a faster mirror
+                    url = self._metadata_url
+                    if self.upstream_unchanged(metadata_files):
+                        _logger.info(_('Upstream repository has not changed '
+                                       'since the last sync.'))
+                        self.skip_repomd_steps = True
+                    else:
+                        self.fix_metadata(metadata_files)
+                        metadata_files = self.get_metadata(metadata_files)
 
                     # Save the default checksum from the metadata
                     self.save_default_metadata_checksum_on_repo(metadata_files)
@@ -83,12 +173,12 @@ class RepoSync(yumsync.RepoSync):
                 # In case it was the last mirror in the list, raise the
                 # exception.
                 bad_mirror_exceptions = [error_codes.RPM1004, error_codes.RPM1006]  # noqa
-                if (e.error_code in bad_mirror_exceptions) and \
-                        url_count != len(self.sync_feed):
-                            continue
-                else:
-                    self._set_failed_state(e)
-                    raise
+                if e.error_code in bad_mirror_exceptions:
+                    self._failed_mirrors.add(self._metadata_url or url)
+                    if self._untried_mirrors(idx):
+                        continue
+                self._set_failed_state(e)
+                raise
 
             except Exception, e:
                 # In case other exceptions were caught that are not related to
@@ -103,16 +193,223 @@ class RepoSync(yumsync.RepoSync):
             finally:
                 # clean up whatever we may have left behind
                 shutil.rmtree(self.tmp_dir, ignore_errors=True)
+                if self.mirror_scores is not None:
+                    self.mirror_scores.save()
+                if self.metadata_cache is not None:
+                    self.metadata_cache.flush()
 
             if self.config.override_config.get(importer_constants.KEY_FEED):
                 self.erase_repomd_revision()
             else:
                 self.save_repomd_revision()
 
+            if self.metadata_cache is not None:
+                _logger.info(_('Metadata cache: %(hits)s hits, '
+                               '%(misses)s misses.') %
+                             dict(hits=self.metadata_cache.hits,
+                                  misses=self.metadata_cache.misses))
+            # Whatever was held back since the last state change
+            self.set_progress(force=True)
             _logger.info(_('Sync complete.'))
             return self.conduit.build_success_report(self._progress_summary,
                                                      self.progress_report)
 
+    @property
+    def _progress_summary(self):
+        summary = super(RepoSync, self)._progress_summary
+        summary.setdefault('content', {})['phases'] = \
+            self.content_report['phases']
+        return summary
+
+    def _untried_mirrors(self, idx):
+        return [url for url in self._mirrors[idx + 1:]
+                if url not in self._failed_mirrors]
+
+    def check_metadata(self, url):
+        """
+        With a mirror list, race the repomd.xml of the next few mirrors and
+        use the first one to return a valid file.
+        """
+        self._metadata_url = url
+        candidates = self._race_candidates(url)
+        raced = len(candidates) > 1
+        if raced:
+            winner = self._race(candidates)
+            if winner is not None:
+                self._metadata_url = winner
+                return self._raced_metadata(winner)
+        start = time.time()
+        try:
+            metadata_files = super(RepoSync, self).check_metadata(url)
+        except Exception:
+            if self.mirror_scores is not None:
+                self.mirror_scores.record_failure(url)
+            raise
+        if self.mirror_scores is not None and not raced:
+            self.mirror_scores.record_metadata(url, time.time() - start)
+        return metadata_files
+
+    def _race_candidates(self, url):
+        if self.mirror_scores is None or self.mirror_race_count <= 1:
+            return [url]
+        idx = self._mirrors.index(url)
+        return [url] + self._untried_mirrors(idx)[:self.mirror_race_count - 1]
+
+    def _race(self, urls):
+        """
+        Fetch repomd.xml from all urls at once.
+
+        :return: the first url to return a valid repomd.xml, or None
+        :rtype: str
+        """
+        self._race_results = Queue.Queue()
+        self._repomd_states = dict()
+        self._raced_repomd = None
+        for url in urls:
+            thread = threading.Thread(target=self._race_repomd,
+                                      args=(url, self._race_results))
+            thread.daemon = True
+            thread.start()
+        for _ in urls:
+            url, state, repomd = self._race_results.get()
+            if state is not None:
+                self._repomd_states[url] = state
+                self._raced_repomd = repomd
+                _logger.info(_('Using mirror %(url)s.') % dict(url=url))
+                return url
+        return None
+
+    def _raced_metadata(self, url):
+        """
+        Parse the repomd.xml the race fetched, instead of downloading it
+        again.
+        """
+        metadata_files = metadata.MetadataFiles(
+            url, self.tmp_dir, self.nectar_config, self._url_modify)
+        path = os.path.join(self.tmp_dir, metadata.REPOMD_FILE_NAME)
+        with open(path, 'wb') as fobj:
+            fobj.write(self._raced_repomd)
+        metadata_files.parse_repomd()
+        return metadata_files
+
+    def _race_repomd(self, url, results):
+        # Losers may still be running once the sync moved on, so they do
+        # not use the sync's tmp_dir
+        dst_dir = tempfile.mkdtemp(dir=self.working_dir)
+        start = time.time()
+        try:
+            metadata_files = metadata.MetadataFiles(
+                url, dst_dir, self.nectar_config, self._url_modify)
+            metadata_files.download_repomd()
+            metadata_files.parse_repomd()
+            state = self._repomd_state(metadata_files)
+            with open(os.path.join(dst_dir,
+                                   metadata.REPOMD_FILE_NAME), 'rb') as fobj:
+                repomd = fobj.read()
+        except Exception, e:
+            _logger.info(_('Mirror %(url)s failed: %(error)s') %
+                         dict(url=url, error=e))
+            self.mirror_scores.record_failure(url)
+            self._failed_mirrors.add(url)
+            results.put((url, None, None))
+        else:
+            self.mirror_scores.record_metadata(url, time.time() - start)
+            results.put((url, state or (), repomd))
+        finally:
+            shutil.rmtree(dst_dir, ignore_errors=True)
+
+    def _healthy_mirrors(self, url):
+        """
+        Mirrors packages can be downloaded from: the one metadata came from,
+        and those that raced it and serve the same repository state.
+        """
+        if self._race_results is None:
+            return [url]
+        while True:
+            try:
+                other, state, _ = self._race_results.get_nowait()
+            except Queue.Empty:
+                break
+            if state is not None:
+                self._repomd_states[other] = state
+        state = self._repomd_states.get(url)
+        if not state:
+            return [url]
+        return [url] + sorted(other for other, other_state
+                              in self._repomd_states.items()
+                              if other != url and other_state == state)
+
+    @classmethod
+    def _repomd_state(cls, metadata_files):
+        """
+        :return: the revision of repomd.xml and the checksum of primary.xml,
+                 or None if repomd.xml does not provide them
+        :rtype: tuple
+        """
+        primary_info = metadata_files.metadata.get(
+            primary.METADATA_FILE_NAME) or {}
+        checksum = (primary_info.get('checksum') or {}).get('hex_digest')
+        if not metadata_files.revision or not checksum:
+            return None
+        return (metadata_files.revision, checksum)
+
+    @classmethod
+    def _upstream_fingerprint(cls, feed, metadata_files, settings=()):
+        """
+        Identify the state of the upstream repository from repomd.xml alone:
+        its revision and the checksum of primary.xml, along with the
+        settings the sync processed it with.
+
+        :param feed: the configured feed, not the mirror that served
+                     repomd.xml, since any mirror serves the same state
+        :type  feed: str
+        :param settings: (name, value) pairs of FINGERPRINT_SETTINGS
+        :type  settings: list
+
+        :return: the fingerprint, or None if repomd.xml does not provide
+                 enough to tell whether the repository changed
+        :rtype: str
+        """
+        state = cls._repomd_state(metadata_files)
+        if state is None:
+            return None
+        return '|'.join(['%s' % x for x in (feed, ) + state] +
+                        ['%s=%s' % setting for setting in settings])
+
+    def upstream_unchanged(self, metadata_files):
+        """
+        Tell whether the last successful sync already processed this
+        version of the upstream repository.
+        """
+        settings = [(name, self.config.get(name, default))
+                    for name, default in self.FINGERPRINT_SETTINGS]
+        self._fingerprint = self._upstream_fingerprint(
+            self.config.get(importer_constants.KEY_FEED), metadata_files,
+            settings)
+        if self._fingerprint is None:
+            return False
+        if self.config.get(constants.CONFIG_FORCE_FULL_SYNC):
+            return False
+        scratchpad = self.conduit.get_scratchpad() or {}
+        return scratchpad.get(UPSTREAM_FINGERPRINT_KEY) == self._fingerprint
+
+    def save_repomd_revision(self):
+        super(RepoSync, self).save_repomd_revision()
+        # Units that failed to download have to be retried by the next sync,
+        # even if upstream does not change
+        fingerprint = self._fingerprint
+        if self.content_report['error_details']:
+            fingerprint = None
+        scratchpad = self.conduit.get_scratchpad() or {}
+        scratchpad[UPSTREAM_FINGERPRINT_KEY] = fingerprint
+        self.conduit.set_scratchpad(scratchpad)
+
+    def erase_repomd_revision(self):
+        super(RepoSync, self).erase_repomd_revision()
+        scratchpad = self.conduit.get_scratchpad() or {}
+        scratchpad.pop(UPSTREAM_FINGERPRINT_KEY, None)
+        self.conduit.set_scratchpad(scratchpad)
+
     def update_content(self, metadata_files, url):
         """
         Decides what to download and then downloads it
@@ -122,146 +419,510 @@ class RepoSync(yumsync.RepoSync):
         :param url: curret URL we should sync
         :type: str
         """
-        to_download, fileless = self._decide_what_to_download(metadata_files)
-        self.download(metadata_files, to_download, url)
-        self.save_fileless(metadata_files, fileless)
+        if self.remove_missing:
+            self._upstream_ids = spool.SortedSpool(dir=self.working_dir)
+        try:
+            to_download, fileless = self._decide_what_to_download(
+                metadata_files)
+            self.download(metadata_files, to_download, url)
+            self.save_fileless(metadata_files, fileless)
+            if self._upstream_ids is not None:
+                self.remove_missing_units()
+        finally:
+            if self._upstream_ids is not None:
+                self._upstream_ids.close()
+                self._upstream_ids = None
         self.conduit.build_success_report({}, {})
 
+    def _seen_upstream(self, units):
+        if self._upstream_ids is not None:
+            self._upstream_ids.update(unit.id for unit in units)
+
+    def remove_missing_units(self):
+        """
+        Remove from the repository the units that upstream no longer lists.
+
+        The ids of the units upstream lists, as found or saved during this
+        sync, are spooled in sorted order; the repository's associations are
+        read sorted by unit id, and the two streams are merged, so memory
+        does not grow with the size of the repository.
+
+        :return: number of units removed
+        :rtype: int
+        """
+        if getattr(self, 'cancelled', False):
+            return 0
+        repo = self.conduit.repo
+        associated = models.iter_repo_unit_ids(repo, self.Type_Class_Map)
+        missing = spool.difference(associated, self._upstream_ids)
+        removed = 0
+        for batch in self._batches(missing, self.SAVE_BATCH_SIZE):
+            removed += models.unassociate_units(repo, batch,
+                                                self.Type_Class_Map)
+        _logger.info(_('Removed %(count)s units missing upstream.') %
+                     dict(count=removed))
+        return removed
+
     def _decide_what_to_download(self, metadata_files):
+        unit_counts = dict((model_class.TYPE_ID, 0)
+                           for model_class in self.Type_Class_Map.values())
+        # In the order of primary.xml, which the download order may keep
+        flattened = []
+        fileless = []
         with metadata_files.get_metadata_file_handle(primary.METADATA_FILE_NAME) as primary_file_handle:  # noqa
-            package_info_generator = packages.package_list_generator(
-                primary_file_handle, primary.PACKAGE_TAG,
-                self._process_package_element)
-
-            sep_units = self._separate_units_by_type(package_info_generator)
-        to_download = dict()
-        for model_class, units in sorted(sep_units.items()):
-            # Because models don't implement an __eq__, we can't simply throw
-            # them in a set (even though they do implement __hash__)
-            k2u = dict((u.unit_key_as_named_tuple, u)
-                       for u in units)
-            # Units from the database
-            unit_generator = [model_class(**unit.unit_key)
-                              for unit in sorted(units)]
-            unit_generator = units_controller.find_units(unit_generator)
-            upstream_unit_keys = set(k2u)
-            # Compute the unit keys we need to download
-            wanted = upstream_unit_keys.difference(
-                u.unit_key_as_named_tuple for u in unit_generator)
-            for existing_key in upstream_unit_keys.difference(wanted):
-                existing = k2u[existing_key]
-                # Existing units get re-associated
-                yumsync.repo_controller.associate_single_unit(
-                    self.conduit.repo, existing)
-            to_download[model_class] = [k2u[k] for k in wanted]
-
-        unit_counts = dict()
-        flattened = set()
-        fileless = set()
-        for model_class, wanted in to_download.items():
-            unit_counts[model_class.TYPE_ID] = len(wanted)
-            if 'filename' in model_class._fields:
-                flattened.update(wanted)
-            else:
-                fileless.update(wanted)
+            package_info_generator = self.content_report.timings.timed_iter(
+                'parse', win_primary.iter_packages(primary_file_handle,
+                                                   self.Type_Class_Map))
+            # Upstream packages are checked against the database in batches,
+            # so that only the units we need to download are kept around
+            for batch in self._batches(package_info_generator,
+                                       self.DECIDE_BATCH_SIZE):
+                sep_units = self._separate_units_by_type(batch)
+                wanted = dict()
+                for model_class, infos in sorted(sep_units.items()):
+                    with self.content_report.timings.timed(
+                            'existence_check', units=len(infos)):
+                        units = self._filter_existing(model_class, infos)
+                    unit_counts[model_class.TYPE_ID] += len(units)
+                    wanted.update(((model_class, unit.unit_key_as_named_tuple),
+                                   unit) for unit in units)
+                for info in batch:
+                    unit = wanted.pop((info.model_class, info.unit_key), None)
+                    if unit is None:
+                        continue
+                    if 'filename' in info.model_class._fields:
+                        flattened.append(unit)
+                    else:
+                        fileless.append(unit)
 
         total_size = sum(x.size for x in flattened if x.size)
         self.content_report.set_initial_values(unit_counts, total_size)
         self.set_progress()
         return flattened, fileless
 
+    def _filter_existing(self, model_class, infos):
+        """
+        Re-associate the units already in the database, and return model
+        instances for the ones that need to be downloaded.
+        """
+        existing = self._find_existing(model_class, infos)
+        k2u = dict((info.unit_key, self._make_unit(info)) for info in infos
+                   if info.unit_key not in existing)
+        # Units are stored with a sha256 unit key; if upstream advertises
+        # a different checksum type, match against the stored digests
+        found = self._find_by_stored_checksums(model_class, k2u.values())
+        for existing_key, unit in found.items():
+            existing[existing_key] = unit
+            del k2u[existing_key]
+        # Existing units get re-associated
+        models.associate_units(self.conduit.repo, existing.values())
+        self._seen_upstream(existing.values())
+        return list(k2u.values())
+
     @classmethod
-    def _separate_units_by_type(cls, units):
+    def _find_existing(cls, model_class, infos):
+        """
+        Find the units already in the database with one query on the
+        (indexed) checksum, loading only their unit key.
+
+        :return: dictionary of unit key to the unit in the database
+        :rtype: dict
+        """
+        return cls._find_by_unit_keys(
+            model_class, set(info.unit_key for info in infos),
+            set(info.fields.get('checksum') for info in infos))
+
+    @classmethod
+    def _find_by_unit_keys(cls, model_class, upstream_unit_keys, checksums):
+        checksums = sorted(checksums)
+        query = model_class.objects(checksum__in=checksums).only(
+            'id', *model_class.unit_key_fields)
         ret = dict()
+        for unit in query:
+            unit_key = unit.unit_key_as_named_tuple
+            if unit_key in upstream_unit_keys:
+                ret[unit_key] = unit
+        return ret
+
+    @classmethod
+    def _make_unit(cls, info):
+        return info.model_class(**info.fields)
+
+    @classmethod
+    def _batches(cls, iterable, size):
+        batch = []
+        for item in iterable:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @classmethod
+    def _find_by_stored_checksums(cls, model_class, units):
+        """
+        Look up units advertised with a checksum type other than the one in
+        their stored unit key, using one query per checksum type.
+
+        :return: dictionary of upstream unit key to the unit in the database
+        :rtype: dict
+        """
+        by_type = dict()
         for unit in units:
-            ret.setdefault(unit.__class__, set()).add(unit)
+            if unit.checksumtype == util.TYPE_SHA256:
+                continue
+            if unit.checksumtype not in models.CHECKSUM_TYPES:
+                continue
+            units_by_checksum = by_type.setdefault(unit.checksumtype, dict())
+            units_by_checksum[unit.checksum] = unit
+        ret = dict()
+        for checksum_type, units_by_checksum in sorted(by_type.items()):
+            field = 'checksums__%s' % checksum_type
+            query = model_class.objects(
+                **{field + '__in': sorted(units_by_checksum)}).only(
+                    'id', 'checksums')
+            for existing in query:
+                unit = units_by_checksum[existing.checksums[checksum_type]]
+                ret[unit.unit_key_as_named_tuple] = existing
+        return ret
+
+    @classmethod
+    def _separate_units_by_type(cls, infos):
+        ret = dict()
+        for info in infos:
+            ret.setdefault(info.model_class, []).append(info)
         return ret
 
+    def set_progress(self, force=False):
+        """
+        Write the progress report, unless the last write was too recent;
+        see ProgressThrottle.
+        """
+        with self._progress_lock:
+            states = tuple(sorted(
+                (name, report.get('state'))
+                for name, report in self.progress_report.items()))
+            if not self.progress_throttle.ready(states, force=force):
+                self.content_report['updates_suppressed'] += 1
+                return
+            super(RepoSync, self).set_progress()
+
     def download(self, metadata_files, units_to_download, url):
+        """
+        Download the units, leaving to other syncs the ones they are already
+        downloading: those are associated once the other sync saved them, or
+        downloaded here if it failed to.
+        """
+        if self.inflight is None:
+            self._download(metadata_files, units_to_download, url)
+            return
+        units = list(units_to_download)
+        while units:
+            claimed = self.inflight.claim(
+                self.inflight.key(unit) for unit in units)
+            mine = [unit for unit in units
+                    if self.inflight.key(unit) in claimed]
+            others = [unit for unit in units
+                      if self.inflight.key(unit) not in claimed]
+            if others:
+                _logger.info(
+                    _('%(count)s units are being downloaded by other syncs.')
+                    % dict(count=len(others)))
+            if mine:
+                # Claims are kept alive while downloading, and dropped after
+                with self.inflight:
+                    self._download(metadata_files, mine, url)
+            units = self._wait_for_other_syncs(others)
+
+    def _wait_for_other_syncs(self, units):
+        """
+        Wait until no other sync is downloading the units, and associate the
+        ones they saved.
+
+        :return: the units the other syncs did not save
+        :rtype: list
+        """
+        units_by_key = dict((self.inflight.key(unit), unit) for unit in units)
+        missing = []
+        while units_by_key:
+            if getattr(self, 'cancelled', False):
+                return []
+            pending = self.inflight.pending(units_by_key)
+            done = [units_by_key.pop(key)
+                    for key in sorted(set(units_by_key) - pending)]
+            missing.extend(self._associate_saved(done))
+            if units_by_key:
+                time.sleep(self.INFLIGHT_POLL_INTERVAL)
+        return missing
+
+    def _associate_saved(self, units):
+        """
+        Associate the units another sync saved.
+
+        :return: the units that are not in the database
+        :rtype: list
+        """
+        units_by_class = dict()
+        for unit in units:
+            units_by_class.setdefault(unit.__class__, []).append(unit)
+        missing = []
+        for model_class, group in sorted(units_by_class.items()):
+            k2u = dict((unit.unit_key_as_named_tuple, unit) for unit in group)
+            existing = self._find_by_unit_keys(
+                model_class, set(k2u), set(unit.checksum for unit in group))
+            rest = [unit for unit_key, unit in k2u.items()
+                    if unit_key not in existing]
+            existing.update(self._find_by_stored_checksums(model_class, rest))
+            models.associate_units(self.conduit.repo, existing.values())
+            self._seen_upstream(existing.values())
+            with self._progress_lock:
+                for unit_key, unit in sorted(k2u.items()):
+                    if unit_key in existing:
+                        self.progress_report['content'].success(unit)
+                    else:
+                        missing.append(unit)
+                self.set_progress()
+        if missing:
+            _logger.info(_('%(count)s units were not saved by other syncs, '
+                           'downloading them.') % dict(count=len(missing)))
+        return missing
+
+    def _download(self, metadata_files, units_to_download, url):
         event_listener = CustomPackageListener(self, metadata_files)
+        workers = int(self.config.get(
+            constants.CONFIG_POST_DOWNLOAD_WORKERS,
+            constants.CONFIG_POST_DOWNLOAD_WORKERS_DEFAULT))
+        if workers > 0:
+            event_listener.pool = pipeline.WorkerPool(
+                event_listener.process_download, workers)
+            event_listener.pool.start()
 
         try:
-            download_wrapper = alternate.Packages(
+            self.concurrency = self._concurrency_controller()
+            units_to_download = self._download_order(units_to_download)
+            mirrors = None
+            if self.mirror_scores is not None:
+                mirrors = self._healthy_mirrors(url)
+                _logger.info(_('Downloading from %(count)s mirrors.') %
+                             dict(count=len(mirrors)))
+            download_wrapper = win_download.Packages(
                 url,
                 self.nectar_config,
                 units_to_download,
                 self.tmp_dir,
                 event_listener,
-                self._url_modify)
+                self._url_modify,
+                mirrors=mirrors,
+                mirror_scores=self.mirror_scores,
+                partials=win_download.PartialStore.from_config(self.config),
+                segment_threshold=int(self.config.get(
+                    constants.CONFIG_SEGMENT_THRESHOLD,
+                    constants.CONFIG_SEGMENT_THRESHOLD_DEFAULT)),
+                segment_count=int(self.config.get(
+                    constants.CONFIG_SEGMENT_COUNT,
+                    constants.CONFIG_SEGMENT_COUNT_DEFAULT)),
+                concurrency=self.concurrency,
+                limiter=BandwidthLimiter.from_config(self.config),
+                hardlink_local=bool(self.config.get(
+                    constants.CONFIG_HARDLINK_LOCAL,
+                    constants.CONFIG_HARDLINK_LOCAL_DEFAULT)))
 
             self.downloader = download_wrapper.downloader
             _logger.info(_('Downloading %(num)s units.') %
                          {'num': len(units_to_download)})
-            download_wrapper.download_packages()
+            with self.content_report.timings.timed('download'):
+                download_wrapper.download_packages()
             self.downloader = None
         finally:
-            pass
+            if event_listener.pool is not None:
+                # Let the workers finish with what was downloaded
+                event_listener.pool.close()
+            self.concurrency = None
+
+    def _download_order(self, units):
+        if self.concurrency is not None:
+            slots = self.concurrency.limit
+        else:
+            slots = int(self.config.get(constants.CONFIG_NUM_THREADS,
+                                        constants.CONFIG_NUM_THREADS_DEFAULT))
+        return schedule.order(
+            units,
+            self.config.get(constants.CONFIG_DOWNLOAD_ORDER,
+                            constants.CONFIG_DOWNLOAD_ORDER_DEFAULT),
+            slots=slots,
+            small=int(self.config.get(
+                constants.CONFIG_INTERLEAVE_SMALL,
+                constants.CONFIG_INTERLEAVE_SMALL_DEFAULT)))
+
+    def _concurrency_controller(self):
+        """
+        Return the controller deciding how many downloads are in flight,
+        between the downloader and the downloads in segments or resumed.
 
-    @classmethod
-    def _process_package_element(cls, el):
-        pkg_type = el.attrib.get('type')
-        if pkg_type not in cls.Type_Class_Map:
-            raise error_codes.RPM1004(
-                reason="Unsupported package type %s" % pkg_type)
-        klass = cls.Type_Class_Map[pkg_type]
-        package_info = dict()
-        field_names = set(klass._fields.keys())
-        field_names.add('size')
-        for fname in field_names:
-            if fname.startswith('_'):
-                continue
-            tag = '{%s}%s' % (primary.COMMON_SPEC_URL, fname)
-            value = el.find(tag)
-            if value is not None:
-                package_info[fname] = value.text
-                if fname == 'checksum' and 'type' in value.attrib:
-                    package_info['checksumtype'] = value.attrib['type']
-                if fname == 'size':
-                    try:
-                        size = int(value.attrib.get('package', 0))
-                    except ValueError:
-                        size = 0
-                    package_info[fname] = size
-        if 'relativepath' in klass._fields:
-            location_element = el.find(primary.LOCATION_TAG)
-            if location_element is not None:
-                href = location_element.attrib['href']
-                package_info['relativepath'] = href
-
-        package_info['filename'] = klass.filename_from_unit_key(package_info)
-        return klass(**package_info)
+        In adaptive mode, let the downloader run up to max_threads threads;
+        otherwise, the limit stays at num_threads.
+        """
+        initial = int(self.config.get(constants.CONFIG_NUM_THREADS,
+                                      constants.CONFIG_NUM_THREADS_DEFAULT))
+        if not self.adaptive_concurrency:
+            return concurrency.AIMDController(initial, initial)
+        minimum = int(self.config.get(constants.CONFIG_MIN_THREADS,
+                                      constants.CONFIG_MIN_THREADS_DEFAULT))
+        maximum = int(self.config.get(constants.CONFIG_MAX_THREADS,
+                                      constants.CONFIG_MAX_THREADS_DEFAULT))
+        self.nectar_config.max_concurrent = maximum
+        report = self.content_report['concurrency'] = dict()
+        return concurrency.AIMDController(minimum, maximum, initial=initial,
+                                          report=report)
 
     def fix_metadata(self, metadata_files):
         metadata_files.generate_dbs = lambda *args, **kwargs: None
 
     def add_unit(self, metadata_files, unit, file_path):
-        unit = unit.save_and_associate(file_path, self.conduit.repo)
-        self.progress_report['content'].success(unit)
-        self.set_progress()
+        # file_path is the sync's own copy, removed once imported
+        with self.content_report.timings.timed('db_write', units=1,
+                                               size=unit.size):
+            unit = unit.save_and_associate(file_path, self.conduit.repo,
+                                           move=True)
+        self._seen_upstream([unit])
+        with self._progress_lock:
+            self.progress_report['content'].success(unit)
+            self.set_progress()
         _logger.info("Added %r", unit)
         return unit
 
     def save_fileless(self, metadata_files, units):
-        for unit in units:
-            self.add_unit(metadata_files, unit, None)
+        for batch in self._batches(units, self.SAVE_BATCH_SIZE):
+            with self.content_report.timings.timed('db_write',
+                                                   units=len(batch)):
+                saved = models.save_and_associate_units(
+                    self.conduit.repo, [(unit, None) for unit in batch])
+            self._seen_upstream(saved)
+            with self._progress_lock:
+                for unit in saved:
+                    self.progress_report['content'].success(unit)
+                    _logger.info("Added %r", unit)
+                self.set_progress()
 
 
 class CustomPackageListener(PackageListener):
+    def __init__(self, *args, **kwargs):
+        super(CustomPackageListener, self).__init__(*args, **kwargs)
+        # When set, downloaded files are handed over to the pool instead of
+        # being processed in the downloader's thread
+        self.pool = None
+        # Digests computed while downloading, keyed by path
+        self._hashed = dict()
+        # Downloaded files, kept open (and locked) until they are processed
+        self._finished = dict()
+        self._finished_lock = threading.Lock()
+
+    def _finish_destination(self, report, succeeded):
+        dest = report.destination
+        if not isinstance(dest, win_download.HashingFile):
+            return
+        if succeeded:
+            dest.finish()
+            self._hashed[dest.name] = dest.checksums()
+            with self._finished_lock:
+                self._finished[dest.name] = dest
+        else:
+            dest.abort()
+        report.destination = dest.name
+        scores = self.sync.mirror_scores
+        mirror = scores and scores.mirror_for(report.url)
+        if mirror is None:
+            return
+        if succeeded:
+            scores.record_download(mirror, dest.size, dest.elapsed)
+        else:
+            scores.record_failure(mirror)
+
+    def _release(self, report, succeeded):
+        if self.sync.concurrency is not None:
+            self.sync.concurrency.release(report.url, report.data.size,
+                                          succeeded)
+
+    def _release_claim(self, unit):
+        # Lets the syncs waiting for the unit look it up
+        if self.sync.inflight is not None:
+            self.sync.inflight.release(self.sync.inflight.key(unit))
+
+    def download_failed(self, report):
+        self._release(report, False)
+        self._finish_destination(report, False)
+        self._hashed.pop(report.destination, None)
+        super(CustomPackageListener, self).download_failed(report)
+        self._release_claim(report.data)
+
     def download_succeeded(self, report):
         _logger.info("%s: download succeeded", report.data._content_type_id)
+        self._release(report, True)
+        self._finish_destination(report, True)
+        self.sync.content_report.timings.count(
+            'download', units=1, size=report.data.size)
+        if self.pool is None:
+            self.process_download(report)
+        else:
+            # Blocks while the workers are behind, so that downloads do not
+            # pile up in the working directory
+            self.pool.put(report)
+
+    def process_download(self, report):
+        """
+        Verify a downloaded file, extract its metadata and save the unit.
+        The file is removed afterwards.
+        """
+        try:
+            self._process_download(report)
+        except Exception as e:
+            # Reported like a failed download, instead of leaving the unit
+            # out of a sync that looks successful
+            _logger.exception("Unable to process %s", report.url)
+            self._process_failed(report, e)
+        finally:
+            self._close_destination(report.destination)
+            self._release_claim(report.data)
+
+    def _close_destination(self, path):
+        # The file was moved into place or removed, it can be unlocked
+        with self._finished_lock:
+            dest = self._finished.pop(path, None)
+        if dest is not None:
+            dest.close()
+
+    def _process_failed(self, report, error):
+        unit = report.data
+        error_report = dict(filename=unit.filename, error=str(error),
+                            traceback=traceback.format_exc().splitlines())
+        with self.sync._progress_lock:
+            self.sync.progress_report['content'].failure(unit, error_report)
+            self.sync.set_progress()
+
+    def _process_download(self, report):
         with util.deleting(report.destination):
             unit = report.data
+            checksums = self._verified_checksums(unit, report.destination)
+            timings = self.sync.content_report.timings
             try:
-                super(CustomPackageListener, self).download_succeeded(report)
+                with timings.timed('verification', units=1, size=unit.size):
+                    super(CustomPackageListener, self).download_succeeded(
+                        report)
             except (verification.VerificationException,
                     util.InvalidChecksumType):
                 # verification failed, unit not added
                 return
+            finally:
+                self._hashed.pop(report.destination, None)
 
             # At this point, the checksum validation should have already
             # caught whether the unit is invalid, so we should be reasonably
             # sure the same unit is on disk
-            unit_dl = unit.__class__.from_file(report.destination)
+            with timings.timed('extraction', units=1, size=unit.size,
+                               latency=True):
+                unit_dl = self._unit_from_download(unit, report.destination,
+                                                   checksums)
 
             _logger.info("Adding %s unit", unit_dl._content_type_id)
             added_unit = self.sync.add_unit(self.metadata_files, unit_dl,
@@ -270,6 +931,84 @@ class CustomPackageListener(PackageListener):
                 added_unit.downloaded = True
                 added_unit.save()
 
+    def _verified_checksums(self, unit, path):
+        """
+        Return the digests computed while the file was downloaded, if they
+        match what upstream advertises for the unit.
+        """
+        checksums = self._hashed.get(path)
+        if not checksums:
+            return None
+        if checksums.get(unit.checksumtype) != unit.checksum:
+            return None
+        return checksums
+
+    def _verify_checksum(self, unit, location):
+        path = getattr(location, 'destination', location)
+        if self._verified_checksums(unit, path) is not None:
+            # Hashed as it was written, no need to read it again
+            return
+        # Let the file be read, and a mismatch be reported, as usual
+        super(CustomPackageListener, self)._verify_checksum(unit, location)
+
+    def _unit_from_download(self, unit, path, checksums=None):
+        """
+        Build the unit to save for a verified download.
+
+        If the importer trusts upstream metadata, the fields parsed from
+        primary.xml are used as they are, as long as the feed also provides
+        the fields otherwise read from the package. A sample of the packages
+        is extracted again, to notice a feed whose metadata does not match
+        its packages.
+        """
+        checksum = None
+        if unit.checksumtype == util.TYPE_SHA256:
+            checksum = unit.checksum
+        # The unit key is based on sha256, which other checksum types
+        # cannot provide without reading the file
+        trusted = checksum is not None and self.sync.trust_upstream_metadata
+        if trusted and random.random() < self.sync.trust_sample_rate:
+            # Not from the cache, which would answer with what the package
+            # held the first time it was seen
+            unit_dl = unit.__class__.from_file(path, checksum=checksum,
+                                               checksums=checksums)
+            self._check_drift(unit, unit_dl)
+            return unit_dl
+        if trusted and not self._missing_fields(unit):
+            return self._unit_from_upstream(unit, path, checksums)
+        return unit.__class__.from_file(
+            path, cache=self.sync.metadata_cache, checksum=checksum,
+            checksums=checksums)
+
+    @classmethod
+    def _missing_fields(cls, unit):
+        # An empty ModuleSignature is a value, only None means the feed did
+        # not provide the field
+        return [field for field in unit.EXTRACTED_FIELDS
+                if getattr(unit, field) is None]
+
+    @classmethod
+    def _unit_from_upstream(cls, unit, path, checksums=None):
+        unit.size = os.path.getsize(path)
+        unit.checksums = checksums or {util.TYPE_SHA256: unit.checksum}
+        return unit
+
+    @classmethod
+    def _check_drift(cls, upstream, unit):
+        fields = list(unit.unit_key_fields) + list(unit.REPOMD_EXTRA_FIELDS)
+        fields.extend(field for field in unit.EXTRACTED_FIELDS
+                      if getattr(upstream, field) is not None)
+        drift = dict((field, (getattr(upstream, field), getattr(unit, field)))
+                     for field in fields
+                     if getattr(upstream, field) != getattr(unit, field))
+        if drift:
+            _logger.warning(
+                "%s: upstream metadata does not match the package: %s",
+                unit.filename, ", ".join(
+                    "%s=%r (package: %r)" % (k, v[0], v[1])
+                    for k, v in sorted(drift.items())))
+        return drift
+
     def _verify_size(self, *args, **kwargs):
         # Since size is not part of the metadata saved in the repomd files, we
         # are bypassing this verification
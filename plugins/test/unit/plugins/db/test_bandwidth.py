@@ -0,0 +1,128 @@
+"""
+Contains tests for pulp_win.plugins.db.bandwidth.
+"""
+import mock
+
+from .... import testbase
+from pulp_win.plugins.db import bandwidth
+
+
+class TestMemoryBucketStore(testbase.TestCase):
+    def test_take(self):
+        store = bandwidth.MemoryBucketStore()
+        store.configure("cluster", 100, 150)
+        # Full after long enough
+        self.assertEquals(150, store.take("cluster", 1000, 10.0))
+        self.assertEquals(0, store.take("cluster", 10, 10.0))
+        self.assertEquals(50, store.take("cluster", 1000, 10.5))
+
+    @mock.patch("pulp_win.plugins.db.bandwidth._LOGGER")
+    def test_configure(self, _LOGGER):
+        store = bandwidth.MemoryBucketStore()
+        store.configure("cluster", 100, 150)
+        # The first one wins
+        store.configure("cluster", 200, 150)
+        self.assertEquals(1, _LOGGER.warning.call_count)
+        self.assertEquals(150, store.take("cluster", 1000, 1.5))
+
+
+class TestMongoBucketStore(testbase.TestCase):
+    @mock.patch("pulp_win.plugins.db.bandwidth._LOGGER")
+    @mock.patch("pulp_win.plugins.db.bandwidth.BandwidthBucket._get_collection")  # noqa
+    def test_configure(self, _get_collection, _LOGGER):
+        collection = _get_collection.return_value
+        collection.find_one_and_update.return_value = dict(
+            _id="cluster", rate=100.0, burst=150.0, tokens=20.0,
+            updated=10.0)
+        store = bandwidth.MongoBucketStore()
+        store.configure("cluster", 100.0, 150.0)
+        spec, update = collection.find_one_and_update.call_args[0]
+        # Only set when the bucket is created
+        self.assertEquals(['$setOnInsert'], update.keys())
+        self.assertFalse(_LOGGER.warning.called)
+        store.configure("cluster", 200.0, 150.0)
+        self.assertTrue(_LOGGER.warning.called)
+
+    @mock.patch("pulp_win.plugins.db.bandwidth.BandwidthBucket._get_collection")  # noqa
+    def test_take_removed(self, _get_collection):
+        collection = _get_collection.return_value
+        store = bandwidth.MongoBucketStore()
+        store.configure("cluster", 100.0, 150.0)
+        collection.find_one.side_effect = [None, dict(
+            _id="cluster", rate=100.0, burst=150.0, tokens=0.0,
+            updated=0.0)]
+        collection.update_one.return_value.modified_count = 1
+        # Created again, and empty
+        self.assertEquals(0, store.take("cluster", 50, 0.0))
+        self.assertEquals(2, collection.find_one_and_update.call_count)
+
+    @mock.patch("pulp_win.plugins.db.bandwidth.BandwidthBucket._get_collection")  # noqa
+    def test_take(self, _get_collection):
+        collection = _get_collection.return_value
+        collection.find_one.return_value = dict(
+            _id="cluster", rate=100.0, burst=150.0, tokens=20.0,
+            updated=10.0)
+        # Someone else got there first, then the update goes through
+        collection.update_one.side_effect = [
+            mock.MagicMock(modified_count=0),
+            mock.MagicMock(modified_count=1)]
+        store = bandwidth.MongoBucketStore()
+        self.assertEquals(50, store.take("cluster", 50, 10.5))
+        self.assertEquals(2, collection.find_one.call_count)
+        collection.update_one.assert_called_with(
+            {'_id': "cluster", 'tokens': 20.0, 'updated': 10.0},
+            {'$set': dict(tokens=20.0, updated=10.5)})
+
+    @mock.patch("pulp_win.plugins.db.bandwidth.BandwidthBucket._get_collection")  # noqa
+    def test_take_contention(self, _get_collection):
+        collection = _get_collection.return_value
+        collection.find_one.return_value = dict(
+            _id="cluster", rate=100.0, burst=150.0, tokens=20.0,
+            updated=10.0)
+        collection.update_one.return_value.modified_count = 0
+        self.assertEquals(0, bandwidth.MongoBucketStore().take(
+            "cluster", 50, 10.5))
+
+
+class TestBandwidthLimiter(testbase.TestCase):
+    def _limiter(self, rate, priority=1.0):
+        self.now = 0.0
+
+        def sleep(seconds):
+            self.now += seconds
+
+        self.store = bandwidth.MemoryBucketStore()
+        return bandwidth.BandwidthLimiter(
+            self.store, "cluster", rate, burst=1024, priority=priority,
+            clock=lambda: self.now, sleep=sleep)
+
+    def test_consume(self):
+        limiter = self._limiter(1024)
+        limiter.LEASE_SIZE = 256
+        limiter.consume(10 * 1024)
+        # Paid for at the bucket's rate
+        self.assertTrue(9.5 <= self.now <= 10.5, self.now)
+
+    def test_priority(self):
+        limiter = self._limiter(1024, priority=2)
+        limiter.LEASE_SIZE = 256
+        self.now = 1.0
+        limiter.consume(100)
+        # A larger lease was taken, the rest is kept for later writes
+        self.assertEquals(412, limiter._leased)
+
+    def test_lease_size(self):
+        # A tenth of a second's worth, at least LEASE_SIZE
+        self.assertEquals(64 * 1024, self._limiter(1024).lease_size)
+        self.assertEquals(10 * 1024 ** 2,
+                          self._limiter(100 * 1024 ** 2).lease_size)
+
+    def test_from_config(self):
+        self.assertEquals(None, bandwidth.BandwidthLimiter.from_config({}))
+        store = bandwidth.MemoryBucketStore()
+        limiter = bandwidth.BandwidthLimiter.from_config(
+            dict(bandwidth_limit=1000, bandwidth_scope="host",
+                 bandwidth_priority=3), store=store)
+        self.assertTrue(limiter.name.startswith("host:"))
+        self.assertEquals(3.0, limiter.priority)
+        self.assertEquals(1000.0, limiter.rate)
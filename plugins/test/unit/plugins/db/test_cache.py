@@ -0,0 +1,109 @@
+"""
+Contains tests for pulp_win.plugins.db.cache.
+"""
+
+import mock
+# Important to import testbase, since it mocks the server's config import snafu
+from .... import testbase
+from pulp_win.plugins.db import cache
+
+
+class TestMetadataCache(testbase.TestCase):
+    def test_from_config(self):
+        mcache = cache.MetadataCache.from_config({})
+        self.assertEquals(
+            cache.constants.CONFIG_METADATA_CACHE_SIZE_DEFAULT,
+            mcache.max_entries)
+        mcache = cache.MetadataCache.from_config(
+            {cache.constants.CONFIG_METADATA_CACHE_SIZE: '5'})
+        self.assertEquals(5, mcache.max_entries)
+
+    def test_from_config_disabled(self):
+        self.assertEquals(None, cache.MetadataCache.from_config(
+            {cache.constants.CONFIG_METADATA_CACHE_SIZE: 0}))
+
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheStats")
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheEntry")
+    def test_get_hit(self, _Entry, _Stats):
+        query = _Entry.objects.return_value
+        query.modify.return_value = mock.MagicMock(metadata=dict(name='a'))
+        mcache = cache.MetadataCache()
+        self.assertEquals(dict(name='a'), mcache.get('msi', 'abc'))
+        # Entries extracted by another version are misses
+        _Entry.objects.assert_called_once_with(
+            key='msi:abc', version=cache.MetadataCache.METADATA_VERSION)
+        self.assertEquals((1, 0), (mcache.hits, mcache.misses))
+        # Counted in memory until flushed
+        self.assertFalse(_Stats.objects.called)
+        mcache.flush()
+        _Stats.objects.return_value.update_one.assert_called_once_with(
+            upsert=True, inc__hits=1)
+
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheStats")
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheEntry")
+    def test_get_miss(self, _Entry, _Stats):
+        _Entry.objects.return_value.modify.return_value = None
+        mcache = cache.MetadataCache()
+        self.assertEquals(None, mcache.get('msi', 'abc'))
+        self.assertEquals((0, 1), (mcache.hits, mcache.misses))
+        mcache.flush()
+        _Stats.objects.return_value.update_one.assert_called_once_with(
+            upsert=True, inc__misses=1)
+
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheStats")
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheEntry")
+    def test_flush(self, _Entry, _Stats):
+        query = _Entry.objects.return_value
+        query.modify.side_effect = [None, mock.MagicMock(metadata=dict()),
+                                    mock.MagicMock(metadata=dict())]
+        mcache = cache.MetadataCache()
+        for _ in range(3):
+            mcache.get('msi', 'abc')
+        mcache.flush()
+        # One write for all the lookups
+        _Stats.objects.return_value.update_one.assert_called_once_with(
+            upsert=True, inc__hits=2, inc__misses=1)
+        # Nothing new, nothing written
+        mcache.flush()
+        self.assertEquals(1, _Stats.objects.return_value.update_one.call_count)
+
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheStats")
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheEntry")
+    def test_put_evicts(self, _Entry, _Stats):
+        _Entry.objects.count.return_value = 4
+        oldest = [mock.MagicMock(key='msi:1'), mock.MagicMock(key='msi:2')]
+        _Entry.objects.order_by.return_value.only.return_value.limit.return_value = oldest  # noqa
+        mcache = cache.MetadataCache(max_entries=2)
+        mcache.put('msi', 'abc', dict(name='a'))
+
+        self.assertEquals('msi:abc', _Entry.call_args[1]['key'])
+        self.assertEquals(cache.MetadataCache.METADATA_VERSION,
+                          _Entry.call_args[1]['version'])
+        _Entry.return_value.save.assert_called_once_with()
+        _Entry.objects.order_by.return_value.only.return_value.limit.assert_called_once_with(2)  # noqa
+        _Entry.objects.assert_called_once_with(key__in=['msi:1', 'msi:2'])
+        _Entry.objects.return_value.delete.assert_called_once_with()
+        mcache.flush()
+        _Stats.objects.return_value.update_one.assert_called_once_with(
+            upsert=True, inc__evictions=2)
+
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheStats")
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheEntry")
+    def test_put_evicts_periodically(self, _Entry, _Stats):
+        _Entry.objects.count.return_value = 2
+        mcache = cache.MetadataCache(max_entries=2)
+        mcache.EVICT_INTERVAL = 3
+        for idx in range(7):
+            mcache.put('msi', str(idx), dict(name='a'))
+        # On the first put, then every 3 puts
+        self.assertEquals(3, _Entry.objects.count.call_count)
+        self.assertEquals(7, _Entry.return_value.save.call_count)
+
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheStats")
+    @mock.patch("pulp_win.plugins.db.cache.MetadataCacheEntry")
+    def test_put_no_eviction(self, _Entry, _Stats):
+        _Entry.objects.count.return_value = 2
+        mcache = cache.MetadataCache(max_entries=2)
+        mcache.put('msi', 'abc', dict(name='a'))
+        self.assertFalse(_Entry.objects.order_by.called)
+        self.assertFalse(_Stats.objects.called)
@@ -0,0 +1,71 @@
+"""
+Contains tests for pulp_win.plugins.db.inflight.
+"""
+import mock
+from pymongo.errors import BulkWriteError
+
+from .... import testbase
+from pulp_win.plugins.db import inflight
+
+
+@mock.patch("pulp_win.plugins.db.inflight.InFlightDownload._get_collection")
+class TestInFlightRegistry(testbase.TestCase):
+    def test_claim(self, _get_collection):
+        collection = _get_collection.return_value
+        # b is claimed by another sync; c too, but that claim expired
+        collection.insert_many.side_effect = BulkWriteError(dict(
+            writeErrors=[dict(index=1, code=11000),
+                         dict(index=2, code=11000)]))
+        collection.update_one.side_effect = [
+            mock.MagicMock(modified_count=0),
+            mock.MagicMock(modified_count=1)]
+        registry = inflight.InFlightRegistry(owner="me")
+        self.assertEquals(set(["sha256:a", "sha256:c"]), registry.claim(
+            ["sha256:c", "sha256:b", "sha256:a", "sha256:a"]))
+        docs = collection.insert_many.call_args[0][0]
+        self.assertEquals(["sha256:a", "sha256:b", "sha256:c"],
+                          [doc['_id'] for doc in docs])
+        self.assertEquals(set(["me"]), set(doc['owner'] for doc in docs))
+        self.assertEquals(
+            ["sha256:b", "sha256:c"],
+            [c[0][0]['_id'] for c in collection.update_one.call_args_list])
+        self.assertIn('$lt', collection.update_one.call_args[0][0]['expires'])
+
+    def test_claim_other_error(self, _get_collection):
+        collection = _get_collection.return_value
+        collection.insert_many.side_effect = BulkWriteError(dict(
+            writeErrors=[dict(index=0, code=121)]))
+        registry = inflight.InFlightRegistry(owner="me")
+        self.assertRaises(BulkWriteError, registry.claim, ["sha256:a"])
+
+    def test_claim_nothing(self, _get_collection):
+        registry = inflight.InFlightRegistry(owner="me")
+        self.assertEquals(set(), registry.claim([]))
+        self.assertFalse(_get_collection.called)
+
+    def test_pending(self, _get_collection):
+        collection = _get_collection.return_value
+        collection.find.return_value = [dict(_id="sha256:b")]
+        registry = inflight.InFlightRegistry(owner="me")
+        self.assertEquals(set(["sha256:b"]),
+                          registry.pending(["sha256:b", "sha256:a"]))
+        spec = collection.find.call_args[0][0]
+        self.assertEquals(["sha256:a", "sha256:b"], spec['_id']['$in'])
+        self.assertEquals({'$ne': "me"}, spec['owner'])
+
+    def test_context(self, _get_collection):
+        collection = _get_collection.return_value
+        registry = inflight.InFlightRegistry(owner="me", ttl=0.03)
+        with registry:
+            registry.release("sha256:a")
+            registry._stop.wait(0.1)
+        collection.delete_one.assert_called_once_with(
+            {'_id': "sha256:a", 'owner': "me"})
+        # Claims were kept alive, then dropped
+        self.assertTrue(collection.update_many.called)
+        collection.delete_many.assert_called_once_with({'owner': "me"})
+        self.assertEquals(None, registry._thread)
+
+    def test_key(self, _get_collection):
+        unit = mock.MagicMock(checksumtype="sha1", checksum="abc")
+        self.assertEquals("sha1:abc", inflight.InFlightRegistry.key(unit))
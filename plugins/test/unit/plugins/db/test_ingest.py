@@ -0,0 +1,87 @@
+"""
+Contains tests for pulp_win.plugins.db.ingest.
+"""
+
+import hashlib
+import os
+# Important to import testbase, since it mocks the server's config import snafu
+from .... import testbase
+from pulp_win.plugins.db import ingest, msidb
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                           '../../../data'))
+MSI_PATH = os.path.join(DATA_DIR, "lorem-ipsum-0.0.1.msi")
+
+
+class CountingFile(object):
+    def __init__(self, fobj):
+        self.fobj = fobj
+        self.name = fobj.name
+        self.bytes_read = 0
+
+    def seek(self, offset, whence=0):
+        return self.fobj.seek(offset, whence)
+
+    def tell(self):
+        return self.fobj.tell()
+
+    def read(self, size):
+        data = self.fobj.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class TestSinglePassReader(testbase.TestCase):
+    def _reader(self, path, block_size):
+        fobj = CountingFile(open(path, "rb"))
+        reader = ingest.SinglePassReader(fobj, ['sha256', 'md5'])
+        reader.BLOCK_SIZE = block_size
+        reader.CHUNK_SIZE = 4 * block_size
+        return fobj, reader
+
+    def test_checksums(self):
+        contents = os.urandom(10000)
+        path = self.new_file(contents=contents).path
+        fobj, reader = self._reader(path, 512)
+        reader.seek(700)
+        self.assertEquals(contents[700:1800], reader.read(1100))
+        reader.seek(9000)
+        self.assertEquals(contents[9000:], reader.read(5000))
+        self.assertEquals(10000, reader.tell())
+        self.assertEquals(
+            dict(sha256=hashlib.sha256(contents).hexdigest(),
+                 md5=hashlib.md5(contents).hexdigest()),
+            reader.checksums())
+        self.assertEquals(10000, reader.size)
+        self.assertEquals(10000, fobj.bytes_read)
+
+    def test_checksums_block_aligned(self):
+        contents = os.urandom(2048)
+        path = self.new_file(contents=contents).path
+        fobj, reader = self._reader(path, 512)
+        self.assertEquals(
+            hashlib.sha256(contents).hexdigest(),
+            reader.checksums()['sha256'])
+        self.assertEquals(2048, reader.size)
+        self.assertEquals(2048, fobj.bytes_read)
+
+    def test_msi_read_once(self):
+        fobj, reader = self._reader(MSI_PATH, 1024)
+        tables, contents = msidb.read_tables(reader, ['Property'])
+        self.assertIn('Property', contents)
+        self.assertEquals(
+            '6fab18ef14a41010b1c865a948bbbdb41ce0779a4520acabb936d931410fac07',  # noqa
+            reader.checksums()['sha256'])
+        self.assertEquals(os.path.getsize(MSI_PATH), fobj.bytes_read)
+
+    def test_precomputed_checksums(self):
+        fobj = CountingFile(open(MSI_PATH, "rb"))
+        checksums = dict(sha256="a" * 64, md5="b" * 32, sha1="c" * 40)
+        reader = ingest.SinglePassReader(fobj, ['sha256', 'md5'], checksums)
+        reader.BLOCK_SIZE = 512
+        msidb.read_tables(reader, ['Property'])
+        self.assertEquals(dict(sha256="a" * 64, md5="b" * 32),
+                          reader.checksums())
+        self.assertEquals(os.path.getsize(MSI_PATH), reader.size)
+        # Only the blocks needed for the metadata were read, and not hashed
+        self.assertTrue(fobj.bytes_read <= os.path.getsize(MSI_PATH))
@@ -0,0 +1,102 @@
+"""
+Contains tests for pulp_win.plugins.db.mirrors.
+"""
+
+import mock
+# Important to import testbase, since it mocks the server's config import snafu
+from .... import testbase
+from pulp_win.plugins.db import mirrors
+
+URLS = ["http://m1/repo/", "http://m2/repo/", "http://m3/repo/"]
+
+
+class TestMirrorScores(testbase.TestCase):
+    @mock.patch("pulp_win.plugins.db.mirrors.MirrorStats.objects")
+    def _scores(self, _objects, stored=()):
+        _objects.return_value = list(stored)
+        scores = mirrors.MirrorScores(URLS)
+        _objects.assert_called_once_with(url__in=URLS)
+        return scores
+
+    def test_rank(self):
+        scores = self._scores(stored=[
+            mirrors.MirrorStats(url=URLS[0], throughput=100.0, health=0.5),
+            mirrors.MirrorStats(url=URLS[1], throughput=80.0, health=1.0),
+        ])
+        # m3 was never measured, it gets the best throughput seen
+        self.assertEquals(50, scores.score(URLS[0]))
+        self.assertEquals(80, scores.score(URLS[1]))
+        self.assertEquals(100, scores.score(URLS[2]))
+        self.assertEquals([URLS[2], URLS[1], URLS[0]], scores.rank(URLS))
+
+    def test_record(self):
+        scores = self._scores()
+        scores.record_download(URLS[0], 1000, 2)
+        scores.record_download(URLS[0], 1000, 1)
+        stats = scores._stats[URLS[0]]
+        self.assertAlmostEquals(0.3 * 1000 + 0.7 * 500, stats.throughput)
+        self.assertEquals(2, stats.successes)
+        scores.record_failure(URLS[0])
+        self.assertAlmostEquals(0.7, stats.health)
+        self.assertEquals(1, stats.failures)
+        scores.record_metadata(URLS[1], 0.5)
+        self.assertEquals(0.5, scores._stats[URLS[1]].latency)
+
+    @mock.patch("pulp_win.plugins.db.mirrors.MirrorStats._get_collection")
+    def test_save(self, _get_collection):
+        collection = _get_collection.return_value
+        scores = self._scores()
+        scores.record_download(URLS[0], 1000, 1)
+        scores.record_failure(URLS[0])
+        scores.record_metadata(URLS[1], 0.5)
+
+        stored = dict(_id=URLS[0], throughput=500.0, latency=None,
+                      health=1.0, successes=3, failures=0)
+        # Another sync saved its samples between our read and our update
+        concurrent = dict(stored, throughput=600.0, successes=4)
+        collection.find_one.side_effect = lambda spec: dict(
+            [(URLS[0], [stored, concurrent][
+                min(collection.update_one.call_count, 1)])]).get(spec['_id'])
+        collection.update_one.side_effect = [
+            mock.MagicMock(modified_count=0),
+            mock.MagicMock(modified_count=1)]
+        scores.save()
+
+        self.assertEquals(2, collection.update_one.call_count)
+        spec, update = collection.update_one.call_args[0]
+        self.assertEquals(
+            dict(_id=URLS[0], throughput=600.0, latency=None, health=1.0),
+            spec)
+        # Our samples, on top of what the other sync saved
+        self.assertAlmostEquals(0.3 * 1000 + 0.7 * 600,
+                                update['$set']['throughput'])
+        self.assertAlmostEquals(0.7, update['$set']['health'])
+        self.assertEquals(dict(successes=1, failures=1), update['$inc'])
+        # m2 was never saved
+        doc = collection.insert_one.call_args[0][0]
+        self.assertEquals((URLS[1], 0.5, 1.0, 1, 0), (
+            doc['_id'], doc['latency'], doc['health'], doc['successes'],
+            doc['failures']))
+
+        # Only what changed since is saved again
+        collection.reset_mock()
+        scores.save()
+        self.assertFalse(collection.find_one.called)
+
+    @mock.patch("pulp_win.plugins.db.mirrors.random.uniform")
+    def test_choose(self, _uniform):
+        scores = self._scores(stored=[
+            mirrors.MirrorStats(url=URLS[0], throughput=100.0),
+            mirrors.MirrorStats(url=URLS[1], throughput=300.0),
+            mirrors.MirrorStats(url=URLS[2], throughput=100.0, health=0.0),
+        ])
+        _uniform.return_value = 99
+        self.assertEquals(URLS[0], scores.choose(URLS))
+        _uniform.assert_called_once_with(0, 400.0)
+        _uniform.return_value = 101
+        self.assertEquals(URLS[1], scores.choose(URLS))
+
+    def test_mirror_for(self):
+        scores = self._scores()
+        self.assertEquals(URLS[1], scores.mirror_for(URLS[1] + "a-1.msi"))
+        self.assertEquals(None, scores.mirror_for("http://other/a-1.msi"))
@@ -4,6 +4,8 @@ Contains tests for pulp_win.plugins.importers.importer.
 
 from __future__ import unicode_literals
 
+import errno
+import hashlib
 import mock
 import os
 # Important to import testbase, since it mocks the server's config import snafu
@@ -26,6 +28,61 @@ class TestModel(testbase.TestCase):
             'checksumtype': 'sha256',
             })
 
+    @mock.patch("pulp_win.plugins.db.models.subprocess.Popen")
+    def test_from_file_no_msiinfo(self, _Popen):
+        # The in-process reader handles the file, msiinfo is not needed
+        msi_path = os.path.join(DATA_DIR, "lorem-ipsum-0.0.1.msi")
+        pkg = models.MSI.from_file(msi_path)
+        self.assertEquals('Cicero Enterprises', pkg.Manufacturer)
+        self.assertEquals('{0FE5FDB7-1DA6-44D2-8C17-10510D12D0EE}',
+                          pkg.ProductCode)
+        self.assertEquals([], pkg.ModuleSignature)
+        self.assertFalse(_Popen.called)
+
+    def test_from_file_cache_miss(self):
+        msi_path = os.path.join(DATA_DIR, "lorem-ipsum-0.0.1.msi")
+        cache = mock.MagicMock()
+        cache.get.return_value = None
+        pkg = models.MSI.from_file(msi_path, cache=cache)
+        checksum = '6fab18ef14a41010b1c865a948bbbdb41ce0779a4520acabb936d931410fac07'  # noqa
+        cache.get.assert_called_once_with('msi', checksum)
+        self.assertEquals(1, cache.put.call_count)
+        self.assertEquals(('msi', checksum), cache.put.call_args[0][:2])
+        self.assertEquals('lorem-ipsum', cache.put.call_args[0][2]['name'])
+        self.assertEquals(9728, pkg.size)
+
+    @mock.patch("pulp_win.plugins.db.models.MSI._read_metadata")
+    def test_from_file_cache_hit(self, _read_metadata):
+        cache = mock.MagicMock()
+        cache.get.return_value = dict(
+            name='lorem-ipsum', version='0.0.1', checksum='abc',
+            checksumtype='sha256', filename='lorem-ipsum-0.0.1.msi')
+        # With a known checksum, the file is not even opened
+        pkg = models.MSI.from_file('/missing-file', cache=cache,
+                                   checksum='abc')
+        cache.get.assert_called_once_with('msi', 'abc')
+        self.assertFalse(cache.put.called)
+        self.assertFalse(_read_metadata.called)
+        self.assertEquals('lorem-ipsum', pkg.name)
+
+    def test_from_file_checksums(self):
+        msi_path = os.path.join(DATA_DIR, "lorem-ipsum-0.0.1.msi")
+        pkg = models.MSI.from_file(msi_path)
+        self.assertEquals(
+            dict(sha256='6fab18ef14a41010b1c865a948bbbdb41ce0779a4520acabb936d931410fac07',  # noqa
+                 sha1=hashlib.sha1(open(msi_path, "rb").read()).hexdigest(),
+                 md5=hashlib.md5(open(msi_path, "rb").read()).hexdigest()),
+            pkg.checksums)
+
+    def test_from_file_precomputed_checksums(self):
+        msi_path = os.path.join(DATA_DIR, "lorem-ipsum-0.0.1.msi")
+        checksums = dict(sha256="a" * 64, sha1="b" * 40, md5="c" * 32)
+        pkg = models.MSI.from_file(msi_path, checksums=checksums)
+        # The digests are taken as they are, the file is not hashed
+        self.assertEquals("a" * 64, pkg.checksum)
+        self.assertEquals(checksums, pkg.checksums)
+        self.assertEquals(os.path.getsize(msi_path), pkg.size)
+
     def test_from_file_different_checksumtype(self):
         metadata = dict(checksumtype='sha1',
                         checksum='e9c828cfeddb8768cbf37b95deb234b383d91e2f')
@@ -64,8 +121,10 @@ class TestModel(testbase.TestCase):
     def _make_msi_table(cls, *tables):
         return '\n'.join(tables)
 
+    @mock.patch("pulp_win.plugins.db.models.msidb.read_tables",
+                side_effect=models.msidb.Error("unsupported"))
     @mock.patch("pulp_win.plugins.db.models.subprocess.Popen")
-    def test_from_file_msi(self, _Popen):
+    def test_from_file_msi(self, _Popen, _read_tables):
         msm_md_path = os.path.join(DATA_DIR, "msm-msiinfo-export.out")
         msm_md = open(msm_md_path).read()
         msi_properties = self._make_msi_property(
@@ -97,8 +156,11 @@ class TestModel(testbase.TestCase):
             ],
             pkg.ModuleSignature)
 
+    @mock.patch("pulp_win.plugins.db.models.msidb.read_tables",
+                side_effect=models.msidb.Error("unsupported"))
     @mock.patch("pulp_win.plugins.db.models.subprocess.Popen")
-    def test_from_file_msi_no_module_signature(self, _Popen):
+    def test_from_file_msi_no_module_signature(self, _Popen,
+                                               _read_tables):
         msm_md_path = os.path.join(DATA_DIR, "msm-msiinfo-export.out")
         msm_md = open(msm_md_path).read()
         msi_properties = self._make_msi_property(
@@ -127,8 +189,10 @@ class TestModel(testbase.TestCase):
             [],
             pkg.ModuleSignature)
 
+    @mock.patch("pulp_win.plugins.db.models.msidb.read_tables",
+                side_effect=models.msidb.Error("unsupported"))
     @mock.patch("pulp_win.plugins.db.models.subprocess.Popen")
-    def test_from_file_msm(self, _Popen):
+    def test_from_file_msm(self, _Popen, _read_tables):
         msm_md_path = os.path.join(DATA_DIR, "msm-msiinfo-export.out")
         msm_md = open(msm_md_path).read()
         popen = _Popen.return_value
@@ -148,6 +212,14 @@ class TestModel(testbase.TestCase):
         self.assertEquals("8E012345_0123_4567_0123_0123456789AB",
                           pkg.guid)
 
+    def test_checksums_indexes(self):
+        for model_class in (models.MSI, models.MSM):
+            specs = dict((tuple(spec['fields']), spec)
+                         for spec in model_class._meta['index_specs'])
+            for checksum_type in models.CHECKSUM_TYPES:
+                spec = specs[(('checksums.%s' % checksum_type, 1),)]
+                self.assertTrue(spec['sparse'])
+
     def test_render_primary_msi(self):
         pkg = models.MSI(name="burgundy", version="1.1.1984.0",
                          checksumtype="sha256", checksum="chksum",
@@ -155,7 +227,7 @@ class TestModel(testbase.TestCase):
         pkg.filename = pkg.filename_from_unit_key(pkg.unit_key)
         xml_str = pkg.render_primary("sha256")
         self.assertEquals(
-            '<package type="msi"><checksum pkgid="YES" type="sha256">chksum</checksum><name>burgundy</name><version>1.1.1984.0</version><size package="42" /><location href="burgundy-1.1.1984.0.msi" /></package>',  # noqa
+            '<package type="msi"><checksum pkgid="YES" type="sha256">chksum</checksum><name>burgundy</name><version>1.1.1984.0</version><ModuleSignature /><size package="42" /><location href="burgundy-1.1.1984.0.msi" /></package>',  # noqa
             xml_str)
 
         # With ProductCode and UpgradeCode
@@ -167,5 +239,186 @@ class TestModel(testbase.TestCase):
         pkg.filename = pkg.filename_from_unit_key(pkg.unit_key)
         xml_str = pkg.render_primary("sha256")
         self.assertEquals(
-            '<package type="msi"><ProductCode>prodcode</ProductCode><UpgradeCode>upgrcode</UpgradeCode><checksum pkgid="YES" type="sha256">chksum</checksum><name>burgundy</name><version>1.1.1984.0</version><size package="42" /><location href="burgundy-1.1.1984.0.msi" /></package>',  # noqa
+            '<package type="msi"><ProductCode>prodcode</ProductCode><UpgradeCode>upgrcode</UpgradeCode><checksum pkgid="YES" type="sha256">chksum</checksum><name>burgundy</name><version>1.1.1984.0</version><ModuleSignature /><size package="42" /><location href="burgundy-1.1.1984.0.msi" /></package>',  # noqa
             xml_str)
+
+    def test_render_primary_extracted_fields(self):
+        pkg = models.MSI(name="burgundy", version="1.1.1984.0",
+                         checksumtype="sha256", checksum="chksum",
+                         size=42, Manufacturer="ACME",
+                         ModuleSignature=[dict(name="mod", guid="{g}",
+                                               version="1.0")])
+        pkg.filename = pkg.filename_from_unit_key(pkg.unit_key)
+        xml_str = pkg.render_primary("sha256")
+        self.assertIn('<Manufacturer>ACME</Manufacturer>', xml_str)
+        self.assertIn(
+            '<ModuleSignature><module guid="{g}" name="mod" version="1.0" />'
+            '</ModuleSignature>', xml_str)
+
+        pkg = models.MSM(name="burgundy", version="1.1.1984.0",
+                         checksumtype="sha256", checksum="chksum",
+                         size=42, guid="{g}")
+        pkg.filename = pkg.filename_from_unit_key(pkg.unit_key)
+        self.assertIn('<guid>{g}</guid>', pkg.render_primary("sha256"))
+
+    def test_render_primary_stored_checksum(self):
+        pkg = models.MSI(name="burgundy", version="1.1.1984.0",
+                         checksumtype="sha256", checksum="chksum",
+                         checksums=dict(sha256="chksum", sha1="chksum1"),
+                         size=42)
+        pkg.filename = pkg.filename_from_unit_key(pkg.unit_key)
+        xml_str = pkg.render_primary("sha1")
+        self.assertEquals(
+            '<package type="msi"><checksum pkgid="YES" type="sha1">chksum1</checksum><name>burgundy</name><version>1.1.1984.0</version><ModuleSignature /><size package="42" /><location href="burgundy-1.1.1984.0.msi" /></package>',  # noqa
+            xml_str)
+        # Types that were not stored fall back to the unit's checksum
+        xml_str = pkg.render_primary("md5")
+        self.assertIn('<checksum pkgid="YES" type="sha256">chksum</checksum>',
+                      xml_str)
+
+    def test_pre_save_signal_repodata(self):
+        pkg = models.MSI(name="burgundy", version="1.1.1984.0",
+                         checksumtype="sha256", checksum="chksum",
+                         checksums=dict(sha256="chksum", sha1="chksum1"),
+                         size=42)
+        pkg.filename = pkg.filename_from_unit_key(pkg.unit_key)
+        models.MSI.pre_save_signal(models.MSI, pkg)
+        self.assertEquals(['sha1', 'sha256'], sorted(pkg.repodata))
+        self.assertEquals(
+            '<package type="msi"><checksum pkgid="YES" type="sha1">chksum1</checksum><name>burgundy</name><version>1.1.1984.0</version><ModuleSignature /><size package="42" /><location href="burgundy-1.1.1984.0.msi" /></package>',  # noqa
+            pkg.repodata['sha1'])
+        self.assertNotIn('repodata', pkg.all_properties)
+
+        # Publishing serves the stored fragment, without building any XML
+        pkg.repodata['sha256'] = '<package>cached</package>'
+        with mock.patch.object(models.MSI, '_package_to_xml') as _to_xml:
+            self.assertEquals('<package>cached</package>',
+                              pkg.render_primary('sha256'))
+            self.assertEquals('<package>cached</package>',
+                              pkg.render_primary(None))
+        self.assertFalse(_to_xml.called)
+
+        # Fragments rendered by an older version are not served
+        pkg.repodata_version = None
+        self.assertIn('<name>burgundy</name>', pkg.render_primary('sha256'))
+
+    @mock.patch("pulp_win.plugins.db.models.RepositoryContentUnit")
+    @mock.patch("pulp_win.plugins.db.models.MSI.safe_import_content")
+    @mock.patch("pulp_win.plugins.db.models.MSI.objects")
+    @mock.patch("pulp_win.plugins.db.models.MSI._get_collection")
+    def test_save_and_associate_units(self, _get_collection, _objects,
+                                      _safe_import_content,
+                                      _RepositoryContentUnit):
+        units = [models.MSI(name="pkg%d" % i, version="1.0",
+                            checksumtype="sha256", checksum="chksum%d" % i)
+                 for i in range(3)]
+        stored = models.MSI(name="pkg1", version="1.0",
+                            checksumtype="sha256", checksum="chksum1")
+        _get_collection.return_value.insert_many.side_effect = \
+            models.BulkWriteError(dict(writeErrors=[
+                dict(index=1, code=11000, errmsg="duplicate key")]))
+        _objects.return_value = [stored]
+        repo = mock.MagicMock(repo_id="repo1")
+
+        ret = models.save_and_associate_units(
+            repo, [(unit, "/tmp/pkg%d.msi" % i)
+                   for i, unit in enumerate(units)])
+
+        self.assertEquals([units[0], stored, units[2]], ret)
+        docs, = _get_collection.return_value.insert_many.call_args[0]
+        self.assertEquals(["pkg0", "pkg1", "pkg2"],
+                          [doc['name'] for doc in docs])
+        self.assertEquals(
+            dict(ordered=False),
+            _get_collection.return_value.insert_many.call_args[1])
+        # A single query resolves the duplicates
+        _objects.assert_called_once_with(checksum__in=["chksum1"])
+        # Only the new units get their content imported
+        self.assertEquals(
+            [mock.call("/tmp/pkg0.msi"), mock.call("/tmp/pkg2.msi")],
+            _safe_import_content.call_args_list)
+        # And all of them are associated with one write
+        bulk_write = _RepositoryContentUnit._get_collection.return_value.bulk_write  # noqa
+        self.assertEquals(1, bulk_write.call_count)
+        self.assertEquals(3, len(bulk_write.call_args[0][0]))
+
+    @mock.patch("pulp_win.plugins.db.models.MSI._get_collection")
+    def test_save_and_associate_units_error(self, _get_collection):
+        unit = models.MSI(name="pkg", version="1.0",
+                          checksumtype="sha256", checksum="chksum")
+        _get_collection.return_value.insert_many.side_effect = \
+            models.BulkWriteError(dict(writeErrors=[
+                dict(index=0, code=2, errmsg="bad value")]))
+        with mock.patch.object(models.MSI, 'safe_import_content'):
+            self.assertRaises(models.BulkWriteError,
+                              models.save_and_associate_units,
+                              mock.MagicMock(), [(unit, "/tmp/pkg.msi")])
+
+    @mock.patch("pulp_win.plugins.db.models.Repository")
+    @mock.patch("pulp_win.plugins.db.models.RepositoryContentUnit")
+    def test_unassociate_units(self, _RepositoryContentUnit, _Repository):
+        collection = _RepositoryContentUnit._get_collection.return_value
+        collection.delete_many.side_effect = [
+            mock.MagicMock(deleted_count=2), mock.MagicMock(deleted_count=0)]
+        repo = mock.MagicMock(repo_id="repo1")
+        self.assertEquals(2, models.unassociate_units(
+            repo, ["a", "b", "c"], ["msm", "msi"]))
+        self.assertEquals(
+            ["msi", "msm"],
+            [c[0][0]['unit_type_id']
+             for c in collection.delete_many.call_args_list])
+        _Repository.objects.assert_called_once_with(repo_id="repo1")
+        update = _Repository.objects.return_value.update_one.call_args[1]
+        self.assertEquals(-2, update['inc__content_unit_counts__msi'])
+        self.assertNotIn('inc__content_unit_counts__msm', update)
+
+        # Nothing removed, nothing to update
+        _Repository.reset_mock()
+        self.assertEquals(0, models.unassociate_units(repo, [], ["msi"]))
+        self.assertFalse(_Repository.objects.called)
+
+    @mock.patch("pulp_win.plugins.db.models.storage.link_or_copy")
+    def test_import_content(self, _link_or_copy):
+        unit = models.MSI(name="pkg", version="1.0",
+                          checksumtype="sha256", checksum="chksum")
+        unit.set_storage_path("pkg-1.0.msi")
+        unit.import_content("/tmp/pkg.msi")
+        _link_or_copy.assert_called_once_with("/tmp/pkg.msi",
+                                              unit._storage_path)
+
+    @mock.patch("pulp_win.plugins.db.models.storage.move")
+    @mock.patch("pulp_win.plugins.db.models.MSI.safe_import_content")
+    def test_import_file_move(self, _safe_import_content, _move):
+        unit = models.MSI(name="pkg", version="1.0",
+                          checksumtype="sha256", checksum="chksum")
+        unit.set_storage_path("pkg-1.0.msi")
+        unit.import_file("/tmp/pkg.msi")
+        _safe_import_content.assert_called_once_with("/tmp/pkg.msi")
+        self.assertFalse(_move.called)
+
+        unit.import_file("/tmp/pkg.msi", move=True)
+        _move.assert_called_once_with("/tmp/pkg.msi", unit._storage_path)
+
+        # The unit does not outlive a failed import
+        _move.side_effect = OSError(28, "No space left on device")
+        with mock.patch.object(unit, 'delete') as _delete:
+            self.assertRaises(OSError, unit.import_file, "/tmp/pkg.msi",
+                              move=True)
+            _delete.assert_called_once_with()
+
+    @mock.patch("pulp_win.plugins.db.models.storage._reflink")
+    @mock.patch("pulp_win.plugins.db.models.MSI.safe_import_content")
+    def test_import_file_owned(self, _safe_import_content, _reflink):
+        _reflink.side_effect = IOError(errno.EOPNOTSUPP, "not supported")
+        src = os.path.join(self.work_dir, "upload")
+        with open(src, "w") as fobj:
+            fobj.write("lorem ipsum")
+        unit = models.MSI(name="pkg", version="1.0",
+                          checksumtype="sha256", checksum="chksum")
+        unit._storage_path = os.path.join(self.work_dir, "storage",
+                                          "pkg-1.0.msi")
+        # An upload staging file is linked into storage, not copied
+        unit.import_file(src, owned=True)
+        self.assertFalse(_safe_import_content.called)
+        self.assertEquals(os.stat(src).st_ino,
+                          os.stat(unit._storage_path).st_ino)
@@ -0,0 +1,102 @@
+"""
+Contains tests for pulp_win.plugins.db.msidb.
+"""
+
+from __future__ import unicode_literals
+
+import glob
+import os
+import unittest
+# Important to import testbase, since it mocks the server's config import snafu
+from .... import testbase
+from pulp_win.plugins.db import models, msidb
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                           '../../../data'))
+MSI_PATH = os.path.join(DATA_DIR, "lorem-ipsum-0.0.1.msi")
+# Same database, with a Manufacturer over 64k
+LONG_STRING_PATH = os.path.join(DATA_DIR, "long-string-0.0.1.msi")
+
+
+class TestMsiDatabase(testbase.TestCase):
+    def test_decode_stream_name(self):
+        # Encoded form of the _StringPool table stream
+        self.assertEquals(
+            msidb.TABLE_PREFIX + '_StringPool',
+            msidb.decode_stream_name(
+                '\u4840\u3f3f\u4577\u446c\u3e6a\u44b2\u482f'))
+
+    def test_read_tables(self):
+        tables, contents = msidb.read_tables(
+            MSI_PATH, ['Property', 'ModuleSignature'])
+        self.assertIn('Property', tables)
+        self.assertIn('File', tables)
+        self.assertNotIn('ModuleSignature', tables)
+        self.assertEquals(['Property'], list(contents))
+        props = dict((r['Property'], r['Value'])
+                     for r in contents['Property'])
+        self.assertEquals('lorem-ipsum', props['ProductName'])
+        self.assertEquals('0.0.1', props['ProductVersion'])
+        self.assertEquals('{12345678-1234-1234-1234-111111111111}',
+                          props['UpgradeCode'])
+
+    def test_read_tables_long_string(self):
+        tables, contents = msidb.read_tables(LONG_STRING_PATH, ['Property'])
+        props = dict((r['Property'], r['Value'])
+                     for r in contents['Property'])
+        self.assertEquals(140000, len(props['Manufacturer']))
+        self.assertTrue(props['Manufacturer'].startswith(
+            'Cicero Enterprises xxx'))
+        # The strings stored after it are found at the right offset
+        self.assertEquals('lorem-ipsum', props['ProductName'])
+        self.assertEquals('NEWERVERSIONDETECTED;OLDERVERSIONBEINGUPGRADED',
+                          props['SecureCustomProperties'])
+        self.assertEquals(msidb.read_tables(MSI_PATH, [])[0], tables)
+
+    def test_read_tables_file_object(self):
+        with open(MSI_PATH, "rb") as fobj:
+            tables, contents = msidb.read_tables(fobj, ['Property'])
+        self.assertIn('Property', contents)
+
+    def test_read_tables_missing_table(self):
+        with open(MSI_PATH, "rb") as fobj:
+            db = msidb.MsiDatabase(fobj)
+            with self.assertRaises(msidb.Error):
+                db.read_table('ModuleSignature')
+
+    def test_not_ole(self):
+        with self.assertRaises(msidb.Error) as ctx:
+            msidb.read_tables(__file__, ['Property'])
+        self.assertEquals("Not an OLE compound file", str(ctx.exception))
+
+    def test_truncated(self):
+        path = self.new_file(contents=open(MSI_PATH, "rb").read()[:1024])[0]
+        with self.assertRaises(msidb.Error):
+            msidb.read_tables(path, ['Property'])
+
+    def test_missing_file(self):
+        with self.assertRaises(msidb.Error):
+            msidb.read_tables('/missing-file', ['Property'])
+
+
+@unittest.skipUnless(os.path.exists(models.MSIINFO_PATH),
+                     "msiinfo is not available")
+class TestMsiinfoParity(testbase.TestCase):
+    """
+    The in-process reader has to return exactly what msiinfo would.
+    """
+    def _packages(self):
+        return sorted(glob.glob(os.path.join(DATA_DIR, "*.ms[im]")))
+
+    def test_parity(self):
+        for path in self._packages():
+            native = models.Package._read_msi_info_native(path)
+            msiinfo = models.Package._read_msi_info_msiinfo(path)
+            # msiinfo also lists the system tables
+            msiinfo['tables'] = set(t for t in msiinfo['tables']
+                                    if t and not t.startswith('_'))
+            if msiinfo['Property'] is not None:
+                # msiinfo returns the column names and types as rows
+                msiinfo['Property'].pop('Property', None)
+                msiinfo['Property'].pop('s72', None)
+            self.assertEquals(msiinfo, native, path)
@@ -0,0 +1,98 @@
+"""
+Contains tests for pulp_win.plugins.db.storage.
+"""
+import errno
+import mock
+import os
+
+from .... import testbase
+from pulp_win.plugins.db import storage
+
+
+class TestLinkOrCopy(testbase.TestCase):
+    def setUp(self):
+        super(TestLinkOrCopy, self).setUp()
+        self.src = os.path.join(self.work_dir, "a-1.msi")
+        with open(self.src, "w") as fobj:
+            fobj.write("lorem ipsum")
+        self.dst = os.path.join(self.work_dir, "storage", "a", "a-1.msi")
+
+    def _listdir(self):
+        return os.listdir(os.path.dirname(self.dst))
+
+    @mock.patch("pulp_win.plugins.db.storage._reflink")
+    def test_hardlink(self, _reflink):
+        _reflink.side_effect = IOError(errno.EOPNOTSUPP, "not supported")
+        self.assertEquals(storage.HARDLINK,
+                          storage.link_or_copy(self.src, self.dst,
+                                               hardlink=True))
+        self.assertEquals(os.stat(self.src).st_ino,
+                          os.stat(self.dst).st_ino)
+        self.assertEquals(["a-1.msi"], self._listdir())
+
+    @mock.patch("pulp_win.plugins.db.storage.os.link")
+    @mock.patch("pulp_win.plugins.db.storage._reflink")
+    def test_no_hardlink(self, _reflink, _link):
+        _reflink.side_effect = IOError(errno.EOPNOTSUPP, "not supported")
+        # Not linked unless asked for
+        self.assertEquals(storage.COPY,
+                          storage.link_or_copy(self.src, self.dst))
+        self.assertFalse(_link.called)
+        self.assertNotEquals(os.stat(self.src).st_ino,
+                             os.stat(self.dst).st_ino)
+
+    @mock.patch("pulp_win.plugins.db.storage.os.link")
+    @mock.patch("pulp_win.plugins.db.storage._reflink")
+    def test_copy(self, _reflink, _link):
+        _reflink.side_effect = IOError(errno.EXDEV, "cross-device")
+        _link.side_effect = OSError(errno.EXDEV, "cross-device")
+        self.assertEquals(storage.COPY,
+                          storage.link_or_copy(self.src, self.dst,
+                                               hardlink=True))
+        self.assertEquals("lorem ipsum", open(self.dst).read())
+        self.assertNotEquals(os.stat(self.src).st_ino,
+                             os.stat(self.dst).st_ino)
+        self.assertEquals(["a-1.msi"], self._listdir())
+
+    def test_replace(self):
+        os.makedirs(os.path.dirname(self.dst))
+        with open(self.dst, "w") as fobj:
+            fobj.write("garbage")
+        storage.link_or_copy(self.src, self.dst)
+        self.assertEquals("lorem ipsum", open(self.dst).read())
+        self.assertEquals(["a-1.msi"], self._listdir())
+
+    def test_missing(self):
+        with self.assertRaises(IOError):
+            storage.link_or_copy(self.src + ".missing", self.dst)
+        self.assertEquals([], self._listdir())
+
+
+class TestMove(testbase.TestCase):
+    def setUp(self):
+        super(TestMove, self).setUp()
+        self.src = os.path.join(self.work_dir, "a-1.msi")
+        with open(self.src, "w") as fobj:
+            fobj.write("lorem ipsum")
+        self.dst = os.path.join(self.work_dir, "storage", "a", "a-1.msi")
+
+    @mock.patch("pulp_win.plugins.db.storage._fsync")
+    def test_rename(self, _fsync):
+        inode = os.stat(self.src).st_ino
+        self.assertEquals(storage.RENAME, storage.move(self.src, self.dst))
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEquals(inode, os.stat(self.dst).st_ino)
+        # The data reaches the disk before the rename, the directory after
+        self.assertEquals(
+            [mock.call(self.src), mock.call(os.path.dirname(self.dst))],
+            _fsync.call_args_list)
+
+    @mock.patch("pulp_win.plugins.db.storage.link_or_copy")
+    @mock.patch("pulp_win.plugins.db.storage.os.rename")
+    def test_cross_device(self, _rename, _link_or_copy):
+        _rename.side_effect = OSError(errno.EXDEV, "cross-device")
+        _link_or_copy.return_value = storage.COPY
+        self.assertEquals(storage.COPY, storage.move(self.src, self.dst))
+        _link_or_copy.assert_called_once_with(self.src, self.dst,
+                                              hardlink=True)
+        self.assertFalse(os.path.exists(self.src))
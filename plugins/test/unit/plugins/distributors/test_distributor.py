@@ -82,6 +82,20 @@ class TestConfiguration(BaseTest):
             distributor.validate_config(repo, config, conduit),
             (True, None))
 
+    def test_validate_config_checksum_type(self):
+        repo = mock.MagicMock(id="repo-1")
+        conduit = self._config_conduit()
+        config = dict(http=True, https=False, relative_url=None,
+                      checksum_type='sha1')
+        distributor = self.Module.WinDistributor()
+        self.assertEquals(
+            (True, None),
+            distributor.validate_config(repo, config, conduit))
+        config['checksum_type'] = 'sha3.14'
+        self.assertEquals(
+            (False, 'Configuration value for [checksum_type] must be one of md5, sha1, sha256'),  # noqa
+            distributor.validate_config(repo, config, conduit))
+
 
 class PublishRepoMixIn(object):
     @classmethod
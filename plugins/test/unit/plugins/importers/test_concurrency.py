@@ -0,0 +1,80 @@
+"""
+Contains tests for pulp_win.plugins.importers.concurrency.
+"""
+import threading
+
+from .... import testbase
+from pulp_win.plugins.importers import concurrency
+
+
+class TestAIMDController(testbase.TestCase):
+    def _controller(self, minimum=1, maximum=10, initial=4):
+        self.now = 0.0
+        self.report = dict()
+        return concurrency.AIMDController(minimum, maximum, initial=initial,
+                                          report=self.report,
+                                          clock=lambda: self.now)
+
+    def _window(self, controller, size=100, failed=0, seconds=1.0):
+        # Complete one window of downloads, one at a time
+        count = max(controller.limit, 4)
+        for idx in range(count):
+            controller.acquire("url%d" % idx)
+            if idx == count - 1:
+                self.now += seconds
+            controller.release("url%d" % idx, size,
+                               succeeded=idx >= failed)
+
+    def test_increase(self):
+        controller = self._controller()
+        self._window(controller)
+        self.assertEquals(5, controller.limit)
+        self._window(controller)
+        self.assertEquals(6, controller.limit)
+        self.assertEquals(6, self.report['current'])
+        self.assertEquals([[0, 4], [1.0, 5], [2.0, 6]],
+                          self.report['history'])
+
+    def test_errors(self):
+        controller = self._controller(initial=8)
+        self._window(controller, failed=1)
+        self.assertEquals(4, controller.limit)
+        self._window(controller, failed=4)
+        self.assertEquals(2, controller.limit)
+        self._window(controller, failed=4)
+        # Not below the minimum
+        self.assertEquals(1, controller.limit)
+
+    def test_throughput_drop(self):
+        controller = self._controller(initial=8)
+        self._window(controller, size=100)
+        self.assertEquals(9, controller.limit)
+        self._window(controller, size=10)
+        self.assertEquals(6, controller.limit)
+
+    def test_maximum(self):
+        controller = self._controller(maximum=5, initial=5)
+        self._window(controller)
+        self.assertEquals(5, controller.limit)
+
+    def test_release_unknown(self):
+        controller = self._controller()
+        controller.release("url0")
+        self.assertEquals(0, controller.in_flight)
+
+    def test_acquire_blocks(self):
+        controller = self._controller(initial=1)
+        controller.acquire("url0")
+        started = threading.Event()
+
+        def acquire():
+            controller.acquire("url1")
+            started.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(started.wait(0.1))
+        controller.release("url0")
+        self.assertTrue(started.wait(5))
+        thread.join()
+        self.assertEquals(1, controller.in_flight)
@@ -0,0 +1,609 @@
+"""
+Contains tests for pulp_win.plugins.importers.download.
+"""
+import BaseHTTPServer
+import hashlib
+import json
+import mock
+import os
+import threading
+import time
+
+from .... import testbase
+from pulp_win.plugins.db import bandwidth
+from pulp_win.plugins.importers import download
+
+
+class TestHashingFile(testbase.TestCase):
+    def _path(self):
+        return os.path.join(self.work_dir, "pkg.msi")
+
+    def test_write(self):
+        path = self._path()
+        dest = download.HashingFile(path)
+        # Nothing is opened until the first write
+        self.assertFalse(os.path.exists(path))
+        dest.write("lorem ")
+        dest.write("ipsum")
+        self.assertEquals(11, dest.tell())
+        dest.close()
+        self.assertEquals("lorem ipsum", open(path).read())
+        self.assertEquals(
+            dict(sha256=hashlib.sha256("lorem ipsum").hexdigest(),
+                 sha1=hashlib.sha1("lorem ipsum").hexdigest(),
+                 md5=hashlib.md5("lorem ipsum").hexdigest()),
+            dest.checksums())
+        self.assertEquals(11, dest.size)
+
+    def test_empty(self):
+        path = self._path()
+        dest = download.HashingFile(path, ['sha256'])
+        dest.finish()
+        dest.close()
+        self.assertEquals("", open(path).read())
+        self.assertEquals(dict(sha256=hashlib.sha256("").hexdigest()),
+                          dest.checksums())
+
+    def test_finish(self):
+        path = self._path()
+        dest = download.HashingFile(path)
+        dest.write("lorem")
+        dest.finish()
+        # Locked until closed
+        self.assertEquals(None, download._open_locked(path))
+        dest.close()
+        self.assertTrue(dest.closed)
+        download._open_locked(path).close()
+
+    def test_abort(self):
+        path = self._path()
+        dest = download.HashingFile(path)
+        dest.close()
+        # Never written, never created
+        self.assertFalse(os.path.exists(path))
+        dest.truncate(0)
+        dest.abort()
+        self.assertFalse(os.path.exists(path))
+        dest = download.HashingFile(path)
+        dest.write("lorem")
+        dest.abort()
+        # Kept, to be resumed
+        self.assertEquals("lorem", open(path).read())
+
+    def test_restart(self):
+        dest = download.HashingFile(self._path(), ['sha256'])
+        dest.write("garbage")
+        dest.seek(0)
+        dest.truncate()
+        dest.write("lorem")
+        dest.close()
+        self.assertEquals(dict(sha256=hashlib.sha256("lorem").hexdigest()),
+                          dest.checksums())
+
+    def test_seek(self):
+        dest = download.HashingFile(self._path(), ['sha256'])
+        dest.write("lorem")
+        dest.seek(2)
+        dest.write("x")
+        dest.close()
+        # The digests no longer describe the file
+        self.assertEquals(None, dest.checksums())
+
+    def test_resume(self):
+        path = self._path()
+        with open(path, "w") as fobj:
+            fobj.write("lorem ")
+        dest = download.HashingFile(path, ['sha256'])
+        self.assertEquals(6, dest.resume())
+        dest.write("ipsum")
+        dest.close()
+        self.assertEquals("lorem ipsum", open(path).read())
+        self.assertEquals(
+            dict(sha256=hashlib.sha256("lorem ipsum").hexdigest()),
+            dest.checksums())
+
+    def test_write_at(self):
+        path = self._path()
+        dest = download.HashingFile(path, ['sha256'])
+        self.assertEquals(0, dest.resume(11))
+        dest.write_at(6, "ips")
+        dest.write_at(2, "rem ")
+        self.assertEquals(0, dest.size)
+        self.assertEquals([(0, 1), (9, 10)], dest.missing(11))
+        dest.write_at(0, "lo")
+        # Hashed up to the gap
+        self.assertEquals(9, dest.size)
+        self.assertEquals(None, dest.checksums())
+        dest.write_at(9, "um")
+        self.assertEquals([], dest.missing(11))
+        dest.finish()
+        dest.close()
+        self.assertEquals("lorem ipsum", open(path).read())
+        self.assertEquals(
+            dict(sha256=hashlib.sha256("lorem ipsum").hexdigest()),
+            dest.checksums())
+        self.assertFalse(os.path.exists(dest.state_path))
+
+    def test_resume_segments(self):
+        path = self._path()
+        dest = download.HashingFile(path, ['sha256'])
+        dest.resume(11)
+        dest.write_at(0, "lor")
+        dest.write_at(6, "ips")
+        dest.abort()
+        self.assertEquals(
+            dict(size=11, ranges=[[0, 3], [6, 9]]),
+            json.load(open(dest.state_path)))
+
+        # Only the missing ranges are left
+        dest = download.HashingFile(path, ['sha256'])
+        self.assertEquals(3, dest.resume(11))
+        self.assertEquals([(3, 5), (9, 10)], dest.missing(11))
+        dest.write_at(3, "em ")
+        dest.write_at(9, "um")
+        dest.finish()
+        dest.close()
+        self.assertEquals(
+            dict(sha256=hashlib.sha256("lorem ipsum").hexdigest()),
+            dest.checksums())
+
+    def test_resume_segments_in_one_piece(self):
+        path = self._path()
+        dest = download.HashingFile(path, ['sha256'])
+        dest.resume(11)
+        dest.write_at(0, "lor")
+        dest.write_at(6, "ips")
+        dest.checkpoint()
+        dest.close()
+        # Cut at the first gap
+        dest = download.HashingFile(path, ['sha256'])
+        self.assertEquals(3, dest.resume())
+        self.assertFalse(os.path.exists(dest.state_path))
+        dest.write("em ipsum")
+        dest.close()
+        self.assertEquals("lorem ipsum", open(path).read())
+        self.assertEquals(
+            dict(sha256=hashlib.sha256("lorem ipsum").hexdigest()),
+            dest.checksums())
+
+    def test_locked(self):
+        path = self._path()
+        fallback = os.path.join(self.work_dir, "fallback.msi")
+        first = download.HashingFile(path)
+        first.write("lorem")
+        # Another download of the same package must not share the file
+        second = download.HashingFile(path, fallback=fallback)
+        self.assertEquals(0, second.resume())
+        self.assertTrue(second.fell_back)
+        second.write("ipsum")
+        second.close()
+        first.close()
+        self.assertEquals("lorem", open(path).read())
+        self.assertEquals("ipsum", open(fallback).read())
+        third = download.HashingFile(path)
+        third.write("dolor")
+        with self.assertRaises(download.DownloadError):
+            download.HashingFile(path).write("sit")
+        third.close()
+
+
+class TestPartialStore(testbase.TestCase):
+    def _store(self, **kwargs):
+        kwargs.setdefault('max_age', 3600)
+        kwargs.setdefault('max_size', 100)
+        return download.PartialStore(
+            os.path.join(self.work_dir, "partials"), **kwargs)
+
+    def _partial(self, store, name, size, age):
+        path = os.path.join(store.path, name + store.SUFFIX)
+        with open(path, "w") as fobj:
+            fobj.write("x" * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_path_for(self):
+        store = self._store()
+        unit = mock.MagicMock(checksumtype="sha256", checksum="abc123")
+        self.assertEquals(os.path.join(store.path, "sha256-abc123.part"),
+                          store.path_for(unit))
+        unit.checksum = "../../etc/passwd"
+        self.assertEquals(None, store.path_for(unit))
+
+    def test_evict(self):
+        store = self._store()
+        store.evict()
+        old = self._partial(store, "old", 10, 7200)
+        older = self._partial(store, "older", 60, 1000)
+        newer = self._partial(store, "newer", 60, 10)
+        other = os.path.join(store.path, "other")
+        open(other, "w").close()
+        states = [path + download.HashingFile.STATE_SUFFIX
+                  for path in (old, newer,
+                               os.path.join(store.path, "orphan.part"))]
+        for path in states:
+            open(path, "w").close()
+        self.assertEquals(2, store.evict())
+        self.assertEquals([False, False, True, True], [
+            os.path.exists(p) for p in (old, older, newer, other)])
+        self.assertEquals([False, True, False],
+                          [os.path.exists(p) for p in states])
+
+    def test_evict_locked(self):
+        store = self._store(max_size=0)
+        store.evict()
+        path = self._partial(store, "busy", 10, 10)
+        dest = download.HashingFile(path)
+        dest.write("lorem")
+        self.assertEquals(0, store.evict())
+        dest.close()
+        self.assertEquals(1, store.evict())
+        self.assertFalse(os.path.exists(path))
+
+    @mock.patch("pulp_win.plugins.importers.download.pulp_config")
+    def test_from_config(self, _pulp_config):
+        _pulp_config.get.return_value = "/var/cache/pulp"
+        store = download.PartialStore.from_config(dict())
+        self.assertEquals("/var/cache/pulp/win_partial_downloads", store.path)
+        self.assertEquals(None, download.PartialStore.from_config(
+            dict(partial_max_size=0)))
+
+
+class TestRangeFetcher(testbase.TestCase):
+    def _fetcher(self):
+        return download.RangeFetcher(mock.MagicMock(
+            ssl_validation=True, ssl_ca_cert_path=None,
+            ssl_client_cert_path=None, basic_auth_username=None,
+            proxy_url=None, headers=None, max_speed=None))
+
+    def _fetch(self, dest, status, body, headers=None, size=None):
+        fetcher = self._fetcher()
+        fetcher.session = mock.MagicMock()
+        response = fetcher.session.get.return_value
+        response.status_code = status
+        response.headers = headers or dict()
+        response.iter_content.return_value = [body]
+        fetcher.fetch("http://m1/a-1.msi", dest, size)
+        return fetcher.session.get.call_args
+
+    def _dest(self, contents):
+        path = os.path.join(self.work_dir, "a-1.msi")
+        with open(path, "w") as fobj:
+            fobj.write(contents)
+        dest = download.HashingFile(path, ['sha256'])
+        dest.resume()
+        return dest
+
+    def test_partial_content(self):
+        dest = self._dest("lorem ")
+        call = self._fetch(dest, 206, "ipsum",
+                           {'Content-Range': 'bytes 6-10/11'})
+        self.assertEquals({'Range': 'bytes=6-'}, call[1]['headers'])
+        dest.close()
+        self.assertEquals("lorem ipsum", open(dest.name).read())
+        self.assertEquals(
+            dict(sha256=hashlib.sha256("lorem ipsum").hexdigest()),
+            dest.checksums())
+
+    def test_range_ignored(self):
+        dest = self._dest("lorem ")
+        self._fetch(dest, 200, "lorem ipsum")
+        dest.close()
+        self.assertEquals("lorem ipsum", open(dest.name).read())
+        self.assertEquals(
+            dict(sha256=hashlib.sha256("lorem ipsum").hexdigest()),
+            dest.checksums())
+
+    def test_error(self):
+        dest = self._dest("lorem ")
+        with self.assertRaises(download.DownloadError):
+            self._fetch(dest, 404, "")
+        dest.close()
+
+    def test_already_complete(self):
+        dest = self._dest("lorem ipsum")
+        self._fetch(dest, 416, "", {'Content-Range': 'bytes */11'})
+        dest.close()
+        self.assertEquals("lorem ipsum", open(dest.name).read())
+        self.assertEquals(
+            dict(sha256=hashlib.sha256("lorem ipsum").hexdigest()),
+            dest.checksums())
+        # Without a Content-Range, from the size in the metadata
+        dest = self._dest("lorem ipsum")
+        self._fetch(dest, 416, "", size=11)
+        dest.close()
+        self.assertEquals("lorem ipsum", open(dest.name).read())
+
+    @mock.patch("pulp_win.plugins.importers.download.time")
+    def test_max_speed(self, _time):
+        _time.time.return_value = 100.0
+        fetcher = download.RangeFetcher(mock.MagicMock(
+            ssl_validation=True, ssl_ca_cert_path=None,
+            ssl_client_cert_path=None, basic_auth_username=None,
+            proxy_url=None, headers=None, max_speed=20, max_concurrent=2))
+        self.assertEquals(10, fetcher.max_speed)
+        self._serve(fetcher, "lorem ipsum")
+        dest = download.HashingFile(os.path.join(self.work_dir, "a-1.msi"))
+        fetcher.fetch("http://m1/a-1.msi", dest)
+        dest.close()
+        # 3 then 8 bytes at 10 bytes per second
+        self.assertEquals([mock.call(0.3), mock.call(1.1)],
+                          _time.sleep.call_args_list)
+
+    def _serve(self, fetcher, body, ranges=True):
+        def get(url, headers=None, **kwargs):
+            response = mock.MagicMock(headers=dict())
+            first, last = 0, len(body) - 1
+            if ranges and headers.get('Range'):
+                first, last = [int(x) for x in
+                               headers['Range'][6:].split('-')]
+                response.status_code = 206
+                response.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                    first, last, len(body))
+            else:
+                response.status_code = 200
+            data = body[first:last + 1]
+            response.iter_content.return_value = [data[:3], data[3:]]
+            return response
+        fetcher.session = mock.MagicMock()
+        fetcher.session.get.side_effect = get
+
+    def test_segments(self):
+        self.assertEquals([(0, 3), (4, 7), (8, 9)],
+                          download.segments([(0, 9)], 3))
+        self.assertEquals([(0, 0), (1, 1)], download.segments([(0, 1)], 4))
+        self.assertEquals([(0, 2), (10, 12), (13, 13)],
+                          download.segments([(0, 2), (10, 13)], 3))
+        self.assertEquals([], download.segments([], 2))
+
+    def test_fetch_segments(self):
+        path = os.path.join(self.work_dir, "a-1.msi")
+        body = "lorem ipsum dolor sit amet"
+        fetcher = self._fetcher()
+        self._serve(fetcher, body)
+        dest = download.HashingFile(path, ['sha256'])
+        fetcher.fetch_segments("http://m1/a-1.msi", dest, len(body), 4)
+        dest.finish()
+        dest.close()
+        self.assertEquals(body, open(path).read())
+        self.assertEquals(
+            ['bytes=0-6', 'bytes=14-20', 'bytes=21-25', 'bytes=7-13'],
+            sorted(c[1]['headers']['Range']
+                   for c in fetcher.session.get.call_args_list))
+        # Hashed while downloading
+        self.assertEquals(dict(sha256=hashlib.sha256(body).hexdigest()),
+                          dest.checksums())
+
+    def test_fetch_segments_resumed(self):
+        path = os.path.join(self.work_dir, "a-1.msi")
+        body = "lorem ipsum dolor sit amet"
+        dest = download.HashingFile(path, ['sha256'])
+        dest.resume(len(body))
+        dest.write_at(0, body[:10])
+        dest.write_at(20, body[20:])
+        dest.abort()
+
+        fetcher = self._fetcher()
+        self._serve(fetcher, body)
+        dest = download.HashingFile(path, ['sha256'])
+        fetcher.fetch_segments("http://m1/a-1.msi", dest, len(body), 4)
+        dest.finish()
+        dest.close()
+        self.assertEquals(body, open(path).read())
+        self.assertEquals(
+            ['bytes=10-12', 'bytes=13-15', 'bytes=16-18', 'bytes=19-19'],
+            sorted(c[1]['headers']['Range']
+                   for c in fetcher.session.get.call_args_list))
+        self.assertEquals(dict(sha256=hashlib.sha256(body).hexdigest()),
+                          dest.checksums())
+
+    def test_fetch_segments_not_supported(self):
+        path = os.path.join(self.work_dir, "a-1.msi")
+        fetcher = self._fetcher()
+        self._serve(fetcher, "lorem ipsum", ranges=False)
+        dest = download.HashingFile(path, ['sha256'])
+        with self.assertRaises(download.RangeNotSupported):
+            fetcher.fetch_segments("http://m1/a-1.msi", dest, 11, 2)
+        dest.abort()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(dest.state_path))
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    BODY = os.urandom(100 * 1024)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.BODY)))
+        self.end_headers()
+        self.wfile.write(self.BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBandwidthLimit(testbase.TestCase):
+    """
+    Two syncs sharing a bandwidth budget, against a local HTTP server.
+    """
+    def setUp(self):
+        super(TestBandwidthLimit, self).setUp()
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:%d/a-1.msi" % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(TestBandwidthLimit, self).tearDown()
+
+    def _download(self, limiter, path):
+        fetcher = download.RangeFetcher(mock.MagicMock(
+            ssl_validation=True, ssl_ca_cert_path=None,
+            ssl_client_cert_path=None, basic_auth_username=None,
+            proxy_url=None, headers=None, connect_timeout=5,
+            read_timeout=5, max_speed=None))
+        dest = download.HashingFile(path, ['sha256'], limiter=limiter)
+        fetcher.fetch(self.url, dest)
+        dest.close()
+
+    def test_shared_limit(self):
+        store = bandwidth.MemoryBucketStore()
+        threads = []
+        start = time.time()
+        for idx in range(2):
+            limiter = bandwidth.BandwidthLimiter(
+                store, "cluster", 200 * 1024, burst=16 * 1024)
+            limiter.LEASE_SIZE = 16 * 1024
+            path = os.path.join(self.work_dir, "a-1.msi.%d" % idx)
+            thread = threading.Thread(target=self._download,
+                                      args=(limiter, path))
+            thread.start()
+            threads.append((thread, path))
+        for thread, path in threads:
+            thread.join()
+            self.assertEquals(_Handler.BODY, open(path, "rb").read())
+        # 200KiB at 200KiB/s, minus the initial burst
+        self.assertTrue(time.time() - start >= 0.8)
+
+
+class TestPackages(testbase.TestCase):
+    @mock.patch("pulp_win.plugins.importers.download.alternate.Packages.__init__")  # noqa
+    def test_mirror_url(self, _init):
+        _init.return_value = None
+        scores = mock.MagicMock()
+        scores.choose.return_value = "http://m2/repo"
+        packages = download.Packages(
+            "http://m1/repo/", mock.MagicMock(), [], "/tmp", mock.MagicMock(),
+            mirrors=["http://m1/repo", "http://m2/repo"],
+            mirror_scores=scores)
+        _init.assert_called_once_with(
+            "http://m1/repo/", mock.ANY, [], "/tmp", mock.ANY)
+        self.assertEquals("http://m2/repo/a/a-1.msi",
+                          packages._mirror_url("http://m1/repo/a/a-1.msi"))
+        scores.choose.assert_called_once_with(
+            ["http://m1/repo", "http://m2/repo"])
+        # Not under the feed, left alone
+        self.assertEquals("http://other/a-1.msi",
+                          packages._mirror_url("http://other/a-1.msi"))
+
+    @mock.patch("pulp_win.plugins.importers.download.alternate.Packages.get_requests")  # noqa
+    @mock.patch("pulp_win.plugins.importers.download.alternate.Packages.__init__")  # noqa
+    def test_get_requests_partial(self, _init, _get_requests):
+        _init.return_value = None
+        store = download.PartialStore(self.work_dir, 3600, 100)
+        units = [mock.MagicMock(checksumtype="sha256", checksum=c, size=11)
+                 for c in ("aaa", "bbb")]
+        with open(store.path_for(units[1]), "w") as fobj:
+            fobj.write("lorem")
+        _get_requests.return_value = [
+            mock.MagicMock(url="http://m1/%s.msi" % u.checksum,
+                           destination="/tmp/%s.msi" % u.checksum, data=u)
+            for u in units]
+        concurrency = mock.MagicMock()
+        packages = download.Packages(
+            "http://m1/", mock.MagicMock(), units, "/tmp", mock.MagicMock(),
+            partials=store, concurrency=concurrency)
+        packages._pool = mock.MagicMock()
+        requests = list(packages.get_requests())
+        # The partial download is handed to the pool, to be resumed
+        self.assertEquals([units[0]], [r.data for r in requests])
+        self.assertEquals(store.path_for(units[0]),
+                          requests[0].destination.name)
+        job = packages._pool.put.call_args[0][0]
+        resumed = job.args[0].destination
+        self.assertEquals(5, resumed.size)
+        # Both took a slot
+        self.assertEquals(2, concurrency.acquire.call_count)
+
+        packages._fetcher = mock.MagicMock()
+        job()
+        packages._fetcher.fetch.assert_called_once_with(
+            "http://m1/bbb.msi", resumed, size=11)
+        packages.event_listener.download_succeeded.assert_called_once_with(
+            mock.ANY)
+        packages._fetcher.fetch.side_effect = download.DownloadError(
+            "HTTP 404")
+        job()
+        report = packages.event_listener.download_failed.call_args[0][0]
+        self.assertEquals("HTTP 404", report.error_msg)
+        resumed.close()
+
+    @mock.patch("pulp_win.plugins.importers.download.alternate.Packages.get_requests")  # noqa
+    @mock.patch("pulp_win.plugins.importers.download.alternate.Packages.__init__")  # noqa
+    def test_get_requests_segmented(self, _init, _get_requests):
+        _init.return_value = None
+        store = download.PartialStore(self.work_dir, 3600, 100)
+        units = [mock.MagicMock(size=s, checksumtype="sha256",
+                                checksum="c%d" % s)
+                 for s in (1000, 10)]
+        _get_requests.return_value = [
+            mock.MagicMock(url="http://m1/%d.msi" % u.size,
+                           destination=os.path.join(self.work_dir,
+                                                    "%d.msi" % u.size),
+                           data=u)
+            for u in units]
+        packages = download.Packages(
+            "http://m1/", mock.MagicMock(), units, "/tmp", mock.MagicMock(),
+            partials=store, segment_threshold=100, segment_count=4)
+        packages._pool = mock.MagicMock()
+        requests = list(packages.get_requests())
+        self.assertEquals([units[1]], [r.data for r in requests])
+        # Downloaded in segments into the partial download
+        job = packages._pool.put.call_args[0][0]
+        request = job.args[0]
+        self.assertEquals(units[0], request.data)
+        self.assertEquals(store.path_for(units[0]),
+                          request.destination.name)
+
+        packages._fetcher = mock.MagicMock()
+        job()
+        packages._fetcher.fetch_segments.assert_called_once_with(
+            request.url, request.destination, 1000, 4)
+        packages.event_listener.download_succeeded.assert_called_once_with(
+            mock.ANY)
+
+        # The server ignores ranges: downloaded in one piece
+        packages._fetcher.fetch_segments.side_effect = (
+            download.RangeNotSupported("no ranges"))
+        packages._fetch_segments(request, request.url, request.destination)
+        packages._fetcher.fetch.assert_called_once_with(
+            request.url, request.destination, 1000)
+        request.destination.close()
+
+    @mock.patch("pulp_win.plugins.importers.download.alternate.Packages.get_requests")  # noqa
+    @mock.patch("pulp_win.plugins.importers.download.alternate.Packages.__init__")  # noqa
+    def test_local(self, _init, _get_requests):
+        _init.return_value = None
+        feed = os.path.join(self.work_dir, "feed dir")
+        os.makedirs(feed)
+        with open(os.path.join(feed, "a-1.msi"), "w") as fobj:
+            fobj.write("lorem ipsum")
+        unit = mock.MagicMock(size=11)
+        dest = os.path.join(self.work_dir, "a-1.msi")
+        _get_requests.return_value = [mock.MagicMock(
+            url="file://%s/a-1.msi" % feed.replace(" ", "%20"),
+            destination=dest, data=unit)]
+        packages = download.Packages(
+            "file://%s/" % feed, mock.MagicMock(), [unit], "/tmp",
+            mock.MagicMock())
+        self.assertEquals([], list(packages.get_requests()))
+        packages._download_local()
+        self.assertEquals("lorem ipsum", open(dest).read())
+        # Not hard linked unless configured to
+        self.assertNotEquals(os.stat(os.path.join(feed, "a-1.msi")).st_ino,
+                             os.stat(dest).st_ino)
+        self.assertTrue(packages.event_listener.download_succeeded.called)
+
+    @mock.patch("pulp_win.plugins.importers.download.storage.link_or_copy")
+    @mock.patch("pulp_win.plugins.importers.download.alternate.Packages.__init__")  # noqa
+    def test_local_hardlink(self, _init, _link_or_copy):
+        _init.return_value = None
+        packages = download.Packages(
+            "file:///feed/", mock.MagicMock(), [], "/tmp", mock.MagicMock(),
+            hardlink_local=True)
+        packages._fetch_local("file:///feed/a-1.msi", "/tmp/a-1.msi")
+        _link_or_copy.assert_called_once_with(
+            "/feed/a-1.msi", "/tmp/a-1.msi", hardlink=True)
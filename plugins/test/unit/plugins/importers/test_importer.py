@@ -32,12 +32,6 @@ class TestEntryPoint(testbase.TestCase):
 
 
 class ModelMixIn(object):
-    def test__compute_checksum(self):
-        file_path, checksum = self.new_file()
-        self.assertEquals(
-            checksum,
-            self.__class__.Model._compute_checksum(open(file_path)))
-
     def test_filename_from_unit_key(self):
         unit_key = dict(name="aaa", version="1", extra="bbb")
         self.assertEquals(
@@ -172,8 +166,9 @@ class TestWinImporter(testbase.TestCase):
     @mock.patch("pulp_win.plugins.db.models.repo_controller")
     @mock.patch('pulp_win.plugins.db.models.MSI._get_db')
     @mock.patch('pulp_win.plugins.db.models.MSI.from_file')
+    @mock.patch("pulp_win.plugins.importers.importer.MetadataCache")
     @mock.patch("pulp_win.plugins.importers.importer.plugin_api")
-    def test_upload_unit_msi(self, _plugin_api, from_file,
+    def test_upload_unit_msi(self, _plugin_api, _MetadataCache, from_file,
                              _get_db, _repo_controller):
         """
         Assert correct operation of upload_unit().
@@ -204,12 +199,16 @@ class TestWinImporter(testbase.TestCase):
         report = pulpimp.upload_unit(repo, type_id, unit_key, metadata,
                                      msi_file, conduit, config)
 
-        from_file.assert_called_once_with(file_path, metadata)
+        _MetadataCache.from_config.assert_called_once_with(config)
+        from_file.assert_called_once_with(
+            file_path, metadata,
+            cache=_MetadataCache.from_config.return_value)
 
         obj_id = _get_db.return_value.__getitem__.return_value.save.return_value.decode.return_value  # noqa
 
         metadata.update(
             id=obj_id,
+            checksums={},
             ModuleSignature=[],
             downloaded=True,
             pulp_user_metadata=dict(),
@@ -226,11 +225,30 @@ class TestWinImporter(testbase.TestCase):
                           ),
                           'summary': ''})
 
+    @mock.patch('pulp_win.plugins.db.models.MSI.save_and_associate')
+    @mock.patch('pulp_win.plugins.db.models.MSI.from_file')
+    @mock.patch("pulp_win.plugins.importers.importer.MetadataCache")
+    @mock.patch("pulp_win.plugins.importers.importer.plugin_api")
+    def test_upload_unit_owned(self, _plugin_api, _MetadataCache, from_file,
+                               _save_and_associate):
+        """
+        The upload staging file is linked into storage, not copied.
+        """
+        _plugin_api.get_unit_model_by_id.return_value = models.MSI
+        from_file.return_value = models.MSI(name="foo", version="1.1")
+        repo = mock.MagicMock()
+        importer.WinImporter().upload_unit(
+            repo, ids.TYPE_ID_MSI, dict(), dict(), "/tmp/upload",
+            mock.MagicMock(), {})
+        _save_and_associate.assert_called_once_with(
+            "/tmp/upload", repo.repo_obj, owned=True)
+
     @mock.patch("pulp_win.plugins.db.models.repo_controller")
     @mock.patch('pulp_win.plugins.db.models.MSM._get_db')
     @mock.patch('pulp_win.plugins.db.models.MSM.from_file')
+    @mock.patch("pulp_win.plugins.importers.importer.MetadataCache")
     @mock.patch("pulp_win.plugins.importers.importer.plugin_api")
-    def test_upload_unit_msm(self, _plugin_api, from_file,
+    def test_upload_unit_msm(self, _plugin_api, _MetadataCache, from_file,
                              _get_db, _repo_controller):
         """
         Assert correct operation of upload_unit().
@@ -259,12 +277,16 @@ class TestWinImporter(testbase.TestCase):
         report = pulpimp.upload_unit(repo, type_id, unit_key, metadata,
                                      msi_file, conduit, config)
 
-        from_file.assert_called_once_with(file_path, metadata)
+        _MetadataCache.from_config.assert_called_once_with(config)
+        from_file.assert_called_once_with(
+            file_path, metadata,
+            cache=_MetadataCache.from_config.return_value)
 
         obj_id = _get_db.return_value.__getitem__.return_value.save.return_value.decode.return_value  # noqa
 
         metadata.update(
             id=obj_id,
+            checksums={},
             downloaded=True,
             pulp_user_metadata=dict(),
             relativepath=None,
@@ -0,0 +1,64 @@
+"""
+Contains tests for pulp_win.plugins.importers.pipeline.
+"""
+import mock
+import threading
+
+from .... import testbase
+from pulp_win.plugins.importers import pipeline
+
+
+class TestWorkerPool(testbase.TestCase):
+    def test_process(self):
+        processed = []
+        lock = threading.Lock()
+
+        def handler(item):
+            with lock:
+                processed.append(item)
+
+        with pipeline.WorkerPool(handler, 3) as pool:
+            for i in range(20):
+                pool.put(i)
+        self.assertEquals(list(range(20)), sorted(processed))
+
+    def test_backpressure(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def handler(item):
+            started.set()
+            release.wait()
+
+        pool = pipeline.WorkerPool(handler, 1, max_pending=2)
+        pool.start()
+        pool.put(0)
+        started.wait()
+        # The worker is busy, so only max_pending items can be queued
+        pool.put(1)
+        pool.put(2)
+        producer = threading.Thread(target=pool.put, args=(3,))
+        producer.start()
+        producer.join(0.2)
+        self.assertTrue(producer.is_alive())
+        release.set()
+        producer.join()
+        pool.close()
+
+    @mock.patch("pulp_win.plugins.importers.pipeline._logger")
+    def test_handler_error(self, _logger):
+        processed = []
+
+        def handler(item):
+            if item == 1:
+                raise ValueError(item)
+            processed.append(item)
+
+        with pipeline.WorkerPool(handler, 1) as pool:
+            for i in range(3):
+                pool.put(i)
+        self.assertEquals([0, 2], processed)
+        _logger.exception.assert_called_once_with("Error processing %r", 1)
+
+    def test_no_workers(self):
+        self.assertRaises(ValueError, pipeline.WorkerPool, mock.MagicMock(), 0)
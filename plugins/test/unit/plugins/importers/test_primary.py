@@ -0,0 +1,77 @@
+"""
+Contains tests for pulp_win.plugins.importers.primary.
+"""
+import io
+
+from .... import testbase
+from pulp_win.plugins.db import models
+from pulp_win.plugins.importers import primary
+from pulp_win.plugins.importers.sync import RepoSync
+from .test_sync import REPODATA_PRIMARY_XML
+
+
+class TestIterPackages(testbase.TestCase):
+    def test_iter_packages(self):
+        fobj = io.BytesIO(REPODATA_PRIMARY_XML)
+        infos = list(primary.iter_packages(fobj, RepoSync.Type_Class_Map))
+        self.assertEquals(
+            [models.MSI, models.MSI, models.MSM],
+            [x.model_class for x in infos])
+        self.assertEquals(
+            ('a', '1.0',
+             '8158106e4b75399561fc30c6e486f3a78a3c221a1101dcf2edd0f1547c9bdd3f',  # noqa
+             'sha256'),
+            infos[0].unit_key)
+        self.assertEquals([123, 42, 123], [x.size for x in infos])
+        self.assertEquals(
+            dict(name='existing', version='1', checksum='existing1',
+                 checksumtype='sha256', size=42,
+                 relativepath='existing-1.msi',
+                 filename='existing-1.msi', Manufacturer=None,
+                 ModuleSignature=None),
+            infos[1].fields)
+
+        unit = infos[2].model_class(**infos[2].fields)
+        self.assertEquals(infos[2].unit_key, unit.unit_key_as_named_tuple)
+        self.assertEquals('a-1.msm', unit.filename)
+
+    def test_iter_packages_extracted_fields(self):
+        pkg = models.MSI(name="a", version="1.0", checksumtype="sha256",
+                         checksum="chksum", size=42, Manufacturer="ACME",
+                         ModuleSignature=[dict(name="mod", guid="{g}",
+                                               version="1.0")])
+        pkg.filename = pkg.filename_from_unit_key(pkg.unit_key)
+        msm = models.MSM(name="b", version="1.0", checksumtype="sha256",
+                         checksum="chksum2", size=42, guid="{g}")
+        msm.filename = msm.filename_from_unit_key(msm.unit_key)
+        empty = models.MSI(name="c", version="1.0", checksumtype="sha256",
+                           checksum="chksum3", size=42, Manufacturer="ACME")
+        empty.filename = empty.filename_from_unit_key(empty.unit_key)
+        fobj = io.BytesIO(
+            b'<metadata xmlns="%s" packages="3">%s</metadata>' % (
+                primary.COMMON_SPEC_URL, b''.join(
+                    x.render_primary("sha256") for x in (pkg, msm, empty))))
+        infos = list(primary.iter_packages(fobj, RepoSync.Type_Class_Map))
+        # What publishing wrote is read back with the same types
+        self.assertEquals("ACME", infos[0].fields['Manufacturer'])
+        self.assertEquals([dict(name="mod", guid="{g}", version="1.0")],
+                          infos[0].fields['ModuleSignature'])
+        self.assertEquals("{g}", infos[1].fields['guid'])
+        self.assertEquals([], infos[2].fields['ModuleSignature'])
+        unit = infos[0].model_class(**infos[0].fields)
+        unit.validate()
+
+    def test_iter_packages_unsupported_type(self):
+        fobj = io.BytesIO(REPODATA_PRIMARY_XML.replace('"msm"', '"rpm"'))
+        with self.assertRaises(primary.UnsupportedPackageType):
+            list(primary.iter_packages(fobj, RepoSync.Type_Class_Map))
+
+    def test_iter_packages_bad_size(self):
+        fobj = io.BytesIO(REPODATA_PRIMARY_XML.replace('"42"', '"lots"'))
+        infos = list(primary.iter_packages(fobj, RepoSync.Type_Class_Map))
+        self.assertEquals([123, 0, 123], [x.size for x in infos])
+
+    def test_batches(self):
+        self.assertEquals(
+            [[0, 1], [2, 3], [4]],
+            list(RepoSync._batches(iter(range(5)), 2)))
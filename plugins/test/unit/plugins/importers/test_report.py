@@ -0,0 +1,77 @@
+"""
+Contains tests for pulp_win.plugins.importers.report.
+"""
+from .... import testbase
+from pulp_win.plugins.importers import report
+
+
+class TestProgressThrottle(testbase.TestCase):
+    def _throttle(self, interval=2, batch=3):
+        self.now = 100.0
+        return report.ProgressThrottle(interval, batch,
+                                       clock=lambda: self.now)
+
+    def test_interval(self):
+        throttle = self._throttle(batch=100)
+        states = (('content', 'IN_PROGRESS'), )
+        self.assertTrue(throttle.ready(states))
+        self.now += 1
+        self.assertFalse(throttle.ready(states))
+        self.assertEquals(1, throttle.pending)
+        self.now += 1
+        self.assertTrue(throttle.ready(states))
+        self.assertEquals(0, throttle.pending)
+
+    def test_batch(self):
+        throttle = self._throttle()
+        states = (('content', 'IN_PROGRESS'), )
+        self.assertEquals([True, False, False, True, False],
+                          [throttle.ready(states) for _ in range(5)])
+
+    def test_state_change(self):
+        throttle = self._throttle()
+        self.assertTrue(throttle.ready((('content', 'IN_PROGRESS'), )))
+        self.assertFalse(throttle.ready((('content', 'IN_PROGRESS'), )))
+        self.assertTrue(throttle.ready((('content', 'FINISHED'), )))
+        self.assertTrue(throttle.ready((('content', 'FINISHED'), ),
+                                       force=True))
+
+    def test_disabled(self):
+        throttle = self._throttle(interval=0)
+        states = (('content', 'IN_PROGRESS'), )
+        self.assertEquals([True] * 3,
+                          [throttle.ready(states) for _ in range(3)])
+
+
+class TestPhaseTimings(testbase.TestCase):
+    def test_record(self):
+        content_report = report.ContentReport()
+        timings = content_report.timings
+        timings.record('download', 2.0, units=1, size=1000)
+        timings.record('download', 2.0, units=3, size=3000)
+        self.assertEquals(
+            dict(seconds=4.0, units=4, bytes=4000, units_per_sec=1.0,
+                 bytes_per_sec=1000),
+            content_report['phases']['download'])
+
+    def test_latency(self):
+        timings = report.ContentReport().timings
+        for seconds in [0.010] * 90 + [0.100] * 9 + [3.0]:
+            timings.record('extraction', seconds, units=1, latency=True)
+        latency = timings.phases['extraction']['latency']
+        self.assertEquals(dict(p50=0.016, p90=0.016, p99=0.128, max=3.0),
+                          latency)
+
+    def test_timed_iter(self):
+        timings = report.ContentReport().timings
+        self.assertEquals(range(5),
+                          list(timings.timed_iter('parse', range(5),
+                                                  every=2)))
+        self.assertEquals(5, timings.phases['parse']['units'])
+
+    def test_timed(self):
+        timings = report.ContentReport().timings
+        with self.assertRaises(ValueError):
+            with timings.timed('db_write', units=2):
+                raise ValueError()
+        self.assertEquals(2, timings.phases['db_write']['units'])
@@ -0,0 +1,49 @@
+"""
+Contains tests for pulp_win.plugins.importers.schedule.
+"""
+import mock
+
+from .... import testbase
+from pulp_win.plugins.importers import schedule
+
+
+class TestOrder(testbase.TestCase):
+    def setUp(self):
+        super(TestOrder, self).setUp()
+        self.units = [mock.MagicMock(size=size)
+                      for size in (3, 10, None, 7, 1, 8)]
+
+    def _sizes(self, units):
+        return [unit.size for unit in units]
+
+    def test_feed(self):
+        self.assertEquals(self.units,
+                          schedule.order(self.units, schedule.FEED))
+
+    def test_largest_first(self):
+        self.assertEquals(
+            [10, 8, 7, 3, 1, None],
+            self._sizes(schedule.order(self.units, schedule.LARGEST_FIRST)))
+
+    def test_lpt(self):
+        # Slots get [10, 3, 1, None] and [8, 7]; each slot starts with its
+        # largest package
+        self.assertEquals(
+            [10, 8, 3, 7, 1, None],
+            self._sizes(schedule.order(self.units, schedule.LPT, slots=2)))
+        self.assertEquals([], schedule.order([], schedule.LPT, slots=2))
+
+    def test_interleave(self):
+        self.assertEquals(
+            [10, None, 1, 8, 3, 7],
+            self._sizes(schedule.order(self.units, schedule.LARGEST_FIRST,
+                                       small=2)))
+
+    def test_interleave_feed(self):
+        # The order of the feed, with the smallest units moved up
+        self.assertEquals(
+            [3, None, 10, 1, 7, 8],
+            self._sizes(schedule.order(self.units, schedule.FEED, small=1)))
+
+    def test_unknown(self):
+        self.assertEquals(self.units, schedule.order(self.units, "random"))
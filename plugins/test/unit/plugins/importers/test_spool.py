@@ -0,0 +1,31 @@
+"""
+Contains tests for pulp_win.plugins.importers.spool.
+"""
+import random
+
+from .... import testbase
+from pulp_win.plugins.importers import spool
+
+
+class TestSortedSpool(testbase.TestCase):
+    def test_iter(self):
+        values = ["%04d" % i for i in range(100)]
+        shuffled = values * 2
+        random.shuffle(shuffled)
+        with spool.SortedSpool(dir=self.work_dir, max_items=7) as ids:
+            ids.update(shuffled)
+            # Most values were written out in sorted runs
+            self.assertEquals(200 // 7, len(ids._runs))
+            self.assertEquals(values, list(ids))
+            # Iterating again gives the same result
+            self.assertEquals(values, list(ids))
+        self.assertEquals([], list(ids))
+
+    def test_difference(self):
+        self.assertEquals(
+            ["a", "c", "f"],
+            list(spool.difference(["a", "b", "c", "d", "f"],
+                                  ["b", "d", "e"])))
+        self.assertEquals(["a", "b"],
+                          list(spool.difference(["a", "b"], [])))
+        self.assertEquals([], list(spool.difference([], ["a"])))
@@ -10,14 +10,15 @@ from pulp_win.plugins.importers import sync
 
 
 class TestSync(testbase.TestCase):
-    def new_config(self, feed="http://example.com/repo"):
-        cfgdict = dict(feed=feed)
+    def new_config(self, feed="http://example.com/repo", **kwargs):
+        cfgdict = dict(feed=feed, **kwargs)
         config = mock.MagicMock()
         config.configure_mock(**cfgdict)
         config.flatten.return_value = cfgdict
         config.get.side_effect = cfgdict.get
         return config
 
+    @mock.patch("pulp_win.plugins.db.inflight.InFlightDownload._get_collection")  # noqa
     @mock.patch("pulp_win.plugins.db.models.MSM.save_and_associate")
     @mock.patch("pulp_win.plugins.db.models.MSM.from_file")
     @mock.patch("pulp_win.plugins.db.models.MSI.save_and_associate")
@@ -28,15 +29,19 @@ class TestSync(testbase.TestCase):
                 autospec=True)
     @mock.patch("pulp_rpm.plugins.importers.yum.sync.metadata.nectar_factory")
     @mock.patch("pulp.server.managers.repo._common.task.current")
-    @mock.patch("pulp_win.plugins.importers.sync.units_controller")
+    @mock.patch("pulp_win.plugins.db.models.RepositoryContentUnit")
+    @mock.patch("pulp_win.plugins.db.models.MSM.objects")
+    @mock.patch("pulp_win.plugins.db.models.MSI.objects")
     @mock.patch("pulp_rpm.plugins.importers.yum.sync.repo_controller")
     @mock.patch("pulp_win.plugins.db.models.repo_controller")
     def test_sync(self, _db_repo_controller,
-                  _repo_controller, _units_controller, _task_current,
+                  _repo_controller, _msi_objects, _msm_objects,
+                  _RepositoryContentUnit, _task_current,
                   _nectar_factory, _ContentSource, _content_catalog_manager,
                   _Session,
                   _msi_from_file, _msi_save_and_associate,
-                  _msm_from_file, _msm_save_and_associate):
+                  _msm_from_file, _msm_save_and_associate,
+                  _inflight_collection):
         _task_current.request.id = 'aabb'
         worker_name = "worker01"
         _task_current.request.configure_mock(hostname=worker_name)
@@ -60,15 +65,16 @@ class TestSync(testbase.TestCase):
 
         repo = mock.MagicMock()
         conduit = mock.MagicMock(**{"last_sync.return_value": None})
-        config = self.new_config()
+        config = self.new_config(dedupe_downloads=True)
 
         _repo_controller.missing_unit_count.return_value = 10
 
         # An existing unit which should not be re-downloaded
-        _units_controller.find_units.return_value = [
-            sync.models.MSI(name="existing", version="1",
-                            checksumtype="sha256", checksum="existing1")
-        ]
+        existing = sync.models.MSI(name="existing", version="1",
+                                   checksumtype="sha256",
+                                   checksum="existing1")
+        _msi_objects.return_value.only.return_value = [existing]
+        _msm_objects.return_value.only.return_value = []
 
         _xml_content = {
             "repomd.xml": REPOMD_XML,
@@ -128,6 +134,489 @@ class TestSync(testbase.TestCase):
             ],
             conduit.build_success_report.call_args_list)
 
+        # One query per type, on the checksum only
+        _msi_objects.assert_called_once_with(checksum__in=[
+            '8158106e4b75399561fc30c6e486f3a78a3c221a1101dcf2edd0f1547c9bdd3f',  # noqa
+            'existing1'])
+        _msi_objects.return_value.only.assert_called_once_with(
+            'id', *sync.models.MSI.unit_key_fields)
+        _msm_objects.assert_called_once_with(checksum__in=[
+            'befd9977547415cccf82ac4e7f573f9cec1730dd124499c0a8f03b79ad73bf6a',  # noqa
+        ])
+        # The existing unit was associated with a single bulk write
+        bulk_write = _RepositoryContentUnit._get_collection.return_value.bulk_write  # noqa
+        self.assertEquals(1, bulk_write.call_count)
+        ops = bulk_write.call_args[0][0]
+        self.assertEquals(1, len(ops))
+        self.assertFalse(_repo_controller.associate_single_unit.called)
+        # Both packages were claimed, and released once saved
+        docs = _inflight_collection.return_value.insert_many.call_args[0][0]
+        self.assertEquals(
+            ['sha256:' + unit1.checksum, 'sha256:' + unit2.checksum],
+            [doc['_id'] for doc in docs])
+        delete_one = _inflight_collection.return_value.delete_one
+        self.assertEquals(
+            sorted(doc['_id'] for doc in docs),
+            sorted(c[0][0]['_id'] for c in delete_one.call_args_list))
+
+    @mock.patch("pulp.server.managers.repo._common.task.current")
+    def _new_reposync(self, conduit, config, _task_current):
+        _task_current.request.id = 'aabb'
+        worker_name = "worker01"
+        _task_current.request.configure_mock(hostname=worker_name)
+        worker_dir = os.path.join(self.pulp_working_dir, worker_name)
+        if not os.path.isdir(worker_dir):
+            os.makedirs(worker_dir)
+        return sync.RepoSync(mock.MagicMock(), conduit, config)
+
+    def test_upstream_unchanged(self):
+        metadata_files = mock.MagicMock(
+            revision=1476732856,
+            metadata=dict(primary=dict(checksum=dict(
+                algorithm="sha256", hex_digest="CSUM1"))))
+        url = "http://example.com/repo"
+        fingerprint = "%s|1476732856|CSUM1|remove_missing_units=False" % url
+        scratchpad = dict()
+        conduit = mock.MagicMock()
+        conduit.get_scratchpad.side_effect = lambda: scratchpad
+        conduit.set_scratchpad.side_effect = scratchpad.update
+
+        reposync = self._new_reposync(conduit, self.new_config())
+        self.assertFalse(reposync.upstream_unchanged(metadata_files))
+        with mock.patch.object(sync.yumsync.RepoSync, "save_repomd_revision"):
+            reposync.save_repomd_revision()
+        self.assertEquals(fingerprint,
+                          scratchpad[sync.UPSTREAM_FINGERPRINT_KEY])
+
+        # Next sync: nothing changed upstream
+        reposync = self._new_reposync(conduit, self.new_config())
+        self.assertTrue(reposync.upstream_unchanged(metadata_files))
+        # Unless a full sync is requested
+        config = self.new_config()
+        config.get.side_effect = dict(feed=url, force_full=True).get
+        reposync = self._new_reposync(conduit, config)
+        self.assertFalse(reposync.upstream_unchanged(metadata_files))
+        # Or settings that change what the sync does
+        config = self.new_config()
+        config.get.side_effect = dict(feed=url,
+                                      remove_missing_units=True).get
+        reposync = self._new_reposync(conduit, config)
+        self.assertFalse(reposync.upstream_unchanged(metadata_files))
+
+        # A new primary.xml is processed
+        metadata_files.metadata["primary"]["checksum"]["hex_digest"] = "NEW"
+        reposync = self._new_reposync(conduit, self.new_config())
+        self.assertFalse(reposync.upstream_unchanged(metadata_files))
+        # Failed units have to be retried next time
+        reposync.content_report["error_details"].append(dict(error="boom"))
+        with mock.patch.object(sync.yumsync.RepoSync, "save_repomd_revision"):
+            reposync.save_repomd_revision()
+        self.assertEquals(None, scratchpad[sync.UPSTREAM_FINGERPRINT_KEY])
+
+    def test_upstream_unchanged_other_mirror(self):
+        metadata_files = mock.MagicMock(
+            revision=1476732856,
+            metadata=dict(primary=dict(checksum=dict(
+                algorithm="sha256", hex_digest="CSUM1"))))
+        scratchpad = dict()
+        conduit = mock.MagicMock()
+        conduit.get_scratchpad.side_effect = lambda: scratchpad
+        conduit.set_scratchpad.side_effect = scratchpad.update
+        config = self.new_config(feed="http://example.com/mirrorlist")
+
+        reposync = self._new_reposync(conduit, config)
+        reposync._metadata_url = "http://m1/repo"
+        self.assertFalse(reposync.upstream_unchanged(metadata_files))
+        with mock.patch.object(sync.yumsync.RepoSync, "save_repomd_revision"):
+            reposync.save_repomd_revision()
+
+        # Served by another mirror this time, same repository
+        reposync = self._new_reposync(conduit, config)
+        reposync._metadata_url = "http://m2/repo"
+        self.assertTrue(reposync.upstream_unchanged(metadata_files))
+
+    @mock.patch("pulp_win.plugins.importers.sync.MirrorScores")
+    def test_race(self, _MirrorScores):
+        urls = ["http://m1/repo", "http://m2/repo", "http://m3/repo",
+                "http://m4/repo"]
+        # Not raced by default
+        reposync = self._new_reposync(mock.MagicMock(), self.new_config())
+        reposync.mirror_scores = _MirrorScores.return_value
+        self.assertEquals(urls[:1], reposync._race_candidates(urls[0]))
+
+        reposync = self._new_reposync(
+            mock.MagicMock(), self.new_config(mirror_race_count=3))
+        reposync.mirror_scores = _MirrorScores.return_value
+        reposync._mirrors = urls
+        self.assertEquals(urls[:3], reposync._race_candidates(urls[0]))
+        reposync._failed_mirrors.add(urls[1])
+        self.assertEquals([urls[0], urls[2], urls[3]],
+                          reposync._race_candidates(urls[0]))
+
+        def race_repomd(url, results):
+            # m1 is down, m2 wins, m3 serves the same state later on
+            if url == urls[0]:
+                results.put((url, None, None))
+            elif url == urls[1]:
+                results.put((url, (1, "CSUM1"), "<repomd/>"))
+        with mock.patch.object(reposync, "_race_repomd",
+                               side_effect=race_repomd):
+            self.assertEquals(urls[1], reposync._race(urls[:2]))
+        reposync._race_results.put((urls[2], (1, "CSUM1"), "<repomd/>"))
+        reposync._race_results.put((urls[3], (2, "CSUM2"), "<repomd/>"))
+        self.assertEquals([urls[1], urls[2]],
+                          reposync._healthy_mirrors(urls[1]))
+
+    @mock.patch("pulp_win.plugins.importers.sync.metadata.MetadataFiles")
+    @mock.patch("pulp_win.plugins.importers.sync.yumsync.RepoSync.check_metadata")  # noqa
+    def test_check_metadata_raced(self, _check_metadata, _MetadataFiles):
+        urls = ["http://m1/repo", "http://m2/repo"]
+        reposync = self._new_reposync(mock.MagicMock(), self.new_config())
+        reposync.mirror_scores = mock.MagicMock()
+        reposync._mirrors = urls
+        reposync.tmp_dir = self.work_dir
+
+        def race(candidates):
+            reposync._raced_repomd = "<repomd/>"
+            return urls[1]
+        with mock.patch.object(reposync, "_race", side_effect=race):
+            metadata_files = reposync.check_metadata(urls[0])
+        # repomd.xml is not downloaded again
+        self.assertFalse(_check_metadata.called)
+        self.assertEquals(urls[1], reposync._metadata_url)
+        self.assertEquals(_MetadataFiles.return_value, metadata_files)
+        _MetadataFiles.assert_called_once_with(
+            urls[1], self.work_dir, reposync.nectar_config,
+            reposync._url_modify)
+        metadata_files.parse_repomd.assert_called_once_with()
+        self.assertFalse(metadata_files.download_repomd.called)
+        path = os.path.join(self.work_dir,
+                            sync.metadata.REPOMD_FILE_NAME)
+        self.assertEquals("<repomd/>", open(path).read())
+
+    @mock.patch("pulp_win.plugins.importers.sync.yumsync.RepoSync.check_metadata")  # noqa
+    def test_check_metadata_single_mirror(self, _check_metadata):
+        reposync = self._new_reposync(mock.MagicMock(), self.new_config())
+        self.assertEquals(_check_metadata.return_value,
+                          reposync.check_metadata("http://m1/repo"))
+        self.assertEquals("http://m1/repo", reposync._metadata_url)
+        self.assertEquals(None, reposync._race_results)
+
+    def test_upstream_fingerprint_no_revision(self):
+        metadata_files = mock.MagicMock(revision=0, metadata=dict())
+        self.assertEquals(
+            None, sync.RepoSync._upstream_fingerprint("http://a",
+                                                      metadata_files))
+
+    @mock.patch("pulp_win.plugins.db.models.MSI.objects")
+    def test_find_by_stored_checksums(self, _objects):
+        upstream = [
+            sync.models.MSI(name="a", version="1", checksumtype="sha1",
+                            checksum="sha1-a"),
+            sync.models.MSI(name="b", version="1", checksumtype="sha1",
+                            checksum="sha1-b"),
+            sync.models.MSI(name="c", version="1", checksumtype="md5",
+                            checksum="md5-c"),
+            sync.models.MSI(name="d", version="1", checksumtype="sha256",
+                            checksum="sha256-d"),
+        ]
+        stored_a = sync.models.MSI(
+            name="a", version="1", checksumtype="sha256", checksum="sha256-a",
+            checksums=dict(sha256="sha256-a", sha1="sha1-a", md5="md5-a"))
+        stored_c = sync.models.MSI(
+            name="c", version="1", checksumtype="sha256", checksum="sha256-c",
+            checksums=dict(sha256="sha256-c", sha1="sha1-c", md5="md5-c"))
+        queries = [
+            mock.MagicMock(**{"only.return_value": [stored_c]}),
+            mock.MagicMock(**{"only.return_value": [stored_a]}),
+        ]
+        _objects.side_effect = queries
+
+        found = sync.RepoSync._find_by_stored_checksums(sync.models.MSI,
+                                                        upstream)
+        self.assertEquals(
+            [mock.call(checksums__md5__in=['md5-c']),
+             mock.call(checksums__sha1__in=['sha1-a', 'sha1-b'])],
+            _objects.call_args_list)
+        for query in queries:
+            query.only.assert_called_once_with('id', 'checksums')
+        self.assertEquals(
+            {upstream[0].unit_key_as_named_tuple: stored_a,
+             upstream[2].unit_key_as_named_tuple: stored_c},
+            found)
+
+    @mock.patch("pulp_win.plugins.db.models.Repository")
+    @mock.patch("pulp_win.plugins.db.models.RepositoryContentUnit")
+    def test_remove_missing_units(self, _RepositoryContentUnit,
+                                  _Repository):
+        conduit = mock.MagicMock()
+        reposync = self._new_reposync(conduit, self.new_config())
+        reposync.SAVE_BATCH_SIZE = 2
+        collection = _RepositoryContentUnit._get_collection.return_value
+        collection.find.return_value.sort.return_value = [
+            dict(unit_id=unit_id) for unit_id in ("a", "b", "c", "d", "e")]
+        # All of them are MSIs
+        collection.delete_many.side_effect = lambda spec: mock.MagicMock(
+            deleted_count=len(spec['unit_id']['$in'])
+            if spec['unit_type_id'] == sync.models.MSI.TYPE_ID else 0)
+        reposync._upstream_ids = sync.spool.SortedSpool(dir=self.work_dir)
+        reposync._seen_upstream([mock.MagicMock(id=unit_id)
+                                 for unit_id in ("d", "b", "x")])
+
+        self.assertEquals(3, reposync.remove_missing_units())
+        collection.find.return_value.sort.assert_called_once_with(
+            'unit_id', 1)
+        self.assertEquals(
+            [["a", "c"], ["a", "c"], ["e"], ["e"]],
+            [c[0][0]['unit_id']['$in']
+             for c in collection.delete_many.call_args_list])
+        # The counts follow what was removed
+        update_one = _Repository.objects.return_value.update_one
+        self.assertEquals(
+            [-2, -1],
+            [c[1]['inc__content_unit_counts__%s' % sync.models.MSI.TYPE_ID]
+             for c in update_one.call_args_list])
+        reposync._upstream_ids.close()
+
+    @mock.patch("pulp_rpm.plugins.importers.yum.sync.RepoSync.set_progress")
+    def test_set_progress_throttled(self, _set_progress):
+        reposync = self._new_reposync(mock.MagicMock(), self.new_config())
+        reposync.progress_throttle.clock = lambda: 100.0
+        for _ in range(5):
+            reposync.set_progress()
+        self.assertEquals(1, _set_progress.call_count)
+        self.assertEquals(4, reposync.content_report['updates_suppressed'])
+        # A state change is written right away
+        reposync.content_report['state'] = 'FINISHED'
+        reposync.set_progress()
+        self.assertEquals(2, _set_progress.call_count)
+        reposync.set_progress(force=True)
+        self.assertEquals(3, _set_progress.call_count)
+
+    def test_progress_summary(self):
+        reposync = self._new_reposync(mock.MagicMock(), self.new_config())
+        reposync.content_report.timings.record('download', 2.0, units=1,
+                                               size=100)
+        summary = reposync._progress_summary
+        self.assertEquals('NOT_STARTED', summary['content']['state'])
+        self.assertEquals(50, summary['content']['phases']['download'][
+            'bytes_per_sec'])
+
+    def test_concurrency_controller(self):
+        config = self.new_config()
+        config.get.side_effect = dict(adaptive_concurrency=True,
+                                      max_threads=12).get
+        reposync = self._new_reposync(mock.MagicMock(), config)
+        controller = reposync._concurrency_controller()
+        self.assertEquals(12, reposync.nectar_config.max_concurrent)
+        self.assertEquals((1, 12, 5), (controller.minimum, controller.maximum,
+                                       controller.limit))
+        self.assertEquals(5, reposync.content_report['concurrency'][
+            'current'])
+
+        # Otherwise the limit is fixed, but still shared with the downloads
+        # in segments
+        config.get.side_effect = dict(num_threads=3).get
+        fixed = self._new_reposync(
+            mock.MagicMock(), config)._concurrency_controller()
+        self.assertEquals((3, 3, 3), (fixed.minimum, fixed.maximum,
+                                      fixed.limit))
+
+        # The listener gives the slot back when a download finishes
+        reposync.concurrency = controller
+        listener = sync.CustomPackageListener(reposync, mock.MagicMock())
+        controller.acquire("http://example.com/repo/a-1.msi")
+        report = mock.MagicMock(url="http://example.com/repo/a-1.msi")
+        with mock.patch.object(listener, 'process_download'):
+            listener.download_succeeded(report)
+        self.assertEquals(0, controller.in_flight)
+
+    @mock.patch("pulp_win.plugins.db.models.RepositoryContentUnit")
+    @mock.patch("pulp_win.plugins.db.models.MSI.objects")
+    def test_download_waits_for_other_syncs(self, _msi_objects,
+                                            _RepositoryContentUnit):
+        reposync = self._new_reposync(mock.MagicMock(), self.new_config())
+        reposync.INFLIGHT_POLL_INTERVAL = 0
+        units = [sync.models.MSI(name=name, version='1', checksumtype='sha256',
+                                 checksum='c' + name, size=10)
+                 for name in ('a', 'b', 'c')]
+        inflight = reposync.inflight = mock.MagicMock()
+        inflight.key.side_effect = lambda unit: unit.checksum
+        # Another sync downloads b and c; it saves b, and fails with c
+        inflight.claim.side_effect = [set(['ca']), set(['cc'])]
+        inflight.pending.side_effect = [set(['cb', 'cc']), set()]
+        stored_b = sync.models.MSI(name='b', version='1',
+                                   checksumtype='sha256', checksum='cb')
+        _msi_objects.return_value.only.return_value = [stored_b]
+        reposync.content_report.set_initial_values(
+            {sync.models.MSI.TYPE_ID: 3, sync.models.MSM.TYPE_ID: 0}, 30)
+
+        with mock.patch.object(reposync, '_download') as _download:
+            reposync.download(mock.MagicMock(), units, 'http://example.com')
+        self.assertEquals(
+            [[units[0]], [units[2]]],
+            [c[0][1] for c in _download.call_args_list])
+        # b was associated, and counted as done
+        bulk_write = _RepositoryContentUnit._get_collection.return_value.bulk_write  # noqa
+        self.assertEquals(1, bulk_write.call_count)
+        self.assertEquals(2, reposync.content_report['items_left'])
+        self.assertEquals(2, inflight.__enter__.call_count)
+
+    def test_process_download_error(self):
+        reposync = self._new_reposync(mock.MagicMock(), self.new_config())
+        reposync.inflight = mock.MagicMock()
+        reposync.inflight.key.return_value = "sha256:abc"
+        reposync.content_report.set_initial_values(
+            {sync.models.MSI.TYPE_ID: 1, sync.models.MSM.TYPE_ID: 0}, 10)
+        listener = sync.CustomPackageListener(reposync, mock.MagicMock())
+        unit = sync.models.MSI(name='a', version='1', checksumtype='sha256',
+                               checksum='abc', filename='a-1.msi', size=10)
+        report = mock.MagicMock(data=unit)
+        with mock.patch.object(listener, '_process_download',
+                               side_effect=ValueError("boom")):
+            listener.process_download(report)
+        self.assertEquals(0, reposync.content_report['items_left'])
+        error, = reposync.content_report['error_details']
+        self.assertEquals(('a-1.msi', 'boom'),
+                          (error['filename'], error['error']))
+        reposync.inflight.release.assert_called_once_with("sha256:abc")
+
+    def test_destination_locked_until_processed(self):
+        listener = self._listener(False)
+        path = self.new_file(contents="").path
+        dest = sync.win_download.HashingFile(path)
+        dest.write("abc")
+        report = mock.MagicMock(destination=dest)
+        listener._finish_destination(report, True)
+        self.assertFalse(dest.closed)
+
+        def process(report):
+            # Moved into place while still locked
+            self.assertFalse(dest.closed)
+            os.unlink(report.destination)
+        with mock.patch.object(listener, '_process_download',
+                               side_effect=process):
+            listener.process_download(report)
+        self.assertTrue(dest.closed)
+
+        # A failed download leaves nothing behind
+        dest = sync.win_download.HashingFile(path)
+        dest.truncate(0)
+        report = mock.MagicMock(destination=dest)
+        listener._finish_destination(report, False)
+        self.assertTrue(dest.closed)
+        self.assertFalse(os.path.exists(path))
+
+    def test_download_succeeded_pool(self):
+        listener = sync.CustomPackageListener(mock.MagicMock(),
+                                              mock.MagicMock())
+        report = mock.MagicMock()
+        with mock.patch.object(listener, 'process_download') as _process:
+            listener.download_succeeded(report)
+            _process.assert_called_once_with(report)
+
+            # With a pool, the downloader's thread only queues the report
+            _process.reset_mock()
+            listener.pool = mock.MagicMock()
+            listener.download_succeeded(report)
+            self.assertFalse(_process.called)
+            listener.pool.put.assert_called_once_with(report)
+
+    def _listener(self, trust, sample_rate=0):
+        repo_sync = mock.MagicMock(trust_upstream_metadata=trust,
+                                   trust_sample_rate=sample_rate,
+                                   mirror_scores=None)
+        return sync.CustomPackageListener(repo_sync, mock.MagicMock())
+
+    @mock.patch("pulp_win.plugins.db.models.MSI.from_file")
+    def test_unit_from_download_trusted(self, _from_file):
+        path = self.new_file(contents="a" * 10).path
+        unit = sync.models.MSI(name="a", version="1", checksumtype="sha256",
+                               checksum="chksum", ProductCode="{pc}",
+                               Manufacturer="ACME",
+                               ModuleSignature=[])
+        unit_dl = self._listener(True)._unit_from_download(unit, path)
+        self.assertFalse(_from_file.called)
+        self.assertIs(unit, unit_dl)
+        self.assertEquals(10, unit_dl.size)
+        self.assertEquals(dict(sha256="chksum"), unit_dl.checksums)
+
+    @mock.patch("pulp_win.plugins.db.models.MSM.from_file")
+    def test_unit_from_download_trusted_incomplete(self, _from_file):
+        listener = self._listener(True)
+        # primary.xml does not say what the guid is
+        unit = sync.models.MSM(name="a", version="1", checksumtype="sha256",
+                               checksum="chksum")
+        unit_dl = listener._unit_from_download(unit, "/tmp/a")
+        self.assertEquals(_from_file.return_value, unit_dl)
+        _from_file.assert_called_once_with(
+            "/tmp/a", cache=listener.sync.metadata_cache, checksum="chksum",
+            checksums=None)
+
+    @mock.patch("pulp_win.plugins.db.models.MSI.from_file")
+    def test_unit_from_download_untrusted(self, _from_file):
+        listener = self._listener(True)
+        # Only sha256 can be trusted, it is the unit key
+        unit = sync.models.MSI(name="a", version="1", checksumtype="sha1",
+                               checksum="chksum")
+        unit_dl = listener._unit_from_download(unit, "/tmp/a")
+        self.assertEquals(_from_file.return_value, unit_dl)
+        _from_file.assert_called_once_with(
+            "/tmp/a", cache=listener.sync.metadata_cache, checksum=None,
+            checksums=None)
+
+        _from_file.reset_mock()
+        listener = self._listener(False)
+        unit.checksumtype = "sha256"
+        unit_dl = listener._unit_from_download(unit, "/tmp/a")
+        _from_file.assert_called_once_with(
+            "/tmp/a", cache=listener.sync.metadata_cache, checksum="chksum",
+            checksums=None)
+
+    @mock.patch("pulp_win.plugins.importers.sync.PackageListener._verify_checksum")  # noqa
+    def test_verify_checksum_while_downloading(self, _verify_checksum):
+        listener = self._listener(False)
+        path = self.new_file(contents="").path
+        dest = sync.win_download.HashingFile(path)
+        dest.write("abc")
+        report = mock.MagicMock(destination=dest)
+        listener._finish_destination(report, True)
+        self.assertEquals(path, report.destination)
+
+        unit = sync.models.MSI(
+            name="a", version="1", checksumtype="sha1",
+            checksum="a9993e364706816aba3e25717850c26c9cd0d89d")
+        listener._verify_checksum(unit, report)
+        # The file was not read again
+        self.assertFalse(_verify_checksum.called)
+        self.assertEquals(
+            'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad',  # noqa
+            listener._verified_checksums(unit, path)['sha256'])
+
+        # On a mismatch, the file is verified as usual
+        unit.checksum = "bad"
+        listener._verify_checksum(unit, report)
+        _verify_checksum.assert_called_once_with(unit, report)
+        self.assertEquals(None, listener._verified_checksums(unit, path))
+
+    @mock.patch("pulp_win.plugins.importers.sync._logger")
+    @mock.patch("pulp_win.plugins.db.models.MSI.from_file")
+    def test_unit_from_download_sampled(self, _from_file, _logger):
+        unit = sync.models.MSI(name="a", version="1", checksumtype="sha256",
+                               checksum="chksum", ProductCode="{pc}")
+        extracted = sync.models.MSI(name="a", version="1",
+                                    checksumtype="sha256", checksum="chksum",
+                                    ProductCode="{other}", filename="a-1.msi")
+        _from_file.return_value = extracted
+        unit_dl = self._listener(True, 1)._unit_from_download(unit, "/tmp/a")
+        self.assertIs(extracted, unit_dl)
+        # Read from the package, not from the cache
+        _from_file.assert_called_once_with("/tmp/a", checksum="chksum",
+                                           checksums=None)
+        _logger.warning.assert_called_once_with(
+            "%s: upstream metadata does not match the package: %s",
+            "a-1.msi", "ProductCode='{pc}' (package: '{other}')")
+
 
 REPOMD_XML = """\
 <?xml version="1.0" encoding="UTF-8"?>
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+"""
+Measure the peak memory used to parse primary.xml files of growing size.
+
+Each measurement runs in a fresh process, so that ru_maxrss only reflects
+that run. The streaming parser should stay flat; the full-tree parse is
+shown for comparison.
+
+Usage: bench_primary_parse.py [count ...]
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'plugins'))
+from pulp_win.plugins.importers import primary  # noqa
+
+PACKAGE = """\
+  <package type="msi">
+    <checksum pkgid="YES" type="sha256">%(checksum)064x</checksum>
+    <name>package-%(idx)d</name>
+    <version>1.0.%(idx)d</version>
+    <ProductCode>{%(idx)08d-1DA6-44D2-8C17-10510D12D0EE}</ProductCode>
+    <UpgradeCode>{%(idx)08d-1234-1234-1234-111111111111}</UpgradeCode>
+    <size package="%(idx)d"/>
+    <location href="package-%(idx)d-1.0.%(idx)d.msi"/>
+  </package>
+"""
+
+
+class Model(object):
+    # Stand-in for the MSI model, so that pulp is not needed
+    _fields = dict.fromkeys(['name', 'version', 'checksum', 'checksumtype',
+                             'size', 'filename', 'relativepath',
+                             'ProductCode', 'UpgradeCode'])
+    unit_key_fields = ('name', 'version', 'checksum', 'checksumtype')
+
+    @classmethod
+    def filename_from_unit_key(cls, unit_key):
+        return "{0}-{1}.msi".format(unit_key['name'], unit_key['version'])
+
+
+def generate(path, count):
+    with open(path, "w") as fobj:
+        fobj.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                   '<metadata xmlns="%s" packages="%d">\n' %
+                   (primary.COMMON_SPEC_URL, count))
+        for idx in range(count):
+            fobj.write(PACKAGE % dict(idx=idx, checksum=idx))
+        fobj.write('</metadata>\n')
+
+
+def measure(mode, path):
+    start = time.time()
+    with open(path, "rb") as fobj:
+        if mode == 'stream':
+            count = sum(1 for _ in primary.iter_packages(fobj,
+                                                         dict(msi=Model)))
+        else:
+            count = len(ElementTree.parse(fobj).getroot())
+    elapsed = time.time() - start
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("%s %d %d %.2f" % (mode, count, maxrss, elapsed))
+
+
+def main(counts):
+    print("%-8s %10s %14s %10s" % ("parser", "packages", "peak RSS (KB)",
+                                   "time (s)"))
+    for count in counts:
+        fd, path = tempfile.mkstemp(suffix='-primary.xml')
+        os.close(fd)
+        try:
+            generate(path, count)
+            for mode in ('stream', 'tree'):
+                out = subprocess.check_output(
+                    [sys.executable, __file__, '--measure', mode, path])
+                mode, parsed, maxrss, elapsed = out.split()
+                print("%-8s %10s %14s %10s" % (mode, parsed, maxrss,
+                                               elapsed))
+        finally:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main([int(x) for x in sys.argv[1:]] or [1000, 10000, 100000])